@@ -4,9 +4,10 @@ Dashboard, user management, model management, and ComfyUI operations
 """
 
 import os
+import time
 import subprocess
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 from pathlib import Path
 
@@ -20,9 +21,13 @@ import json
 import asyncio
 from sse_starlette.sse import EventSourceResponse
 
-from database import db
+from database import db, page_cursors, principal_cache, api_key_cache, USER_SORTS
 from auth import get_current_admin
 from wallet import manual_adjust_rcc, get_balance
+from reconciler import credit_reconciler
+from docker_manager import docker_manager, lifecycle
+from gpu_monitor import gpu_sampler, gpu_usage_recorder, gpu_metric_rollup, gpu_live, lttb
+from usage_stats import get_usage_stats, percentile
 
 load_dotenv()
 
@@ -72,38 +77,87 @@ MODEL_TYPES = {
 # Dashboard
 # ============================================
 
+# Dashboard tiles are served from this cache; older than the TTL triggers a background refresh
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "15"))
+
+
+class DashboardKPICache:
+    """
+    Short-TTL cache for dashboard KPIs, model count and ComfyUI probe.
+    A refresh runs the KPI query, the models directory scan and the ComfyUI
+    probe concurrently. Stale values are served while a single background
+    refresh runs, so page views never wait on ComfyUI once the cache is warm.
+    """
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value: Optional[dict] = None
+        self._updated_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+    
+    async def _compute(self) -> dict:
+        kpis, models, comfyui = await asyncio.gather(
+            db.get_dashboard_kpis(),
+            asyncio.to_thread(list_models_in_directory),
+            probe_comfyui()
+        )
+        return {"stats": {**kpis, "models_count": len(models)}, "comfyui": comfyui}
+    
+    async def _run_refresh(self):
+        try:
+            self._value = await self._compute()
+            self._updated_at = time.monotonic()
+        except Exception as e:
+            # Keep serving the last good value
+            print(f"[WARNING] Dashboard KPI refresh failed: {e}")
+        finally:
+            self._refreshing = None
+    
+    def refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already running"""
+        if self._refreshing is None:
+            self._refreshing = asyncio.create_task(self._run_refresh())
+        return self._refreshing
+    
+    async def get(self) -> dict:
+        if self._value is None:
+            await asyncio.shield(self.refresh())
+            if self._value is None:
+                raise HTTPException(status_code=503, detail="Dashboard statistics are unavailable")
+        elif time.monotonic() - self._updated_at > self.ttl:
+            self.refresh()
+        return self._value
+    
+    def close(self):
+        """Cancel an in-flight refresh (on shutdown)"""
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+            self._refreshing = None
+
+
+dashboard_kpis = DashboardKPICache(DASHBOARD_CACHE_TTL)
+
+
 @router.get("/dashboard", response_class=HTMLResponse)
 async def admin_dashboard(request: Request, current_user: dict = Depends(get_current_admin)):
-    """Admin dashboard with KPIs"""
-    now = datetime.utcnow()
-    last_24h = now - timedelta(hours=24)
-    last_7d = now - timedelta(days=7)
-    
-    # Gather stats
-    stats = {
-        "total_users": await db.count_users(),
-        "total_jobs_24h": await db.count_jobs(since=last_24h),
-        "total_jobs_7d": await db.count_jobs(since=last_7d),
-        "rcc_consumed_24h": await db.get_total_rcc_consumed(since=last_24h),
-        "rcc_consumed_7d": await db.get_total_rcc_consumed(since=last_7d),
-        "failed_jobs_24h": await db.count_failed_jobs(since=last_24h),
-        "models_count": len(list_models_in_directory())
+    """Admin dashboard with KPIs (cached, see DashboardKPICache)"""
+    cached, recent_jobs, recent_logs, public_port = await asyncio.gather(
+        dashboard_kpis.get(),
+        db.get_all_jobs(limit=10),
+        db.get_logs(limit=10),
+        get_comfyui_public_port()
+    )
+    comfyui_status = {
+        **cached["comfyui"],
+        "url": await get_comfyui_public_url(request, public_port),
+        "port": public_port
     }
     
-    # Recent jobs
-    recent_jobs = await db.get_all_jobs(limit=10)
-    
-    # Recent logs
-    recent_logs = await db.get_logs(limit=10)
-    
-    # ComfyUI status
-    comfyui_status = await get_comfyui_status(request)
-    
     return templates.TemplateResponse("admin/dashboard.html", {
         "request": request,
         "user": current_user,
         "messages": [],
-        "stats": stats,
+        "stats": cached["stats"],
         "recent_jobs": recent_jobs,
         "recent_logs": recent_logs,
         "comfyui_status": comfyui_status
@@ -118,31 +172,43 @@ async def admin_dashboard(request: Request, current_user: dict = Depends(get_cur
 async def admin_users_list(
     request: Request,
     current_user: dict = Depends(get_current_admin),
-    page: int = 1,
-    per_page: int = 20
+    cursor: Optional[str] = None,
+    per_page: int = 20,
+    sort: str = "newest",
+    min_balance: Optional[str] = None,
+    max_balance: Optional[str] = None
 ):
-    """List all users with their RCC balance"""
-    offset = (page - 1) * per_page
-    users = await db.get_all_users(limit=per_page, offset=offset)
-    
-    # Add balance to each user
-    users_with_balance = []
-    for user in users:
-        balance = await get_balance(user["id"])
-        users_with_balance.append({**user, "rcc_balance": balance})
+    """List all users with their RCC balance (sorted and filtered in the database)"""
+    if sort not in USER_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Use one of: {', '.join(USER_SORTS)}")
+    try:
+        # Blank form fields arrive as empty strings
+        min_balance = int(min_balance) if min_balance else None
+        max_balance = int(max_balance) if max_balance else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="min_balance/max_balance must be integers")
+    try:
+        users = await db.get_users_with_balances(
+            limit=per_page, cursor=cursor, sort=sort,
+            min_balance=min_balance, max_balance=max_balance
+        )
+        cursors = page_cursors(users, per_page, cursor, key=USER_SORTS[sort][0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     total_users = await db.count_users()
-    total_pages = (total_users + per_page - 1) // per_page
     
     return templates.TemplateResponse("admin/users.html", {
         "request": request,
         "user": current_user,
         "messages": [],
-        "users": users_with_balance,
-        "page": page,
+        "users": users,
         "per_page": per_page,
-        "total_pages": total_pages,
-        "total_users": total_users
+        "total_users": total_users,
+        "sort": sort,
+        "min_balance": min_balance,
+        "max_balance": max_balance,
+        **cursors
     })
 
 
@@ -215,12 +281,19 @@ async def admin_toggle_user_admin(
     await db.add_log(
         action="admin_toggle",
         user_id=current_user["id"],
-        details=f"Set user {user_id} admin status to {new_admin_status}"
+        details=f"Set user {user_id} admin status to {new_admin_status}",
+        sync=True
     )
     
     return RedirectResponse(url=f"/admin/users/{user_id}", status_code=303)
 
 
+@router.get("/auth/cache")
+async def admin_auth_cache_stats(current_user: dict = Depends(get_current_admin)):
+    """Principal and API key cache sizes and hit/miss counters for this worker"""
+    return {"principals": principal_cache.stats(), "api_keys": api_key_cache.stats()}
+
+
 # ============================================
 # Jobs Management
 # ============================================
@@ -229,27 +302,28 @@ async def admin_toggle_user_admin(
 async def admin_jobs_list(
     request: Request,
     current_user: dict = Depends(get_current_admin),
-    page: int = 1,
+    cursor: Optional[str] = None,
     per_page: int = 20,
     status: Optional[str] = None
 ):
     """List all jobs"""
-    offset = (page - 1) * per_page
-    jobs = await db.get_all_jobs(limit=per_page, offset=offset, status=status)
+    try:
+        jobs = await db.get_all_jobs(limit=per_page, status=status, cursor=cursor)
+        cursors = page_cursors(jobs, per_page, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     total_jobs = await db.count_jobs()
-    total_pages = (total_jobs + per_page - 1) // per_page
     
     return templates.TemplateResponse("admin/jobs.html", {
         "request": request,
         "user": current_user,
         "messages": [],
         "jobs": jobs,
-        "page": page,
         "per_page": per_page,
-        "total_pages": total_pages,
         "total_jobs": total_jobs,
-        "status_filter": status
+        "status_filter": status,
+        **cursors
     })
 
 
@@ -261,22 +335,25 @@ async def admin_jobs_list(
 async def admin_logs_list(
     request: Request,
     current_user: dict = Depends(get_current_admin),
-    page: int = 1,
+    cursor: Optional[str] = None,
     per_page: int = 50,
     action: Optional[str] = None
 ):
     """View system logs"""
-    offset = (page - 1) * per_page
-    logs = await db.get_logs(limit=per_page, offset=offset, action=action)
+    try:
+        logs = await db.get_logs(limit=per_page, action=action, cursor=cursor)
+        cursors = page_cursors(logs, per_page, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return templates.TemplateResponse("admin/logs.html", {
         "request": request,
         "user": current_user,
         "messages": [],
         "logs": logs,
-        "page": page,
         "per_page": per_page,
-        "action_filter": action
+        "action_filter": action,
+        **cursors
     })
 
 
@@ -761,44 +838,45 @@ async def admin_delete_model(
 # ComfyUI Operations
 # ============================================
 
-async def get_comfyui_public_url(request: Request) -> str:
+async def get_comfyui_public_port() -> int:
+    """Public ComfyUI port from database setting, fallback to env var"""
+    public_port = await db.get_setting("comfyui_public_port")
+    return int(public_port) if public_port else COMFYUI_PUBLIC_PORT
+
+
+async def get_comfyui_public_url(request: Request, port: Optional[int] = None) -> str:
     """Build public ComfyUI URL from request host"""
     # Get the host from the request (e.g., remote.ranchcomputing.com)
     host = request.headers.get("host", "localhost").split(":")[0]
     scheme = request.headers.get("x-forwarded-proto", "http")
-    # Get public port from database setting, fallback to env var
-    public_port = await db.get_setting("comfyui_public_port")
-    port = int(public_port) if public_port else COMFYUI_PUBLIC_PORT
+    port = port or await get_comfyui_public_port()
     return f"{scheme}://{host}:{port}"
 
 
-async def get_comfyui_status(request: Request = None) -> dict:
-    """Check ComfyUI container/service status"""
-    # Get public port from database setting, fallback to env var
-    public_port_str = await db.get_setting("comfyui_public_port") if request else None
-    public_port = int(public_port_str) if public_port_str else COMFYUI_PUBLIC_PORT
-    public_url = await get_comfyui_public_url(request) if request else f"http://localhost:{public_port}"
-    
+async def probe_comfyui(timeout: float = 5.0) -> dict:
+    """Probe the ComfyUI service (running flag and system_stats details)"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
+        async with httpx.AsyncClient(timeout=timeout) as client:
             response = await client.get(f"{COMFYUI_INTERNAL_URL}/system_stats")
             if response.status_code == 200:
-                return {
-                    "running": True,
-                    "url": public_url,
-                    "internal_url": COMFYUI_INTERNAL_URL,
-                    "port": public_port,
-                    "details": response.json()
-                }
+                return {"running": True, "internal_url": COMFYUI_INTERNAL_URL, "details": response.json()}
     except:
         pass
+    return {"running": False, "internal_url": COMFYUI_INTERNAL_URL, "details": None}
+
+
+async def get_comfyui_status(request: Request = None) -> dict:
+    """Check ComfyUI container/service status"""
+    public_port = await get_comfyui_public_port() if request else COMFYUI_PUBLIC_PORT
+    public_url = await get_comfyui_public_url(request, public_port) if request else f"http://localhost:{public_port}"
     
+    status = await probe_comfyui()
     return {
-        "running": False,
+        "running": status["running"],
         "url": public_url,
-        "internal_url": COMFYUI_INTERNAL_URL,
+        "internal_url": status["internal_url"],
         "port": public_port,
-        "details": None
+        "details": status["details"]
     }
 
 
@@ -808,6 +886,62 @@ async def admin_comfyui_status(request: Request, current_user: dict = Depends(ge
     return await get_comfyui_status(request)
 
 
+@router.get("/comfyui/reconciler")
+async def admin_comfyui_reconciler(current_user: dict = Depends(get_current_admin)):
+    """Credit reconciler counters (auto-stops of ComfyUI for users without credits)"""
+    return credit_reconciler.stats()
+
+
+STARTUP_PHASES = ("prepare", "image", "create", "start", "first_log", "ready", "total")
+
+
+def summarize_startups(attempts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Outcome counts plus p50/p90/p99/max per phase over the given start attempts"""
+    outcomes: Dict[str, int] = {}
+    for attempt in attempts:
+        outcomes[attempt["outcome"]] = outcomes.get(attempt["outcome"], 0) + 1
+    
+    phases = {}
+    for phase in STARTUP_PHASES:
+        values = sorted(a[f"{phase}_seconds"] for a in attempts if a.get(f"{phase}_seconds") is not None)
+        if values:
+            phases[phase] = {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 3),
+                "p90": round(percentile(values, 90), 3),
+                "p99": round(percentile(values, 99), 3),
+                "max": round(values[-1], 3),
+            }
+    
+    pulls = [a for a in attempts if a.get("image_pulled") and a.get("pull_bytes") and a.get("image_seconds")]
+    pull_mbps = sorted(a["pull_bytes"] / 1e6 / a["image_seconds"] for a in pulls)
+    return {
+        "attempts": len(attempts),
+        "outcomes": outcomes,
+        "phases": phases,
+        "pulls": len(pulls),
+        "pull_mb_per_s_p50": round(percentile(pull_mbps, 50), 1) if pull_mbps else None,
+    }
+
+
+@router.get("/comfyui/lifecycle")
+async def admin_comfyui_lifecycle(current_user: dict = Depends(get_current_admin)):
+    """Idle shutdown / pre-warm counters, cold vs warm starts and idle GPU minutes saved"""
+    return lifecycle.stats()
+
+
+@router.get("/comfyui/startups")
+async def admin_comfyui_startups(limit: int = 100, current_user: dict = Depends(get_current_admin)):
+    """Recent ComfyUI start attempts with per-phase timings, and percentiles over them"""
+    attempts = await db.get_comfyui_startups(limit=max(1, min(limit, 1000)))
+    current = docker_manager.current_startup
+    return {
+        "in_progress": current.as_row() if current and not current.finished else None,
+        "summary": summarize_startups(attempts),
+        "attempts": attempts,
+    }
+
+
 @router.post("/comfyui/start")
 async def admin_start_comfyui(
     request: Request,
@@ -820,7 +954,9 @@ async def admin_start_comfyui(
         env = os.environ.copy()
         env["HOST_PROJECT_DIR"] = host_project_dir
         
-        result = subprocess.run(
+        # docker compose can take tens of seconds; keep it off the event loop
+        result = await asyncio.to_thread(
+            subprocess.run,
             "docker compose -f docker-compose-comfyui.yml up -d",
             cwd=os.path.dirname(os.path.abspath(__file__)),
             capture_output=True,
@@ -829,6 +965,9 @@ async def admin_start_comfyui(
             env=env
         )
         
+        if result.returncode == 0:
+            await credit_reconciler.set_owner(current_user["id"])
+        
         await db.add_log(
             action="comfyui_start",
             user_id=current_user["id"],
@@ -860,7 +999,9 @@ async def admin_stop_comfyui(
         env = os.environ.copy()
         env["HOST_PROJECT_DIR"] = host_project_dir
         
-        result = subprocess.run(
+        # docker compose can take tens of seconds; keep it off the event loop
+        result = await asyncio.to_thread(
+            subprocess.run,
             "docker compose -f docker-compose-comfyui.yml stop",
             cwd=os.path.dirname(os.path.abspath(__file__)),
             capture_output=True,
@@ -869,6 +1010,9 @@ async def admin_stop_comfyui(
             env=env
         )
         
+        if result.returncode == 0:
+            await credit_reconciler.set_owner(None)
+        
         await db.add_log(
             action="comfyui_stop",
             user_id=current_user["id"],
@@ -900,7 +1044,9 @@ async def admin_restart_comfyui(
         env = os.environ.copy()
         env["HOST_PROJECT_DIR"] = host_project_dir
         
-        result = subprocess.run(
+        # docker compose can take tens of seconds; keep it off the event loop
+        result = await asyncio.to_thread(
+            subprocess.run,
             "docker compose -f docker-compose-comfyui.yml restart",
             cwd=os.path.dirname(os.path.abspath(__file__)),
             capture_output=True,
@@ -909,6 +1055,9 @@ async def admin_restart_comfyui(
             env=env
         )
         
+        if result.returncode == 0:
+            await credit_reconciler.set_owner(current_user["id"])
+        
         await db.add_log(
             action="comfyui_restart",
             user_id=current_user["id"],
@@ -966,7 +1115,8 @@ async def update_admin_settings(
             action="settings_update",
             user_id=current_user["id"],
             ip=request.client.host if request.client else None,
-            details=f"Updated comfyui_public_port to {port}"
+            details=f"Updated comfyui_public_port to {port}",
+            sync=True
         )
     
     return {"success": True, "message": "Settings updated"}
@@ -977,67 +1127,8 @@ async def update_admin_settings(
 # ============================================
 
 async def get_live_gpu_stats() -> Dict[str, Any]:
-    """Get live GPU stats from the ComfyUI Docker container using nvidia-smi"""
-    try:
-        # Query nvidia-smi inside the Docker container
-        result = subprocess.run(
-            [
-                "docker", "exec", "comfyui", "nvidia-smi",
-                "--query-gpu=index,name,memory.used,memory.total,utilization.gpu,utilization.memory,temperature.gpu,power.draw",
-                "--format=csv,noheader,nounits"
-            ],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode != 0:
-            # Try without docker (for local nvidia-smi)
-            result = subprocess.run(
-                [
-                    "nvidia-smi",
-                    "--query-gpu=index,name,memory.used,memory.total,utilization.gpu,utilization.memory,temperature.gpu,power.draw",
-                    "--format=csv,noheader,nounits"
-                ],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-        
-        if result.returncode != 0:
-            return {"available": False, "error": "nvidia-smi not available", "gpus": []}
-        
-        gpus = []
-        for line in result.stdout.strip().split("\n"):
-            if not line.strip():
-                continue
-            parts = [p.strip() for p in line.split(",")]
-            if len(parts) >= 8:
-                try:
-                    gpus.append({
-                        "id": int(parts[0]),
-                        "name": parts[1],
-                        "memory_used_mb": int(float(parts[2])),
-                        "memory_total_mb": int(float(parts[3])),
-                        "gpu_utilization": int(float(parts[4])),
-                        "memory_utilization": int(float(parts[5])),
-                        "temperature_c": int(float(parts[6])),
-                        "power_draw_w": float(parts[7]) if parts[7] != "[N/A]" else None
-                    })
-                except (ValueError, IndexError):
-                    continue
-        
-        return {
-            "available": True,
-            "gpus": gpus,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-    except subprocess.TimeoutExpired:
-        return {"available": False, "error": "Timeout querying GPU stats", "gpus": []}
-    except FileNotFoundError:
-        return {"available": False, "error": "nvidia-smi not found", "gpus": []}
-    except Exception as e:
-        return {"available": False, "error": str(e), "gpus": []}
+    """Latest GPU sample from the background sampler (no nvidia-smi call per request)"""
+    return gpu_sampler.latest()
 
 
 @router.get("/gpu/live")
@@ -1046,23 +1137,112 @@ async def admin_gpu_live_stats(current_user: dict = Depends(get_current_admin)):
     return await get_live_gpu_stats()
 
 
+@router.get("/gpu/live/stream")
+async def admin_gpu_live_stream(request: Request, current_user: dict = Depends(get_current_admin)):
+    """
+    SSE feed of the live GPU ring buffer: a "samples" event with the whole window
+    (reset: true), then one per new sample with only that sample. Each event id is
+    the sequence to resume from (Last-Event-ID). A "status" event reports the
+    sampler state when no sample arrives for a while (GPU unavailable).
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    
+    async def generate_samples():
+        after = int(last_event_id) if last_event_id.isdigit() else None
+        queue = gpu_live.subscribe()
+        try:
+            while True:
+                if after != gpu_live.seq:
+                    data = gpu_live.delta_json(after)
+                    after = gpu_live.seq
+                    yield {"event": "samples", "id": str(after), "data": data}
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=max(5, 3 * gpu_sampler.interval))
+                except asyncio.TimeoutError:
+                    yield {"event": "status", "data": json.dumps(gpu_sampler.latest())}
+        finally:
+            gpu_live.unsubscribe(queue)
+    
+    return EventSourceResponse(generate_samples())
+
+
+@router.get("/gpu/sampler")
+async def admin_gpu_sampler(current_user: dict = Depends(get_current_admin)):
+    """GPU sampler backend, interval and counters, plus per-job attribution counters"""
+    return {
+        **gpu_sampler.stats(),
+        "attribution": gpu_usage_recorder.stats(),
+        "rollups": gpu_metric_rollup.stats(),
+        "live": gpu_live.stats(),
+    }
+
+
 @router.get("/gpu/stats")
 async def admin_gpu_usage_stats(
     user_id: Optional[int] = None,
     days: int = 30,
+    hours: Optional[float] = None,
     current_user: dict = Depends(get_current_admin)
 ):
-    """Get GPU usage statistics from database"""
-    return await db.get_gpu_usage_stats(user_id=user_id, days=days)
+    """Get GPU usage statistics from database (hours, when given, overrides days)"""
+    return await db.get_gpu_usage_stats(user_id=user_id, days=days, hours=hours)
 
 
 @router.get("/gpu/by-user")
 async def admin_gpu_usage_by_user(
     days: int = 30,
+    hours: Optional[float] = None,
     current_user: dict = Depends(get_current_admin)
 ):
     """Get GPU usage aggregated by user"""
-    return await db.get_gpu_usage_by_user(days=days)
+    return await db.get_gpu_usage_by_user(days=days, hours=hours)
+
+
+# Metrics charted by /admin/gpu/series
+GPU_SERIES_METRICS = ("gpu_utilization", "memory_used_mb", "power_draw_w", "temperature_max_c")
+
+
+def _bucket_epoch(bucket: str) -> int:
+    """Unix seconds of a rollup bucket (SQLite buckets are naive UTC)"""
+    moment = datetime.fromisoformat(bucket)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+@router.get("/gpu/series")
+async def admin_gpu_series(
+    hours: float = 24,
+    gpu_id: int = 0,
+    points: int = 300,
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    GPU metric chart series from the rollups: [unix seconds, value] pairs per metric,
+    downsampled with LTTB to at most `points` whatever the window length
+    """
+    data = await db.get_gpu_metric_series(gpu_id=gpu_id, hours=max(hours, 1 / 60))
+    points = max(3, min(points, 2000))
+    series = {}
+    for metric in GPU_SERIES_METRICS:
+        values = [(_bucket_epoch(p["bucket"]), p[metric]) for p in data["points"] if p[metric] is not None]
+        series[metric] = lttb(values, points)
+    return {
+        "gpu_id": gpu_id,
+        "resolution": data["resolution"],
+        "since": data["since"],
+        "buckets": len(data["points"]),
+        "series": series,
+    }
+
+
+@router.get("/stats/percentiles")
+async def admin_usage_percentiles(days: float = 7, current_user: dict = Depends(get_current_admin)):
+    """
+    p50/p95/p99, histograms and per job type / per user aggregates of job duration_ms
+    and of gpu_usage utilisation and memory over the last `days`
+    """
+    return await get_usage_stats(days=max(1 / 24, min(days, 365)))
 
 
 @router.post("/gpu/log")
@@ -5,6 +5,8 @@ Portal for ComfyUI SaaS with RCC monetization
 
 import os
 import io
+import json
+import asyncio
 import mimetypes
 from datetime import datetime, timedelta
 from typing import Optional, List
@@ -15,28 +17,31 @@ BASE_DIR = Path(__file__).resolve().parent
 OUTPUT_DIR = BASE_DIR / "storage-user" / "output"
 THUMBNAIL_DIR = BASE_DIR / "storage-user" / ".thumbnails"
 
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Form
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
 from dotenv import load_dotenv
+from sse_starlette.sse import EventSourceResponse
 
 # Load environment variables
 load_dotenv()
 
 # Import modules
-from database import db, init_db, JobType, JobStatus
+from database import db, init_db, close_db, start_log_buffer, page_cursors, JobType, JobStatus
 from auth import (
     get_current_user, get_current_user_optional, get_current_admin,
-    authenticate_user, register_user, create_user_token
+    authenticate_user, register_user, create_user_token, password_hasher,
+    require_api_scope, create_api_key
 )
 from auth_gitlab import gitlab_login, gitlab_callback, gitlab_logout
 from wallet import (
-    get_balance, reserve_rcc, release_rcc, get_rcc_history,
+    get_balance, reserve_rcc, create_reserved_job, release_rcc, get_rcc_history,
     get_job_cost, get_topup_packs, get_subscription_plans,
     get_credit_pricing, update_credit_pricing, set_charge_mode,
-    process_task_completion, should_charge_on_creation
+    process_task_completion, should_charge_on_creation,
+    run_ledger_compactor
 )
 from payment import (
     create_topup_checkout, create_subscription_checkout,
@@ -47,14 +52,17 @@ from schemas import (
     RCCBalance, RCCHistory, TopupCheckoutRequest, SubscriptionCheckoutRequest,
     CheckoutSessionResponse, MessageResponse, MeResponse,
     CreditPricingConfig, CreditPricingUpdate, ChargeModeUpdate,
-    TaskCompletionRequest, TaskCompletionResponse
+    TaskCompletionRequest, TaskCompletionResponse,
+    ApiKeyCreate, ApiKeyInfo, ApiKeyCreated
 )
 
 # Import admin router
-from admin import router as admin_router
+from admin import router as admin_router, dashboard_kpis
 
 # Import Docker manager for ComfyUI control
-from docker_manager import docker_manager
+from docker_manager import docker_manager, startup_log, lifecycle
+from reconciler import credit_reconciler
+from gpu_monitor import gpu_sampler, gpu_usage_recorder, gpu_metric_rollup
 
 # ============================================
 # FastAPI App Configuration
@@ -84,12 +92,31 @@ app.include_router(admin_router)
 async def startup_event():
     """Initialize database and services on startup"""
     init_db()
+    start_log_buffer()
+    app.state.ledger_compactor = asyncio.create_task(run_ledger_compactor())
+    dashboard_kpis.refresh()
+    credit_reconciler.start()
+    docker_manager.watch()
+    lifecycle.start()
+    gpu_sampler.start()
+    gpu_usage_recorder.start()
+    gpu_metric_rollup.start()
     print("✅ ComfyUI Manager started")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    app.state.ledger_compactor.cancel()
+    await credit_reconciler.stop()
+    await lifecycle.stop()
+    await gpu_sampler.stop()
+    await gpu_usage_recorder.stop()
+    await gpu_metric_rollup.stop()
+    await docker_manager.stop_watching()
+    dashboard_kpis.close()
+    await close_db()
+    password_hasher.close()
     print("🛑 ComfyUI Manager shutting down")
 
 
@@ -163,7 +190,17 @@ async def login_form(
     password: str = Form(...)
 ):
     """Login via form (for web UI)"""
-    user = await authenticate_user(email, password)
+    try:
+        user = await authenticate_user(email, password)
+    except HTTPException as e:
+        if e.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+            raise
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "user": None,
+            "messages": [],
+            "error": e.detail
+        }, status_code=e.status_code, headers=e.headers)
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
@@ -182,25 +219,10 @@ async def login_form(
         details=f"User login: {user['email']}"
     )
     
-    # Check balance and stop ComfyUI service if empty (to avoid resource usage without credits)
-    user_balance = await get_balance(user["id"])
-    if user_balance <= 0:
-        try:
-            status = await docker_manager.get_status()
-            if status.get("status") == "running":
-                await docker_manager.stop()
-                await db.add_log(
-                    action="comfyui_auto_stop",
-                    user_id=user["id"],
-                    details=f"ComfyUI stopped on login - no credits available"
-                )
-        except Exception as e:
-            # Log but don't block login
-            await db.add_log(
-                action="comfyui_auto_stop_failed",
-                user_id=user["id"],
-                details=f"Failed to auto-stop ComfyUI: {str(e)}"
-            )
+    # Stopping ComfyUI when the user has no credits happens in the background reconciler
+    credit_reconciler.check_user(user["id"])
+    # The day's first login pre-warms ComfyUI (also in the background)
+    lifecycle.note_login(user["id"])
     
     # Redirect with cookie
     response = RedirectResponse(url="/dashboard", status_code=303)
@@ -244,8 +266,7 @@ async def dev_admin_login():
         
         if not user:
             # Create dev admin user
-            from auth import get_password_hash
-            password_hash = get_password_hash("admin123")
+            password_hash = await password_hasher.hash("admin123")
             user = await db.create_user(email=email, password_hash=password_hash, is_admin=True)
         elif not user.get("is_admin"):
             # Make sure they're admin
@@ -365,12 +386,59 @@ async def user_dashboard(request: Request, current_user: dict = Depends(get_curr
     })
 
 
+# ============================================
+# API Key Routes
+# ============================================
+
+def api_key_info(record: dict) -> dict:
+    return {**record, "scopes": record["scopes"].split(",")}
+
+
+@app.post("/api-keys", response_model=ApiKeyCreated)
+async def create_user_api_key(
+    key_data: ApiKeyCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    """Create a long-lived API key for automation. The key is only returned once."""
+    key, record = await create_api_key(
+        current_user["id"], key_data.name, key_data.scopes, key_data.expires_in_days
+    )
+    await db.add_log(
+        action="api_key_created",
+        user_id=current_user["id"],
+        details=f"API key {record['prefix']} ({record['scopes']})",
+        sync=True
+    )
+    return {**api_key_info(record), "key": key}
+
+
+@app.get("/api-keys", response_model=List[ApiKeyInfo])
+async def list_user_api_keys(current_user: dict = Depends(get_current_user)):
+    """List the current user's API keys"""
+    return [api_key_info(record) for record in await db.get_user_api_keys(current_user["id"])]
+
+
+@app.delete("/api-keys/{key_id}", response_model=MessageResponse)
+async def revoke_user_api_key(key_id: int, current_user: dict = Depends(get_current_user)):
+    """Revoke one of the current user's API keys"""
+    record = await db.revoke_api_key(current_user["id"], key_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="API key not found")
+    await db.add_log(
+        action="api_key_revoked",
+        user_id=current_user["id"],
+        details=f"API key {record['prefix']}",
+        sync=True
+    )
+    return MessageResponse(message="API key revoked")
+
+
 # ============================================
 # RCC Wallet Routes
 # ============================================
 
 @app.get("/wallet/balance", response_model=RCCBalance)
-async def get_wallet_balance(current_user: dict = Depends(get_current_user)):
+async def get_wallet_balance(current_user: dict = Depends(require_api_scope("wallet:read"))):
     """Get current RCC balance"""
     balance = await get_balance(current_user["id"])
     return RCCBalance(user_id=current_user["id"], balance=balance)
@@ -378,13 +446,14 @@ async def get_wallet_balance(current_user: dict = Depends(get_current_user)):
 
 @app.get("/wallet/history", response_model=RCCHistory)
 async def get_wallet_history(
-    current_user: dict = Depends(get_current_user),
+    current_user: dict = Depends(require_api_scope("wallet:read")),
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ):
-    """Get RCC transaction history"""
-    history = await get_rcc_history(current_user["id"], limit=limit, offset=offset)
-    return RCCHistory(entries=history["entries"], balance=history["balance"])
+    """Get RCC transaction history (pass next_cursor/prev_cursor back as `cursor` to page)"""
+    history = await get_rcc_history(current_user["id"], limit=limit, offset=offset, cursor=cursor)
+    return RCCHistory(**history)
 
 
 # ============================================
@@ -437,7 +506,8 @@ async def update_pricing_config(
         await db.add_log(
             action="pricing_updated",
             user_id=current_user["id"],
-            details=f"Updated {update.job_type}: base_cost={update.base_cost}, multiplier={update.multiplier}"
+            details=f"Updated {update.job_type}: base_cost={update.base_cost}, multiplier={update.multiplier}",
+            sync=True
         )
         
         return {
@@ -465,7 +535,8 @@ async def update_charge_mode(
         await db.add_log(
             action="charge_mode_updated",
             user_id=current_user["id"],
-            details=f"Changed charge mode to: {update.mode}"
+            details=f"Changed charge mode to: {update.mode}",
+            sync=True
         )
         
         return {
@@ -480,7 +551,7 @@ async def update_charge_mode(
 @app.post("/tasks/complete", response_model=TaskCompletionResponse)
 async def process_completion(
     request: TaskCompletionRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_api_scope("jobs:write"))
 ):
     """
     Process a task completion and charge credits if configured.
@@ -505,6 +576,8 @@ async def process_completion(
         is_admin=job.get("admin_bypass", False),
         task_success=request.success
     )
+    gpu_usage_recorder.job_finished(request.job_id)
+    lifecycle.note_activity()
     
     return TaskCompletionResponse(**result)
 
@@ -516,7 +589,7 @@ async def process_completion(
 @app.post("/jobs", response_model=JobResponse)
 async def create_job(
     job_data: JobCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_api_scope("jobs:write"))
 ):
     """
     Create a new compute job.
@@ -530,32 +603,40 @@ async def create_job(
     
     # Get job cost (uses base_cost * multiplier)
     cost = get_job_cost(job_data.type)
-    
-    # Create job record
-    job = await db.create_job(
-        user_id=user_id,
-        job_type=job_data.type,
-        cost_rcc=cost,
-        admin_bypass=is_admin,
-        metadata=str(job_data.metadata) if job_data.metadata else None
-    )
-    
-    if not job:
-        raise HTTPException(status_code=500, detail="Failed to create job")
-    
-    # Reserve RCC only if charging on creation (or log admin bypass)
-    if should_charge_on_creation():
-        try:
+    metadata = str(job_data.metadata) if job_data.metadata else None
+    
+    if should_charge_on_creation() and not is_admin:
+        # Create the job and reserve RCC in one transaction
+        # (raises 402 without creating the job if the balance is insufficient)
+        job = await create_reserved_job(
+            user_id=user_id,
+            job_type=job_data.type,
+            metadata=metadata
+        )
+    else:
+        # Create job record
+        job = await db.create_job(
+            user_id=user_id,
+            job_type=job_data.type,
+            cost_rcc=cost,
+            admin_bypass=is_admin,
+            metadata=metadata
+        )
+        
+        if job and should_charge_on_creation():
+            # Admin bypass - log the ADMIN_BYPASS ledger entry
             await reserve_rcc(
                 user_id=user_id,
                 job_id=job["id"],
                 job_type=job_data.type,
                 is_admin=is_admin
             )
-        except HTTPException as e:
-            # If reservation fails (insufficient balance), delete the job
-            # In a real implementation, you'd use a transaction
-            raise e
+    
+    if not job:
+        raise HTTPException(status_code=500, detail="Failed to create job")
+    
+    # Jobs keep ComfyUI from idling out; queued while it is down, they pre-warm it
+    lifecycle.note_activity(wake=True)
     
     # Log job creation
     charge_mode = "on_creation" if should_charge_on_creation() else "on_completion"
@@ -570,17 +651,30 @@ async def create_job(
 
 @app.get("/jobs", response_model=list)
 async def list_jobs(
-    current_user: dict = Depends(get_current_user),
+    response: Response,
+    current_user: dict = Depends(require_api_scope("jobs:read")),
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ):
-    """List user's jobs"""
-    jobs = await db.get_user_jobs(current_user["id"], limit=limit, offset=offset)
+    """
+    List user's jobs, newest first.
+    Page cursors are returned in the X-Next-Cursor (older) and X-Prev-Cursor (newer) headers.
+    """
+    try:
+        jobs = await db.get_user_jobs(current_user["id"], limit=limit, offset=offset, cursor=cursor)
+        cursors = page_cursors(jobs, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if cursors["next_cursor"]:
+        response.headers["X-Next-Cursor"] = cursors["next_cursor"]
+    if cursors["prev_cursor"]:
+        response.headers["X-Prev-Cursor"] = cursors["prev_cursor"]
     return jobs
 
 
 @app.get("/jobs/{job_id}", response_model=JobResponse)
-async def get_job(job_id: int, current_user: dict = Depends(get_current_user)):
+async def get_job(job_id: int, current_user: dict = Depends(require_api_scope("jobs:read"))):
     """Get job details"""
     job = await db.get_job(job_id)
     
@@ -599,7 +693,7 @@ async def update_job_status(
     job_id: int,
     status: JobStatus,
     output_uri: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_api_scope("jobs:write"))
 ):
     """
     Update job status.
@@ -633,6 +727,13 @@ async def update_job_status(
     # Update job
     updated_job = await db.update_job(job_id, **update_data)
     
+    # GPU samples are attributed to the job while it runs; its usage row is written when it ends
+    if status == JobStatus.RUNNING:
+        gpu_usage_recorder.job_started(job_id, job["user_id"])
+    elif status in [JobStatus.SUCCEEDED, JobStatus.FAILED]:
+        gpu_usage_recorder.job_finished(job_id)
+    lifecycle.note_activity()
+    
     # Handle credit operations based on job status and charge mode
     if status == JobStatus.SUCCEEDED and not job.get("admin_bypass"):
         # If charging on completion, process the charge now
@@ -766,9 +867,8 @@ async def get_stripe_key():
 # ComfyUI Docker Control Routes
 # ============================================
 
-@app.get("/comfyui/status")
-async def comfyui_status(request: Request, current_user: dict = Depends(get_current_user)):
-    """Get ComfyUI container status (requires authentication)"""
+async def get_public_comfyui_status(request: Request) -> dict:
+    """Container status with the public URL built from the request host"""
     status = await docker_manager.get_status()
     
     # Build public URL from request host if running
@@ -784,9 +884,37 @@ async def comfyui_status(request: Request, current_user: dict = Depends(get_curr
     return status
 
 
+@app.get("/comfyui/status")
+async def comfyui_status(request: Request, current_user: dict = Depends(get_current_user)):
+    """Get ComfyUI container status (requires authentication)"""
+    return await get_public_comfyui_status(request)
+
+
+@app.get("/comfyui/status/stream")
+async def comfyui_status_stream(request: Request, current_user: dict = Depends(get_current_user)):
+    """SSE stream of ComfyUI container status: the current status, then every change"""
+    async def generate_status():
+        queue = docker_manager.subscribe()
+        try:
+            while True:
+                yield {"event": "status", "data": json.dumps(await get_public_comfyui_status(request))}
+                await queue.get()
+        finally:
+            docker_manager.unsubscribe(queue)
+    
+    return EventSourceResponse(generate_status())
+
+
 @app.post("/comfyui/start")
-async def comfyui_start(current_user: dict = Depends(get_current_user)):
-    """Start ComfyUI container (requires authentication and credits)"""
+async def comfyui_start(
+    wait: bool = False,
+    timeout: float = 60,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Start ComfyUI container (requires authentication and credits).
+    With ?wait=true the response is held until ComfyUI answers requests (or `timeout` seconds).
+    """
     # Check if user has credits (admins bypass this check)
     if not current_user.get("is_admin", False):
         balance = await get_balance(current_user["id"])
@@ -802,6 +930,8 @@ async def comfyui_start(current_user: dict = Depends(get_current_user)):
             }
     
     result = await docker_manager.start()
+    if result.get("success"):
+        await credit_reconciler.set_owner(current_user["id"])
     
     # Log the action
     await db.add_log(
@@ -810,6 +940,12 @@ async def comfyui_start(current_user: dict = Depends(get_current_user)):
         details=f"User {current_user['email']} started ComfyUI: {result['message']}"
     )
     
+    if wait and result.get("success"):
+        result["ready"] = await docker_manager.wait_until_ready(timeout)
+        if result["ready"]:
+            result["status"] = "running"
+            result["message"] = "ComfyUI is running and ready"
+    
     return result
 
 
@@ -817,6 +953,9 @@ async def comfyui_start(current_user: dict = Depends(get_current_user)):
 async def comfyui_stop(current_user: dict = Depends(get_current_user)):
     """Stop ComfyUI container (requires authentication)"""
     result = await docker_manager.stop()
+    if result.get("success"):
+        # The stop is only queued; the owner is cleared once it has actually stopped
+        asyncio.create_task(credit_reconciler.clear_owner_after(result["operation_id"]))
     
     # Log the action
     await db.add_log(
@@ -846,6 +985,8 @@ async def comfyui_restart(current_user: dict = Depends(get_current_user)):
             }
     
     result = await docker_manager.restart()
+    if result.get("success"):
+        await credit_reconciler.set_owner(current_user["id"])
     
     # Log the action
     await db.add_log(
@@ -857,6 +998,25 @@ async def comfyui_restart(current_user: dict = Depends(get_current_user)):
     return result
 
 
+@app.get("/comfyui/ready")
+async def comfyui_ready(request: Request, timeout: float = 30, current_user: dict = Depends(get_current_user)):
+    """
+    Long-poll until ComfyUI answers requests, for at most `timeout` seconds.
+    Returns the status with "ready" true, or false on timeout or when nothing is starting.
+    """
+    await docker_manager.wait_until_ready(timeout)
+    return await get_public_comfyui_status(request)
+
+
+@app.get("/comfyui/operations/{operation_id}")
+async def comfyui_operation(operation_id: str, current_user: dict = Depends(get_current_user)):
+    """Progress of a stop/restart operation returned by /comfyui/stop or /comfyui/restart"""
+    operation = docker_manager.get_operation(operation_id)
+    if operation is None:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return operation
+
+
 @app.get("/comfyui/logs")
 async def comfyui_logs(
     lines: int = 100,
@@ -871,12 +1031,48 @@ async def comfyui_logs(
 
 
 @app.get("/comfyui/startup-logs")
-async def comfyui_startup_logs(current_user: dict = Depends(get_current_user)):
-    """Get ComfyUI startup/pull logs (requires authentication)"""
-    result = await docker_manager.get_startup_logs()
+async def comfyui_startup_logs(
+    after_offset: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get ComfyUI startup/pull logs (requires authentication).
+    Pass the returned `offset` back as `?after_offset=` to fetch only new output.
+    """
+    result = await docker_manager.get_startup_logs(after_offset=after_offset)
     return result
 
 
+@app.get("/comfyui/startup-logs/stream")
+async def comfyui_startup_logs_stream(
+    request: Request,
+    after_offset: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """SSE tail of the startup log. Each event id is the offset to resume from (Last-Event-ID)."""
+    last_event_id = request.headers.get("last-event-id", "")
+    if after_offset is None and last_event_id.isdigit():
+        after_offset = int(last_event_id)
+    
+    async def generate_log():
+        offset = after_offset
+        while True:
+            if await request.is_disconnected():
+                break
+            # May fall back to a file read; keep it off the event loop
+            chunk = await asyncio.to_thread(startup_log.read, offset)
+            if chunk["text"] or chunk["reset"]:
+                yield {
+                    "event": "log",
+                    "id": str(chunk["offset"]),
+                    "data": json.dumps({"text": chunk["text"], "reset": chunk["reset"]})
+                }
+            offset = chunk["offset"]
+            await asyncio.sleep(0.5)
+    
+    return EventSourceResponse(generate_log())
+
+
 # ============================================
 # Health Check
 # ============================================
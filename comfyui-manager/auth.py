@@ -4,8 +4,13 @@ Handles JWT tokens, password hashing, and user authentication
 """
 
 import os
+import hmac
+import asyncio
+import hashlib
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, List
 
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
@@ -13,7 +18,7 @@ from jose import JWTError, jwt
 import bcrypt
 from dotenv import load_dotenv
 
-from database import db
+from database import db, principal_cache, api_key_cache
 from schemas import TokenData
 
 load_dotenv()
@@ -23,6 +28,18 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+# Password hashing - bcrypt runs on a bounded worker pool, never on the event loop.
+# PASSWORD_HASH_WORKERS=0 hashes inline (legacy behaviour, for benchmarking only).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+# API keys look like cmk_<prefix>_<secret>. The prefix is stored in clear and indexed;
+# the whole key is verified with HMAC-SHA256 (cheap, unlike bcrypt).
+API_KEY_PREFIX = "cmk_"
+API_KEY_HASH_SECRET = os.getenv("API_KEY_HASH_SECRET") or SECRET_KEY
+API_KEY_SCOPES = ("jobs:read", "jobs:write", "wallet:read")
+
 # OAuth2 scheme - uses token from header
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
@@ -35,13 +52,71 @@ security = HTTPBearer(auto_error=False)
 # ============================================
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
+    """Verify a password against its hash (blocking; use password_hasher.verify from async code)"""
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash a password (blocking; use password_hasher.hash from async code)"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a different cost than BCRYPT_ROUNDS"""
+    # bcrypt hashes look like $2b$12$<salt+digest>
+    parts = hashed_password.split("$")
+    try:
+        return int(parts[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated thread pool (bcrypt releases the GIL), so a burst
+    of logins cannot stall other requests. At most `workers + queue_limit`
+    operations are admitted; beyond that callers get an immediate 503.
+    """
+    
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.capacity = workers + queue_limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt") if workers > 0 else None
+    
+    @property
+    def saturated(self) -> bool:
+        return self._executor is not None and self.in_flight >= self.capacity
+    
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if self.saturated:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in attempts in progress, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
 
 
 # ============================================
@@ -77,10 +152,114 @@ def decode_token(token: str) -> Optional[TokenData]:
         return None
 
 
+# ============================================
+# API Keys
+# ============================================
+
+def hash_api_key(key: str) -> str:
+    """Keyed hash stored for an API key"""
+    return hmac.new(API_KEY_HASH_SECRET.encode('utf-8'), key.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def is_api_key(token: str) -> bool:
+    return token.startswith(API_KEY_PREFIX)
+
+
+async def create_api_key(user_id: int, name: str, scopes: List[str],
+                         expires_in_days: Optional[int] = None) -> tuple:
+    """
+    Issue a new API key for a user.
+    Returns (key, record); the plaintext key is only available here.
+    """
+    unknown = set(scopes) - set(API_KEY_SCOPES)
+    if unknown or not scopes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Scopes must be a non-empty subset of: {', '.join(API_KEY_SCOPES)}"
+        )
+    
+    prefix = secrets.token_hex(6)
+    key = f"{API_KEY_PREFIX}{prefix}_{secrets.token_urlsafe(32)}"
+    expires_at = datetime.utcnow() + timedelta(days=expires_in_days) if expires_in_days else None
+    record = await db.create_api_key(
+        user_id=user_id,
+        name=name,
+        prefix=prefix,
+        key_hash=hash_api_key(key),
+        scopes=",".join(sorted(set(scopes))),
+        expires_at=expires_at
+    )
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to create API key"
+        )
+    return key, record
+
+
+def _api_key_expired(expires_at) -> bool:
+    if not expires_at:
+        return False
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.replace(tzinfo=None) - expires_at.utcoffset()
+    return expires_at <= datetime.utcnow()
+
+
+async def authenticate_api_key(key: str) -> Optional[dict]:
+    """
+    Resolve an API key to its user (one indexed lookup by prefix, none when cached).
+    The returned user never has admin rights and carries the key's scopes under "api_key".
+    """
+    prefix, _, secret = key[len(API_KEY_PREFIX):].partition("_")
+    if not prefix or not secret:
+        return None
+    
+    record = api_key_cache.get(prefix)
+    if record is None:
+        record = await db.get_api_key_by_prefix(prefix)
+        if record is None:
+            return None
+        api_key_cache.put(prefix, record)
+    
+    if not hmac.compare_digest(record["key_hash"], hash_api_key(key)):
+        return None
+    if record.get("revoked_at") or _api_key_expired(record.get("expires_at")):
+        return None
+    
+    user = principal_cache.get(record["user_id"])
+    if user is None:
+        user = await db.get_user_by_id(record["user_id"])
+        if user is None:
+            return None
+        principal_cache.put(user["id"], user)
+    
+    user["is_admin"] = False
+    user["api_key"] = {"id": record["id"], "prefix": prefix, "scopes": record["scopes"].split(",")}
+    return user
+
+
 # ============================================
 # Authentication Dependencies
 # ============================================
 
+async def get_token_user(token_data: TokenData) -> Optional[dict]:
+    """
+    Resolve the user a decoded token refers to, via the principal cache.
+    A cached row only counts if its email still matches the token subject.
+    """
+    if token_data.user_id is not None and principal_cache.enabled:
+        user = principal_cache.get(token_data.user_id)
+        if user is not None and user["email"] == token_data.email:
+            return user
+    
+    user = await db.get_user_by_email(token_data.email)
+    if user is not None and user["id"] == token_data.user_id:
+        principal_cache.put(user["id"], user)
+    return user
+
+
 async def get_token_from_request(
     request: Request,
     oauth2_token: Optional[str] = Depends(oauth2_scheme),
@@ -88,14 +267,20 @@ async def get_token_from_request(
 ) -> Optional[str]:
     """
     Extract token from various sources:
-    1. Authorization header (Bearer token)
-    2. OAuth2 password flow
-    3. Cookie (for web UI)
+    1. Authorization header (Bearer token or API key)
+    2. X-API-Key header
+    3. OAuth2 password flow
+    4. Cookie (for web UI)
     """
     # Try Bearer token first
     if bearer and bearer.credentials:
         return bearer.credentials
     
+    # Try API key header
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        return api_key
+    
     # Try OAuth2 token
     if oauth2_token:
         return oauth2_token
@@ -132,8 +317,7 @@ async def get_current_user(
     if token_data is None:
         raise credentials_exception
     
-    # Get user from database
-    user = await db.get_user_by_email(token_data.email)
+    user = await get_token_user(token_data)
     if user is None:
         raise credentials_exception
     
@@ -155,8 +339,36 @@ async def get_current_user_optional(
     if token_data is None:
         return None
     
-    user = await db.get_user_by_email(token_data.email)
-    return user
+    return await get_token_user(token_data)
+
+
+def require_api_scope(scope: str):
+    """
+    Dependency for routes automation clients may call.
+    Accepts everything get_current_user does, plus API keys holding `scope`.
+    """
+    async def dependency(
+        request: Request,
+        token: Optional[str] = Depends(get_token_from_request)
+    ) -> dict:
+        if not token or not is_api_key(token):
+            return await get_current_user(request, token)
+        
+        user = await authenticate_api_key(token)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or revoked API key",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if scope not in user["api_key"]["scopes"]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"API key lacks the '{scope}' scope"
+            )
+        return user
+    
+    return dependency
 
 
 async def get_current_admin(
@@ -187,9 +399,19 @@ async def authenticate_user(email: str, password: str) -> Optional[dict]:
     if not user.get("password_hash"):
         return None
     
-    if not verify_password(password, user["password_hash"]):
+    if not await password_hasher.verify(password, user["password_hash"]):
         return None
     
+    # Upgrade hashes made with an older BCRYPT_ROUNDS while we have the plaintext;
+    # skipped when the hashing pool is busy, the next login will try again
+    if password_needs_rehash(user["password_hash"]) and not password_hasher.saturated:
+        try:
+            password_hash = await password_hasher.hash(password)
+            await db.update_user(user["id"], password_hash=password_hash)
+            user["password_hash"] = password_hash
+        except Exception as e:
+            print(f"[WARNING] Password rehash failed for user {user['id']}: {e}")
+    
     return user
 
 
@@ -204,7 +426,7 @@ async def register_user(email: str, password: str) -> dict:
         )
     
     # Hash password and create user
-    password_hash = get_password_hash(password)
+    password_hash = await password_hasher.hash(password)
     user = await db.create_user(email=email, password_hash=password_hash)
     
     if not user:
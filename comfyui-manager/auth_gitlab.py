@@ -140,7 +140,8 @@ async def gitlab_callback(request: Request) -> RedirectResponse:
         # Log the failed admin attempt
         await db.add_log(
             action="gitlab_admin_denied",
-            details=f"GitLab user {email} ({username}) attempted admin login but is not in allowlist"
+            details=f"GitLab user {email} ({username}) attempted admin login but is not in allowlist",
+            sync=True
         )
         raise HTTPException(
             status_code=403,
@@ -174,7 +175,8 @@ async def gitlab_callback(request: Request) -> RedirectResponse:
         action="gitlab_admin_login",
         user_id=user["id"],
         ip=request.client.host if request.client else None,
-        details=f"Admin login via GitLab: {email} ({username})"
+        details=f"Admin login via GitLab: {email} ({username})",
+        sync=True
     )
     
     # Create JWT token
@@ -4,13 +4,23 @@ Handles all database operations for ComfyUI Manager
 """
 
 import os
+import json
+import base64
+import asyncio
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Set, TypeVar
+from collections import deque, OrderedDict
 from contextlib import contextmanager
 from enum import Enum
 
+import httpx
+import numpy as np
 from dotenv import load_dotenv
+from postgrest import AsyncPostgrestClient
 
 load_dotenv()
 
@@ -22,10 +32,111 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./comfyui_manager.db")
 # Determine which database to use
 USE_SUPABASE = bool(SUPABASE_URL and SUPABASE_KEY)
 
+# PostgREST endpoint (override to point at a local PostgREST-compatible server)
+SUPABASE_REST_URL = os.getenv("SUPABASE_REST_URL") or (f"{SUPABASE_URL.rstrip('/')}/rest/v1" if SUPABASE_URL else None)
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "50"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
+
+# ============================================
+# Async Supabase (PostgREST) Client
+# ============================================
+
+class ConcurrencyLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Caps the number of in-flight PostgREST requests.
+    With HTTP/2 many requests share one connection, so the connection
+    pool limit alone does not bound load on the database.
+    """
+    
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_concurrency: int, acquire_timeout: float):
+        self._transport = transport
+        self._max_concurrency = max_concurrency
+        self._acquire_timeout = acquire_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._acquire_timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout("Timed out waiting for a Supabase request slot", request=request)
+        try:
+            response = await self._transport.handle_async_request(request)
+            # Responses are read in full by postgrest, so the slot can be released here
+            await response.aread()
+            return response
+        finally:
+            self._semaphore.release()
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class SupabaseREST:
+    """
+    Async PostgREST client for the Supabase backend.
+    All queries share one keep-alive (HTTP/2) connection pool, created lazily on
+    first use so it binds to the running event loop, and closed by close_db().
+    """
+    
+    def __init__(self, rest_url: str, key: str):
+        self.rest_url = rest_url
+        self.key = key
+        self._client: Optional[AsyncPostgrestClient] = None
+    
+    def _connect(self) -> AsyncPostgrestClient:
+        timeout = httpx.Timeout(SUPABASE_TIMEOUT)
+        transport = ConcurrencyLimitedTransport(
+            httpx.AsyncHTTPTransport(
+                http2=SUPABASE_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_CONNECTIONS
+                ),
+                retries=1
+            ),
+            max_concurrency=SUPABASE_MAX_CONCURRENCY,
+            acquire_timeout=SUPABASE_TIMEOUT
+        )
+        headers = {
+            "apikey": self.key,
+            "Authorization": f"Bearer {self.key}",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+        http_client = httpx.AsyncClient(
+            base_url=self.rest_url,
+            headers=headers,
+            timeout=timeout,
+            transport=transport
+        )
+        return AsyncPostgrestClient(self.rest_url, headers=headers, timeout=timeout, http_client=http_client)
+    
+    @property
+    def client(self) -> AsyncPostgrestClient:
+        if self._client is None:
+            self._client = self._connect()
+        return self._client
+    
+    def table(self, name: str):
+        return self.client.from_(name)
+    
+    def rpc(self, fn: str, params: Dict[str, Any]):
+        return self.client.rpc(fn, params)
+    
+    async def aclose(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+
 if USE_SUPABASE:
-    from supabase import create_client, Client
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase connected")
+    supabase: Optional[SupabaseREST] = SupabaseREST(SUPABASE_REST_URL, SUPABASE_KEY)
+    print(f"✅ Supabase configured ({SUPABASE_REST_URL})")
 else:
     supabase = None
     print("⚠️ Supabase not configured. Using SQLite fallback.")
@@ -62,12 +173,36 @@ class JobStatus(str, Enum):
 
 SQLITE_DB_PATH = DATABASE_URL.replace("sqlite:///", "") if DATABASE_URL.startswith("sqlite:///") else "./comfyui_manager.db"
 
+# Worker threads (one long-lived connection each) used to run queries off the event loop.
+# 0 disables the pool: queries then open a fresh connection and run inline (legacy behaviour).
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+T = TypeVar("T")
+
+
+def open_sqlite_connection() -> sqlite3.Connection:
+    """Open a SQLite connection with the portal's pragmas applied"""
+    conn = sqlite3.connect(
+        SQLITE_DB_PATH,
+        timeout=30,
+        check_same_thread=False,
+        cached_statements=SQLITE_STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while a writer holds the lock;
+    # synchronous=NORMAL is durable across app crashes in WAL mode
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    return conn
+
 
 @contextmanager
 def get_sqlite_connection():
     """Context manager for SQLite connections"""
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = open_sqlite_connection()
     try:
         yield conn
         conn.commit()
@@ -78,6 +213,71 @@ def get_sqlite_connection():
         conn.close()
 
 
+class SQLitePool:
+    """
+    Small pool of SQLite connections, each owned by a dedicated worker thread.
+    Connections (and their prepared statement caches) live as long as the pool,
+    so pragmas are applied once per connection rather than once per query.
+    """
+    
+    def __init__(self, size: int):
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_sqlite_connection()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def _run_in_transaction(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        conn = self._get_connection()
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+    
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run fn(conn) as one transaction on a pool thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_in_transaction, fn)
+    
+    def close(self):
+        """Wait for in-flight queries, then close every pooled connection"""
+        executor = self._executor
+        # Fresh executor/thread-locals so the pool can be reused after close
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sqlite")
+        self._local = threading.local()
+        executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+sqlite_pool: Optional[SQLitePool] = SQLitePool(SQLITE_POOL_SIZE) if not USE_SUPABASE and SQLITE_POOL_SIZE > 0 else None
+
+
+async def run_sqlite(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """
+    Run fn(conn) in a single transaction without blocking the event loop.
+    Commits on success and rolls back if fn raises.
+    """
+    if sqlite_pool is None:
+        with get_sqlite_connection() as conn:
+            return fn(conn)
+    return await sqlite_pool.run(fn)
+
+
 def init_sqlite_db():
     """Initialize SQLite database with all required tables"""
     with get_sqlite_connection() as conn:
@@ -129,6 +329,65 @@ def init_sqlite_db():
             )
         """)
         
+        # User balances table (projection of rcc_ledger, one row per user)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_balances (
+                user_id INTEGER PRIMARY KEY,
+                rcc_balance INTEGER NOT NULL DEFAULT 0,
+                last_ledger_id INTEGER,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        """)
+
+        # Keep the projection in the same transaction as every ledger insert
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_rcc_ledger_apply_balance
+            AFTER INSERT ON rcc_ledger
+            BEGIN
+                INSERT INTO user_balances (user_id, rcc_balance, last_ledger_id, updated_at)
+                VALUES (NEW.user_id, NEW.delta, NEW.id, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    rcc_balance = rcc_balance + excluded.rcc_balance,
+                    last_ledger_id = excluded.last_ledger_id,
+                    updated_at = excluded.updated_at;
+            END
+        """)
+
+        # Every user has a projection row (balance 0 until a ledger entry), so balance
+        # sorts and filters read user_balances and its (rcc_balance, user_id) index
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_users_create_balance
+            AFTER INSERT ON users
+            BEGIN
+                INSERT OR IGNORE INTO user_balances (user_id, rcc_balance, updated_at)
+                VALUES (NEW.id, 0, CURRENT_TIMESTAMP);
+            END
+        """)
+
+        # Ledger checkpoints (balance as of a ledger id, written by the compactor)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rcc_ledger_checkpoints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ledger_id INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                entry_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (user_id, ledger_id),
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (ledger_id) REFERENCES rcc_ledger(id)
+            )
+        """)
+
+        # Backfill the projection for databases created before it existed
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM user_balances), EXISTS (SELECT 1 FROM rcc_ledger)")
+        has_balances, has_ledger = cursor.fetchone()
+        if has_ledger and not has_balances:
+            _rebuild_sqlite_user_balances(cursor)
+            print("✅ Rebuilt user_balances from rcc_ledger")
+        _add_missing_sqlite_user_balances(cursor)
+
         # Payments table (audit)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS payments (
@@ -184,11 +443,93 @@ def init_sqlite_db():
                 temperature_c INTEGER,
                 power_draw_w REAL,
                 duration_seconds REAL,
+                energy_wh REAL,
+                sample_count INTEGER,
                 recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id),
                 FOREIGN KEY (job_id) REFERENCES jobs(id)
             )
         """)
+        # Per-job summaries from the GPU sampler (databases created before they existed)
+        _add_missing_columns(cursor, "gpu_usage", {"energy_wh": "REAL", "sample_count": "INTEGER"})
+        
+        # API keys for automation clients (only a keyed hash of the secret is stored)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS api_keys (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                prefix TEXT UNIQUE NOT NULL,
+                key_hash TEXT NOT NULL,
+                scopes TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                revoked_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        """)
+        
+        # ComfyUI container start attempts with per-phase timings (seconds)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS comfyui_startups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TIMESTAMP NOT NULL,
+                outcome TEXT NOT NULL,
+                image_pulled INTEGER DEFAULT 0,
+                container_created INTEGER DEFAULT 0,
+                prepare_seconds REAL,
+                image_seconds REAL,
+                pull_bytes INTEGER,
+                create_seconds REAL,
+                start_seconds REAL,
+                first_log_seconds REAL,
+                ready_seconds REAL,
+                total_seconds REAL,
+                error TEXT
+            )
+        """)
+        
+        # gpu_usage rolled up per minute/hour/day and user (user_id 0 = not attributed),
+        # updated in the same transaction as every gpu_usage insert
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS gpu_usage_rollups (
+                resolution TEXT NOT NULL,
+                bucket TIMESTAMP NOT NULL,
+                user_id INTEGER NOT NULL DEFAULT 0,
+                records INTEGER NOT NULL DEFAULT 0,
+                duration_seconds REAL NOT NULL DEFAULT 0,
+                energy_wh REAL NOT NULL DEFAULT 0,
+                gpu_utilization_sum REAL NOT NULL DEFAULT 0,
+                gpu_utilization_count INTEGER NOT NULL DEFAULT 0,
+                memory_utilization_sum REAL NOT NULL DEFAULT 0,
+                memory_utilization_count INTEGER NOT NULL DEFAULT 0,
+                power_draw_sum REAL NOT NULL DEFAULT 0,
+                power_draw_count INTEGER NOT NULL DEFAULT 0,
+                peak_memory_mb INTEGER,
+                PRIMARY KEY (resolution, bucket, user_id)
+            )
+        """)
+        
+        # GPU device metrics from the sampler per minute/hour/day, for charts
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS gpu_metric_rollups (
+                resolution TEXT NOT NULL,
+                bucket TIMESTAMP NOT NULL,
+                gpu_id INTEGER NOT NULL,
+                samples INTEGER NOT NULL DEFAULT 0,
+                gpu_utilization_sum REAL NOT NULL DEFAULT 0,
+                memory_used_sum REAL NOT NULL DEFAULT 0,
+                memory_used_max INTEGER,
+                power_draw_sum REAL NOT NULL DEFAULT 0,
+                power_draw_count INTEGER NOT NULL DEFAULT 0,
+                temperature_max INTEGER,
+                PRIMARY KEY (resolution, bucket, gpu_id)
+            )
+        """)
+        # Backfill rollups for gpu_usage rows written before they existed
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM gpu_usage_rollups)")
+        if not cursor.fetchone()[0]:
+            _apply_sqlite_usage_rollups(cursor)
         
         # Insert default settings if not exists
         cursor.execute("""
@@ -205,10 +546,223 @@ def init_sqlite_db():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_usage_user_id ON gpu_usage(user_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_usage_recorded_at ON gpu_usage(recorded_at)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_usage_job_id ON gpu_usage(job_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_usage_user_id_recorded_at ON gpu_usage(user_id, recorded_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_user_id ON api_keys(user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_comfyui_startups_started_at ON comfyui_startups(started_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rcc_ledger_reason_created_at ON rcc_ledger(reason, created_at)")
+        # Users joined with their balance, for sorting/filtering the admin user list.
+        # Driven from user_balances (a row per user) so balance sorts use its index;
+        # recreated because earlier versions LEFT JOINed from users
+        cursor.execute("DROP VIEW IF EXISTS users_with_balances")
+        cursor.execute("""
+            CREATE VIEW users_with_balances AS
+            SELECT b.user_id AS id, u.email, u.is_admin, u.gitlab_id, u.created_at, b.rcc_balance
+            FROM user_balances b
+            JOIN users u ON u.id = b.user_id
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_balances_rcc_balance ON user_balances(rcc_balance, user_id)")
+        
+        # Keyset pagination: every list is ordered by (created_at, id) within its filter
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at_id ON jobs(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_id_created_at_id ON jobs(user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at_id ON jobs(status, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rcc_ledger_user_id_created_at_id ON rcc_ledger(user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_created_at_id ON logs(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_action_created_at_id ON logs(action, created_at, id)")
         
         print("✅ SQLite database initialized")
 
 
+def _add_missing_columns(cursor, table: str, columns: Dict[str, str]):
+    """ALTER TABLE ... ADD COLUMN for each column the table does not have yet"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def _apply_sqlite_usage_rollups(cursor, first_id: int = 0):
+    """Add gpu_usage rows with id >= first_id to gpu_usage_rollups (runs in the caller's transaction)"""
+    for resolution, (_, bucket_format) in ROLLUP_RESOLUTIONS.items():
+        cursor.execute("""
+            INSERT INTO gpu_usage_rollups
+                (resolution, bucket, user_id, records, duration_seconds, energy_wh,
+                 gpu_utilization_sum, gpu_utilization_count, memory_utilization_sum, memory_utilization_count,
+                 power_draw_sum, power_draw_count, peak_memory_mb)
+            SELECT ?, strftime(?, recorded_at), COALESCE(user_id, 0), COUNT(*),
+                   COALESCE(SUM(duration_seconds), 0), COALESCE(SUM(energy_wh), 0),
+                   COALESCE(SUM(gpu_utilization), 0), COUNT(gpu_utilization),
+                   COALESCE(SUM(memory_utilization), 0), COUNT(memory_utilization),
+                   COALESCE(SUM(power_draw_w), 0), COUNT(power_draw_w), MAX(memory_used_mb)
+            FROM gpu_usage
+            WHERE id >= ?
+            GROUP BY 2, 3
+            ON CONFLICT (resolution, bucket, user_id) DO UPDATE SET
+                records = records + excluded.records,
+                duration_seconds = duration_seconds + excluded.duration_seconds,
+                energy_wh = energy_wh + excluded.energy_wh,
+                gpu_utilization_sum = gpu_utilization_sum + excluded.gpu_utilization_sum,
+                gpu_utilization_count = gpu_utilization_count + excluded.gpu_utilization_count,
+                memory_utilization_sum = memory_utilization_sum + excluded.memory_utilization_sum,
+                memory_utilization_count = memory_utilization_count + excluded.memory_utilization_count,
+                power_draw_sum = power_draw_sum + excluded.power_draw_sum,
+                power_draw_count = power_draw_count + excluded.power_draw_count,
+                peak_memory_mb = MAX(COALESCE(peak_memory_mb, excluded.peak_memory_mb),
+                                     COALESCE(excluded.peak_memory_mb, peak_memory_mb))
+        """, (resolution, bucket_format, first_id))
+
+
+def _rebuild_sqlite_user_balances(cursor) -> int:
+    """Recompute every row of user_balances from rcc_ledger (runs in the caller's transaction)"""
+    cursor.execute("DELETE FROM user_balances")
+    cursor.execute("""
+        INSERT INTO user_balances (user_id, rcc_balance, last_ledger_id, updated_at)
+        SELECT user_id, SUM(delta), MAX(id), CURRENT_TIMESTAMP
+        FROM rcc_ledger
+        GROUP BY user_id
+    """)
+    return cursor.rowcount + _add_missing_sqlite_user_balances(cursor)
+
+
+def _add_missing_sqlite_user_balances(cursor) -> int:
+    """Zero-balance projection rows for users without one (users without ledger entries)"""
+    cursor.execute("""
+        INSERT INTO user_balances (user_id, rcc_balance, updated_at)
+        SELECT u.id, 0, CURRENT_TIMESTAMP FROM users u
+        WHERE NOT EXISTS (SELECT 1 FROM user_balances b WHERE b.user_id = u.id)
+    """)
+    return cursor.rowcount
+
+
+def _rebuild_sqlite_ledger_checkpoints(cursor, every: int) -> int:
+    """Recompute checkpoints from rcc_ledger, one every `every` entries per user"""
+    cursor.execute("DELETE FROM rcc_ledger_checkpoints")
+    cursor.execute("""
+        INSERT INTO rcc_ledger_checkpoints (user_id, ledger_id, balance, entry_count, created_at)
+        SELECT user_id, id, running_balance, entry_count, CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, id,
+                   SUM(delta) OVER (PARTITION BY user_id ORDER BY id) AS running_balance,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS entry_count
+            FROM rcc_ledger
+        )
+        WHERE entry_count % ? = 0
+    """, (every,))
+    return cursor.rowcount
+
+
+# ============================================
+# Keyset Pagination
+# ============================================
+# Lists are ordered by a sort key with id as tie-breaker - (created_at, id),
+# newest first, unless stated otherwise. A cursor is an opaque token holding
+# the (sort key, id) of a row on the current page and the direction to move:
+# forward (next page) or backward (previous page).
+
+def encode_cursor(row: Dict[str, Any], previous: bool = False, key: str = "created_at") -> str:
+    """Encode a cursor pointing past `row` (towards the next page, or the previous one)"""
+    value = row[key] if isinstance(row[key], (int, float)) else str(row[key])
+    payload = json.dumps([value, row["id"], previous], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor into (sort value, id, previous). Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id, previous = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(value, (str, int, float)):
+            raise TypeError(value)
+        return value, int(row_id), bool(previous)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+class Page(list):
+    """Rows of one page; `more` is True when rows continue past it in the scan direction"""
+    
+    def __init__(self, rows: List[Dict[str, Any]], more: bool):
+        super().__init__(rows)
+        self.more = more
+
+
+def page_cursors(rows: Page, limit: int, cursor: Optional[str] = None,
+                 key: str = "created_at") -> Dict[str, Optional[str]]:
+    """
+    Cursors for the pages around a page fetched with `cursor` (a Page from _fetch_page).
+    next_cursor continues in sort order (older rows for newest-first lists),
+    prev_cursor goes back (None at either end).
+    """
+    if not rows:
+        return {"next_cursor": None, "prev_cursor": None}
+    previous = decode_cursor(cursor)[2] if cursor else False
+    # The cursor row itself lies on the side the page was reached from
+    has_next = previous or rows.more
+    has_prev = rows.more if previous else cursor is not None
+    return {
+        "next_cursor": encode_cursor(rows[-1], key=key) if has_next else None,
+        "prev_cursor": encode_cursor(rows[0], previous=True, key=key) if has_prev else None
+    }
+
+
+# Admin user list sort options: name -> (sort key, descending)
+USER_SORTS = {
+    "newest": ("created_at", True),
+    "oldest": ("created_at", False),
+    "balance_desc": ("rcc_balance", True),
+    "balance_asc": ("rcc_balance", False),
+}
+
+# Columns of gpu_usage written by insert_gpu_usage
+GPU_USAGE_COLUMNS = (
+    "user_id", "job_id", "gpu_id", "gpu_name", "memory_used_mb", "memory_total_mb", "gpu_utilization",
+    "memory_utilization", "temperature_c", "power_draw_w", "duration_seconds", "energy_wh", "sample_count",
+)
+
+# Columns loaded for usage statistics: (name, NumPy dtype)
+JOB_STAT_COLUMNS = (("id", "i8"), ("type", "U32"), ("user_id", "i8"), ("duration_ms", "f8"))
+GPU_USAGE_STAT_COLUMNS = (("job_id", "i8"), ("user_id", "i8"), ("gpu_utilization", "f8"), ("memory_used_mb", "f8"))
+
+# GPU rollup resolutions: name -> (bucket seconds, strftime format of the bucket start)
+ROLLUP_RESOLUTIONS = {
+    "minute": (60, "%Y-%m-%d %H:%M:00"),
+    "hour": (3600, "%Y-%m-%d %H:00:00"),
+    "day": (86400, "%Y-%m-%d 00:00:00"),
+}
+# Queries read the finest resolution covering their window in at most this many buckets
+# (also the PostgREST page size, so a chart is always one request)
+GPU_ROLLUP_MAX_BUCKETS = int(os.getenv("GPU_ROLLUP_MAX_BUCKETS", "1000"))
+# Days of minute and hour rollups kept by prune_gpu_rollups (day rollups are kept)
+GPU_ROLLUP_RETENTION_DAYS = {"minute": 2, "hour": 90}
+
+# Columns of gpu_metric_rollups written by add_gpu_metric_minutes (besides resolution and bucket)
+GPU_METRIC_COLUMNS = (
+    "gpu_id", "samples", "gpu_utilization_sum", "memory_used_sum", "memory_used_max",
+    "power_draw_sum", "power_draw_count", "temperature_max",
+)
+
+
+def rollup_window(seconds: float) -> tuple:
+    """
+    (resolution, since) for a window of `seconds` ending now: the finest resolution
+    with at most GPU_ROLLUP_MAX_BUCKETS buckets, and the window start floored to a bucket
+    """
+    for resolution, (bucket_seconds, bucket_format) in ROLLUP_RESOLUTIONS.items():
+        if seconds / bucket_seconds <= GPU_ROLLUP_MAX_BUCKETS:
+            break
+    since = datetime.utcnow() - timedelta(seconds=seconds)
+    return resolution, datetime.strptime(since.strftime(bucket_format), "%Y-%m-%d %H:%M:%S")
+
+# Columns of comfyui_startups written by record_comfyui_startup
+STARTUP_COLUMNS = (
+    "started_at", "outcome", "image_pulled", "container_created", "prepare_seconds", "image_seconds",
+    "pull_bytes", "create_seconds", "start_seconds", "first_log_seconds", "ready_seconds",
+    "total_seconds", "error",
+)
+
+
 # ============================================
 # Database Abstraction Layer
 # ============================================
@@ -221,12 +775,84 @@ class Database:
     def __init__(self):
         self.use_supabase = USE_SUPABASE
     
+    async def _fetch_page(self, table: str, filters: Dict[str, Any], limit: int,
+                          offset: int = 0, cursor: Optional[str] = None,
+                          order_by: str = "created_at", descending: bool = True,
+                          ranges: Optional[Dict[str, tuple]] = None) -> Page:
+        """
+        Page of `table` ordered by (order_by, id), newest first by default.
+        `filters` are equality filters, `ranges` maps a column to inclusive
+        (min, max) bounds (either may be None). With a cursor this is a keyset
+        range scan on the (filters..., order_by, id) index; offset is only
+        honoured without a cursor (legacy callers). One extra row is read to
+        tell whether the scan continues (Page.more).
+        """
+        position = decode_cursor(cursor) if cursor else None
+        # Walking backward reverses the scan, then the page is flipped back
+        backward = bool(position and position[2])
+        scan_descending = descending != backward
+        bounds = [(column, low, high) for column, (low, high) in (ranges or {}).items()]
+        
+        if self.use_supabase:
+            query = supabase.table(table).select("*")
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            for column, low, high in bounds:
+                if low is not None:
+                    query = query.gte(column, low)
+                if high is not None:
+                    query = query.lte(column, high)
+            if position:
+                value, row_id, _ = position
+                op = "lt" if scan_descending else "gt"
+                query = query.or_(f'{order_by}.{op}."{value}",and({order_by}.eq."{value}",id.{op}.{row_id})')
+            query = query.order(order_by, desc=scan_descending).order("id", desc=scan_descending)
+            if position:
+                result = await query.limit(limit + 1).execute()
+            else:
+                result = await query.range(offset, offset + limit).execute()
+            rows = result.data
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                where = [f"{column} = ?" for column in filters]
+                params: list = list(filters.values())
+                for column, low, high in bounds:
+                    if low is not None:
+                        where.append(f"{column} >= ?")
+                        params.append(low)
+                    if high is not None:
+                        where.append(f"{column} <= ?")
+                        params.append(high)
+                if position:
+                    value, row_id, _ = position
+                    where.append(f"({order_by}, id) {'<' if scan_descending else '>'} (?, ?)")
+                    params += [value, row_id]
+                order = "DESC" if scan_descending else "ASC"
+                sql = f"SELECT * FROM {table}"
+                if where:
+                    sql += " WHERE " + " AND ".join(where)
+                sql += f" ORDER BY {order_by} {order}, id {order} LIMIT ?"
+                params.append(limit + 1)
+                if not position and offset:
+                    sql += " OFFSET ?"
+                    params.append(offset)
+                cursor.execute(sql, params)
+                return [dict(row) for row in cursor.fetchall()]
+            rows = await run_sqlite(_execute)
+        
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return Page(rows, more)
+    
     # -------------------- Users --------------------
     
     async def create_user(self, email: str, password_hash: Optional[str] = None, 
                          is_admin: bool = False, gitlab_id: Optional[str] = None) -> Dict[str, Any]:
         if self.use_supabase:
-            result = supabase.table("users").insert({
+            result = await supabase.table("users").insert({
                 "email": email,
                 "password_hash": password_hash,
                 "is_admin": is_admin,
@@ -234,7 +860,7 @@ class Database:
             }).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     "INSERT INTO users (email, password_hash, is_admin, gitlab_id) VALUES (?, ?, ?, ?)",
@@ -244,46 +870,50 @@ class Database:
                 cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("users").select("*").eq("email", email).execute()
+            result = await supabase.table("users").select("*").eq("email", email).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("users").select("*").eq("id", user_id).execute()
+            result = await supabase.table("users").select("*").eq("id", user_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_user_by_gitlab_id(self, gitlab_id: str) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("users").select("*").eq("gitlab_id", gitlab_id).execute()
+            result = await supabase.table("users").select("*").eq("gitlab_id", gitlab_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM users WHERE gitlab_id = ?", (gitlab_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def update_user(self, user_id: int, **kwargs) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("users").update(kwargs).eq("id", user_id).execute()
-            return result.data[0] if result.data else None
+            result = await supabase.table("users").update(kwargs).eq("id", user_id).execute()
+            user = result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
                 values = list(kwargs.values()) + [user_id]
@@ -291,33 +921,128 @@ class Database:
                 cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            user = await run_sqlite(_execute)
+        # Role and email changes must apply to the user's very next request
+        principal_cache.invalidate(user_id)
+        return user
+    
+    async def get_all_users(self, limit: int = 100, offset: int = 0,
+                            cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Newest users first; pass `cursor` for keyset pagination"""
+        return await self._fetch_page("users", {}, limit, offset, cursor)
+    
+    async def get_users_with_balances(self, limit: int = 100, cursor: Optional[str] = None,
+                                      sort: str = "newest", min_balance: Optional[int] = None,
+                                      max_balance: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Users joined with their RCC balance (`rcc_balance`), filtered and sorted in the database.
+        sort is one of USER_SORTS; pass `cursor` (from page_cursors with USER_SORTS[sort][0]) to page.
+        """
+        order_by, descending = USER_SORTS[sort]
+        return await self._fetch_page(
+            "users_with_balances", {}, limit, cursor=cursor,
+            order_by=order_by, descending=descending,
+            ranges={"rcc_balance": (min_balance, max_balance)}
+        )
+    
+    async def count_users(self) -> int:
+        if self.use_supabase:
+            result = await supabase.table("users").select("id", count="exact").execute()
+            return result.count or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM users")
+                return cursor.fetchone()[0]
+            return await run_sqlite(_execute)
+    
+    # -------------------- API Keys --------------------
+    
+    async def create_api_key(self, user_id: int, name: str, prefix: str, key_hash: str,
+                             scopes: str, expires_at: Optional[datetime] = None) -> Dict[str, Any]:
+        expires = expires_at.isoformat() if expires_at else None
+        if self.use_supabase:
+            result = await supabase.table("api_keys").insert({
+                "user_id": user_id,
+                "name": name,
+                "prefix": prefix,
+                "key_hash": key_hash,
+                "scopes": scopes,
+                "expires_at": expires
+            }).execute()
+            return result.data[0] if result.data else None
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO api_keys (user_id, name, prefix, key_hash, scopes, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, name, prefix, key_hash, scopes, expires)
+                )
+                cursor.execute("SELECT * FROM api_keys WHERE id = ?", (cursor.lastrowid,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            return await run_sqlite(_execute)
     
-    async def get_all_users(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    async def get_api_key_by_prefix(self, prefix: str) -> Optional[Dict[str, Any]]:
+        """Single lookup through the unique prefix index"""
         if self.use_supabase:
-            result = supabase.table("users").select("*").range(offset, offset + limit - 1).execute()
+            result = await supabase.table("api_keys").select("*").eq("prefix", prefix).execute()
+            return result.data[0] if result.data else None
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM api_keys WHERE prefix = ?", (prefix,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            return await run_sqlite(_execute)
+    
+    async def get_user_api_keys(self, user_id: int) -> List[Dict[str, Any]]:
+        """A user's keys, newest first (hashes excluded)"""
+        columns = "id, user_id, name, prefix, scopes, created_at, expires_at, revoked_at"
+        if self.use_supabase:
+            result = await supabase.table("api_keys").select(columns).eq("user_id", user_id)\
+                .order("created_at", desc=True).execute()
             return result.data
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                cursor.execute("SELECT * FROM users LIMIT ? OFFSET ?", (limit, offset))
+                cursor.execute(
+                    f"SELECT {columns} FROM api_keys WHERE user_id = ? ORDER BY created_at DESC, id DESC",
+                    (user_id,)
+                )
                 return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
     
-    async def count_users(self) -> int:
+    async def revoke_api_key(self, user_id: int, key_id: int) -> Optional[Dict[str, Any]]:
+        """Revoke one of the user's keys. Returns the key, or None if the user has no such key."""
+        revoked_at = datetime.utcnow().isoformat()
         if self.use_supabase:
-            result = supabase.table("users").select("id", count="exact").execute()
-            return result.count or 0
+            result = await supabase.table("api_keys").update({"revoked_at": revoked_at})\
+                .eq("id", key_id).eq("user_id", user_id).is_("revoked_at", "null").execute()
+            if not result.data:
+                result = await supabase.table("api_keys").select("*").eq("id", key_id).eq("user_id", user_id).execute()
+            key = result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM users")
-                return cursor.fetchone()[0]
+                cursor.execute(
+                    "UPDATE api_keys SET revoked_at = ? WHERE id = ? AND user_id = ? AND revoked_at IS NULL",
+                    (revoked_at, key_id, user_id)
+                )
+                cursor.execute("SELECT * FROM api_keys WHERE id = ? AND user_id = ?", (key_id, user_id))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            key = await run_sqlite(_execute)
+        if key:
+            api_key_cache.invalidate(key["prefix"])
+        return key
     
     # -------------------- Jobs --------------------
     
     async def create_job(self, user_id: int, job_type: JobType, cost_rcc: int,
                         admin_bypass: bool = False, metadata: Optional[str] = None) -> Dict[str, Any]:
         if self.use_supabase:
-            result = supabase.table("jobs").insert({
+            result = await supabase.table("jobs").insert({
                 "user_id": user_id,
                 "type": job_type.value,
                 "cost_rcc": cost_rcc,
@@ -327,7 +1052,7 @@ class Database:
             }).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO jobs (user_id, type, cost_rcc, status, admin_bypass, metadata) 
@@ -338,24 +1063,26 @@ class Database:
                 cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("jobs").select("*").eq("id", job_id).execute()
+            result = await supabase.table("jobs").select("*").eq("id", job_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def update_job(self, job_id: int, **kwargs) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("jobs").update(kwargs).eq("id", job_id).execute()
+            result = await supabase.table("jobs").update(kwargs).eq("id", job_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
                 values = list(kwargs.values()) + [job_id]
@@ -363,80 +1090,133 @@ class Database:
                 cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
-    async def get_user_jobs(self, user_id: int, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
-        if self.use_supabase:
-            result = supabase.table("jobs").select("*").eq("user_id", user_id).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-            return result.data
-        else:
-            with get_sqlite_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT * FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                    (user_id, limit, offset)
-                )
-                return [dict(row) for row in cursor.fetchall()]
+    async def get_user_jobs(self, user_id: int, limit: int = 50, offset: int = 0,
+                            cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A user's jobs, newest first; pass `cursor` for keyset pagination"""
+        return await self._fetch_page("jobs", {"user_id": user_id}, limit, offset, cursor)
     
-    async def get_all_jobs(self, limit: int = 100, offset: int = 0, status: Optional[str] = None) -> List[Dict[str, Any]]:
-        if self.use_supabase:
-            query = supabase.table("jobs").select("*")
-            if status:
-                query = query.eq("status", status)
-            result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-            return result.data
-        else:
-            with get_sqlite_connection() as conn:
-                cursor = conn.cursor()
-                if status:
-                    cursor.execute(
-                        "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                        (status, limit, offset)
-                    )
-                else:
-                    cursor.execute(
-                        "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                        (limit, offset)
-                    )
-                return [dict(row) for row in cursor.fetchall()]
+    async def get_all_jobs(self, limit: int = 100, offset: int = 0, status: Optional[str] = None,
+                           cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """All jobs (optionally by status), newest first; pass `cursor` for keyset pagination"""
+        return await self._fetch_page("jobs", {"status": status} if status else {}, limit, offset, cursor)
     
     async def count_jobs(self, since: Optional[datetime] = None) -> int:
         if self.use_supabase:
             query = supabase.table("jobs").select("id", count="exact")
             if since:
                 query = query.gte("created_at", since.isoformat())
-            result = query.execute()
+            result = await query.execute()
             return result.count or 0
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 if since:
                     cursor.execute("SELECT COUNT(*) FROM jobs WHERE created_at >= ?", (since.isoformat(),))
                 else:
                     cursor.execute("SELECT COUNT(*) FROM jobs")
                 return cursor.fetchone()[0]
+            return await run_sqlite(_execute)
+    
+    async def count_active_jobs(self, since: datetime) -> int:
+        """Jobs created since `since` that are still queued or running"""
+        statuses = [JobStatus.CREATED.value, JobStatus.RUNNING.value]
+        if self.use_supabase:
+            result = await supabase.table("jobs").select("id", count="exact")\
+                .in_("status", statuses).gte("created_at", since.isoformat()).execute()
+            return result.count or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?) AND created_at >= ?",
+                    (*statuses, since.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                return cursor.fetchone()[0]
+            return await run_sqlite(_execute)
+    
+    async def get_active_job_user_ids(self, since: datetime) -> Set[int]:
+        """Owners of the jobs created since `since` that are still queued or running"""
+        statuses = [JobStatus.CREATED.value, JobStatus.RUNNING.value]
+        if self.use_supabase:
+            result = await supabase.table("jobs").select("user_id")\
+                .in_("status", statuses).gte("created_at", since.isoformat()).execute()
+            return {row["user_id"] for row in result.data}
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT DISTINCT user_id FROM jobs WHERE status IN (?, ?) AND created_at >= ?",
+                    (*statuses, since.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                return {row[0] for row in cursor.fetchall()}
+            return await run_sqlite(_execute)
     
     async def count_failed_jobs(self, since: Optional[datetime] = None) -> int:
         if self.use_supabase:
             query = supabase.table("jobs").select("id", count="exact").eq("status", "failed")
             if since:
                 query = query.gte("created_at", since.isoformat())
-            result = query.execute()
+            result = await query.execute()
             return result.count or 0
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 if since:
                     cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'failed' AND created_at >= ?", (since.isoformat(),))
                 else:
                     cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'failed'")
                 return cursor.fetchone()[0]
+            return await run_sqlite(_execute)
+    
+    async def get_dashboard_kpis(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Admin dashboard tiles in a single query: total users, jobs (24h/7d),
+        failed jobs (24h) and RCC consumed by job reservations (24h/7d).
+        """
+        now = now or datetime.utcnow()
+        since_24h = now - timedelta(hours=24)
+        since_7d = now - timedelta(days=7)
+        if self.use_supabase:
+            result = await supabase.rpc("get_dashboard_kpis", {
+                "p_since_24h": since_24h.isoformat(),
+                "p_since_7d": since_7d.isoformat()
+            }).execute()
+            return result.data
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    """WITH recent_jobs AS (
+                           SELECT created_at, status FROM jobs WHERE created_at >= :since_7d
+                       ), recent_consumption AS (
+                           SELECT created_at, ABS(delta) AS amount FROM rcc_ledger
+                           WHERE reason = 'JOB_RESERVE' AND created_at >= :since_7d
+                       )
+                       SELECT
+                           (SELECT COUNT(*) FROM users) AS total_users,
+                           (SELECT COUNT(*) FROM recent_jobs WHERE created_at >= :since_24h) AS total_jobs_24h,
+                           (SELECT COUNT(*) FROM recent_jobs) AS total_jobs_7d,
+                           (SELECT COUNT(*) FROM recent_jobs
+                            WHERE status = 'failed' AND created_at >= :since_24h) AS failed_jobs_24h,
+                           (SELECT COALESCE(SUM(amount), 0) FROM recent_consumption
+                            WHERE created_at >= :since_24h) AS rcc_consumed_24h,
+                           (SELECT COALESCE(SUM(amount), 0) FROM recent_consumption) AS rcc_consumed_7d""",
+                    {
+                        "since_24h": since_24h.strftime("%Y-%m-%d %H:%M:%S"),
+                        "since_7d": since_7d.strftime("%Y-%m-%d %H:%M:%S")
+                    }
+                )
+                return dict(cursor.fetchone())
+            return await run_sqlite(_execute)
     
     # -------------------- RCC Ledger --------------------
     
     async def add_rcc_entry(self, user_id: int, delta: int, reason: RCCReason,
                            job_id: Optional[int] = None, external_ref: Optional[str] = None) -> Dict[str, Any]:
         if self.use_supabase:
-            result = supabase.table("rcc_ledger").insert({
+            result = await supabase.table("rcc_ledger").insert({
                 "user_id": user_id,
                 "delta": delta,
                 "reason": reason.value,
@@ -445,7 +1225,7 @@ class Database:
             }).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO rcc_ledger (user_id, delta, reason, job_id, external_ref) 
@@ -456,41 +1236,296 @@ class Database:
                 cursor.execute("SELECT * FROM rcc_ledger WHERE id = ?", (entry_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
-    async def get_user_rcc_balance(self, user_id: int) -> int:
-        """Calculate user's RCC balance from ledger (source of truth)"""
+    async def debit_rcc_if_sufficient(self, user_id: int, amount: int, reason: RCCReason,
+                                      job_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Atomically debit `amount` RCC if the user's balance covers it.
+        The balance check and the ledger insert run in one transaction, so
+        concurrent debits against the same wallet cannot overdraw it.
+        Returns {"success": bool, "balance": int, "entry": dict | None};
+        balance is the balance after the debit (or the unchanged balance on failure).
+        Raises ValueError unless amount is positive (a negative debit would credit).
+        """
+        if amount <= 0:
+            raise ValueError(f"Debit amount must be positive, got {amount}")
         if self.use_supabase:
-            result = supabase.table("rcc_ledger").select("delta").eq("user_id", user_id).execute()
-            return sum(entry["delta"] for entry in result.data) if result.data else 0
+            result = await supabase.rpc("debit_rcc_if_sufficient", {
+                "p_user_id": user_id,
+                "p_amount": amount,
+                "p_reason": reason.value,
+                "p_job_id": job_id
+            }).execute()
+            return result.data
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                cursor.execute("SELECT COALESCE(SUM(delta), 0) FROM rcc_ledger WHERE user_id = ?", (user_id,))
-                return cursor.fetchone()[0]
-    
-    async def get_user_rcc_history(self, user_id: int, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+                # Take the write lock up front so the check and insert are serialized
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(
+                    """INSERT INTO rcc_ledger (user_id, delta, reason, job_id)
+                       SELECT ?, ?, ?, ?
+                       WHERE COALESCE((SELECT rcc_balance FROM user_balances WHERE user_id = ?), 0) >= ?""",
+                    (user_id, -amount, reason.value, job_id, user_id, amount)
+                )
+                debited = cursor.rowcount == 1
+                entry_id = cursor.lastrowid
+                cursor.execute("SELECT rcc_balance FROM user_balances WHERE user_id = ?", (user_id,))
+                row = cursor.fetchone()
+                balance = row["rcc_balance"] if row else 0
+                if not debited:
+                    return {"success": False, "balance": balance, "entry": None}
+                cursor.execute("SELECT * FROM rcc_ledger WHERE id = ?", (entry_id,))
+                return {"success": True, "balance": balance, "entry": dict(cursor.fetchone())}
+            return await run_sqlite(_execute)
+
+    async def create_job_with_reserve(self, user_id: int, job_type: JobType, cost_rcc: int,
+                                      metadata: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Create a job and reserve its cost (JOB_RESERVE) in a single transaction.
+        Nothing is written when the balance does not cover the cost.
+        Returns {"success": bool, "balance": int, "job": dict | None, "entry": dict | None}.
+        Raises ValueError unless cost_rcc is positive.
+        """
+        if cost_rcc <= 0:
+            raise ValueError(f"Reserved cost must be positive, got {cost_rcc}")
         if self.use_supabase:
-            result = supabase.table("rcc_ledger").select("*").eq("user_id", user_id).order("created_at", desc=True).range(offset, offset + limit - 1).execute()
+            result = await supabase.rpc("create_job_with_reserve", {
+                "p_user_id": user_id,
+                "p_type": job_type.value,
+                "p_cost": cost_rcc,
+                "p_metadata": metadata
+            }).execute()
             return result.data
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT rcc_balance FROM user_balances WHERE user_id = ?", (user_id,))
+                row = cursor.fetchone()
+                balance = row["rcc_balance"] if row else 0
+                if balance < cost_rcc:
+                    return {"success": False, "balance": balance, "job": None, "entry": None}
+
+                cursor.execute(
+                    """INSERT INTO jobs (user_id, type, cost_rcc, status, admin_bypass, metadata)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (user_id, job_type.value, cost_rcc, JobStatus.CREATED.value, False, metadata)
+                )
+                job_id = cursor.lastrowid
+                cursor.execute(
+                    "INSERT INTO rcc_ledger (user_id, delta, reason, job_id) VALUES (?, ?, ?, ?)",
+                    (user_id, -cost_rcc, RCCReason.JOB_RESERVE.value, job_id)
+                )
+                entry_id = cursor.lastrowid
+                cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+                job = dict(cursor.fetchone())
+                cursor.execute("SELECT * FROM rcc_ledger WHERE id = ?", (entry_id,))
+                entry = dict(cursor.fetchone())
+                return {"success": True, "balance": balance - cost_rcc, "job": job, "entry": entry}
+            return await run_sqlite(_execute)
+
+    async def get_user_rcc_balance(self, user_id: int) -> int:
+        """
+        Get user's RCC balance from the user_balances projection.
+        The projection is maintained by a trigger on every rcc_ledger insert,
+        so this is a single primary-key lookup however long the history is.
+        """
+        if self.use_supabase:
+            result = await supabase.table("user_balances").select("rcc_balance").eq("user_id", user_id).execute()
+            return result.data[0]["rcc_balance"] if result.data else 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("SELECT rcc_balance FROM user_balances WHERE user_id = ?", (user_id,))
+                row = cursor.fetchone()
+                return row["rcc_balance"] if row else 0
+            return await run_sqlite(_execute)
+
+    async def get_balances(self, user_ids: List[int]) -> Dict[int, int]:
+        """Get RCC balances for many users in one query (users without ledger entries map to 0)"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        if self.use_supabase:
+            result = await supabase.table("user_balances").select("user_id, rcc_balance").in_("user_id", user_ids).execute()
+            rows = result.data
+        else:
+            def _execute(conn):
                 cursor = conn.cursor()
+                placeholders = ", ".join("?" for _ in user_ids)
                 cursor.execute(
-                    "SELECT * FROM rcc_ledger WHERE user_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                    (user_id, limit, offset)
+                    f"SELECT user_id, rcc_balance FROM user_balances WHERE user_id IN ({placeholders})",
+                    user_ids
                 )
                 return [dict(row) for row in cursor.fetchall()]
-    
+            rows = await run_sqlite(_execute)
+        balances = {user_id: 0 for user_id in user_ids}
+        balances.update({row["user_id"]: row["rcc_balance"] for row in rows})
+        return balances
+
+    async def rebuild_user_balances(self) -> int:
+        """
+        Rebuild the user_balances projection from rcc_ledger (source of truth).
+        Returns the number of users written.
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("rebuild_user_balances", {}).execute()
+            return result.data or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                return _rebuild_sqlite_user_balances(cursor)
+            return await run_sqlite(_execute)
+
+    async def check_user_balances(self) -> List[Dict[str, Any]]:
+        """
+        Compare the user_balances projection against SUM(delta) over rcc_ledger.
+        Returns one row per user whose projected balance differs (empty when consistent).
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("check_user_balances", {}).execute()
+            return result.data or []
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT l.user_id, l.ledger_balance, COALESCE(b.rcc_balance, 0) AS projected_balance
+                    FROM (SELECT user_id, SUM(delta) AS ledger_balance FROM rcc_ledger GROUP BY user_id) l
+                    LEFT JOIN user_balances b ON b.user_id = l.user_id
+                    WHERE COALESCE(b.rcc_balance, 0) != l.ledger_balance
+                    UNION ALL
+                    SELECT b.user_id, 0 AS ledger_balance, b.rcc_balance AS projected_balance
+                    FROM user_balances b
+                    WHERE b.rcc_balance != 0
+                      AND NOT EXISTS (SELECT 1 FROM rcc_ledger l WHERE l.user_id = b.user_id)
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
+
+    async def get_user_rcc_history(self, user_id: int, limit: int = 50, offset: int = 0,
+                                   cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get a page of ledger entries, newest first, each with `balance_after`.
+        The balance at the newest entry of the page comes from the nearest
+        checkpoint, then the page is walked backwards, so no full scan is needed.
+        Pass `cursor` for keyset pagination.
+        """
+        entries = await self._fetch_page("rcc_ledger", {"user_id": user_id}, limit, offset, cursor)
+        if entries:
+            balance = await self.get_rcc_balance_at(user_id, max(entry["id"] for entry in entries))
+            for entry in sorted(entries, key=lambda e: e["id"], reverse=True):
+                entry["balance_after"] = balance
+                balance -= entry["delta"]
+        return entries
+
+    async def get_rcc_balance_at(self, user_id: int, ledger_id: int) -> int:
+        """
+        Get a user's balance as of a ledger entry (inclusive):
+        nearest checkpoint at or before it plus the deltas in between.
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("get_rcc_balance_at", {"p_user_id": user_id, "p_ledger_id": ledger_id}).execute()
+            return result.data or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    """SELECT ledger_id, balance FROM rcc_ledger_checkpoints
+                       WHERE user_id = ? AND ledger_id <= ?
+                       ORDER BY ledger_id DESC LIMIT 1""",
+                    (user_id, ledger_id)
+                )
+                checkpoint = cursor.fetchone()
+                base_id, base_balance = (checkpoint["ledger_id"], checkpoint["balance"]) if checkpoint else (0, 0)
+                cursor.execute(
+                    "SELECT COALESCE(SUM(delta), 0) FROM rcc_ledger WHERE user_id = ? AND id > ? AND id <= ?",
+                    (user_id, base_id, ledger_id)
+                )
+                return base_balance + cursor.fetchone()[0]
+            return await run_sqlite(_execute)
+
+    async def compact_ledger_checkpoints(self, min_entries: int = 1000) -> int:
+        """
+        Write a checkpoint for every user with at least `min_entries` ledger
+        entries since their last checkpoint. Returns the number of checkpoints written.
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("compact_ledger_checkpoints", {"p_min_entries": min_entries}).execute()
+            return result.data or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    INSERT INTO rcc_ledger_checkpoints (user_id, ledger_id, balance, entry_count, created_at)
+                    SELECT b.user_id, MAX(l.id),
+                           COALESCE(cp.balance, 0) + SUM(l.delta),
+                           COALESCE(cp.entry_count, 0) + COUNT(l.id),
+                           CURRENT_TIMESTAMP
+                    FROM user_balances b
+                    LEFT JOIN rcc_ledger_checkpoints cp ON cp.id = (
+                        SELECT id FROM rcc_ledger_checkpoints
+                        WHERE user_id = b.user_id ORDER BY ledger_id DESC LIMIT 1
+                    )
+                    JOIN rcc_ledger l ON l.user_id = b.user_id AND l.id > COALESCE(cp.ledger_id, 0)
+                    GROUP BY b.user_id
+                    HAVING COUNT(l.id) >= ?
+                """, (min_entries,))
+                return cursor.rowcount
+            return await run_sqlite(_execute)
+
+    async def verify_ledger_checkpoints(self) -> List[Dict[str, Any]]:
+        """
+        Recompute every checkpoint from the raw ledger.
+        Returns the checkpoints that do not match (empty when consistent).
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("verify_ledger_checkpoints", {}).execute()
+            return result.data or []
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT * FROM (
+                        SELECT c.id, c.user_id, c.ledger_id, c.balance, c.entry_count,
+                               (SELECT COALESCE(SUM(delta), 0) FROM rcc_ledger l
+                                WHERE l.user_id = c.user_id AND l.id <= c.ledger_id) AS ledger_balance,
+                               (SELECT COUNT(*) FROM rcc_ledger l
+                                WHERE l.user_id = c.user_id AND l.id <= c.ledger_id) AS ledger_entry_count
+                        FROM rcc_ledger_checkpoints c
+                    )
+                    WHERE balance != ledger_balance OR entry_count != ledger_entry_count
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
+
+    async def rebuild_ledger_checkpoints(self, every: int = 1000) -> int:
+        """
+        Drop all checkpoints and recompute them from the raw ledger,
+        one every `every` entries per user. Returns the number written.
+        """
+        if self.use_supabase:
+            result = await supabase.rpc("rebuild_ledger_checkpoints", {"p_every": every}).execute()
+            return result.data or 0
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                return _rebuild_sqlite_ledger_checkpoints(cursor, every)
+            return await run_sqlite(_execute)
+
     async def get_total_rcc_consumed(self, since: Optional[datetime] = None) -> int:
         """Get total RCC consumed (negative deltas for JOB_RESERVE)"""
         if self.use_supabase:
-            query = supabase.table("rcc_ledger").select("delta").eq("reason", "JOB_RESERVE")
-            if since:
-                query = query.gte("created_at", since.isoformat())
-            result = query.execute()
-            return abs(sum(entry["delta"] for entry in result.data)) if result.data else 0
+            result = await supabase.rpc("get_total_rcc_consumed", {
+                "p_since": since.isoformat() if since else None
+            }).execute()
+            return result.data or 0
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 if since:
                     cursor.execute(
@@ -500,6 +1535,7 @@ class Database:
                 else:
                     cursor.execute("SELECT COALESCE(SUM(ABS(delta)), 0) FROM rcc_ledger WHERE reason = 'JOB_RESERVE'")
                 return cursor.fetchone()[0]
+            return await run_sqlite(_execute)
     
     # -------------------- Payments --------------------
     
@@ -507,7 +1543,7 @@ class Database:
                             currency: str = "usd", external_ref: Optional[str] = None,
                             stripe_event_id: Optional[str] = None) -> Dict[str, Any]:
         if self.use_supabase:
-            result = supabase.table("payments").insert({
+            result = await supabase.table("payments").insert({
                 "user_id": user_id,
                 "type": payment_type,
                 "amount": amount,
@@ -518,7 +1554,7 @@ class Database:
             }).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO payments (user_id, type, amount, currency, status, external_ref, stripe_event_id) 
@@ -529,13 +1565,14 @@ class Database:
                 cursor.execute("SELECT * FROM payments WHERE id = ?", (payment_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def update_payment(self, payment_id: int, **kwargs) -> Optional[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("payments").update(kwargs).eq("id", payment_id).execute()
+            result = await supabase.table("payments").update(kwargs).eq("id", payment_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
                 values = list(kwargs.values()) + [payment_id]
@@ -543,47 +1580,56 @@ class Database:
                 cursor.execute("SELECT * FROM payments WHERE id = ?", (payment_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_payment_by_stripe_event(self, stripe_event_id: str) -> Optional[Dict[str, Any]]:
         """Check idempotency - has this Stripe event been processed?"""
         if self.use_supabase:
-            result = supabase.table("payments").select("*").eq("stripe_event_id", stripe_event_id).execute()
+            result = await supabase.table("payments").select("*").eq("stripe_event_id", stripe_event_id).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM payments WHERE stripe_event_id = ?", (stripe_event_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
     async def get_user_payments(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
         if self.use_supabase:
-            result = supabase.table("payments").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
+            result = await supabase.table("payments").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
             return result.data
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     "SELECT * FROM payments WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
                     (user_id, limit)
                 )
                 return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
     
     # -------------------- Logs --------------------
     
     async def add_log(self, action: str, user_id: Optional[int] = None, ip: Optional[str] = None,
-                     details: Optional[str] = None, status: str = "success") -> Dict[str, Any]:
+                     details: Optional[str] = None, status: str = "success",
+                     sync: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Record an audit log entry.
+        Entries are buffered and written in batches when the log buffer is running;
+        pass sync=True for security-critical actions that must be stored before returning.
+        Returns the stored row for synchronous writes, None when buffered.
+        """
+        entry = {"user_id": user_id, "ip": ip, "action": action, "details": details, "status": status}
+        if not sync and log_buffer.running:
+            await log_buffer.add(entry)
+            return None
+        
         if self.use_supabase:
-            result = supabase.table("logs").insert({
-                "user_id": user_id,
-                "ip": ip,
-                "action": action,
-                "details": details,
-                "status": status
-            }).execute()
+            result = await supabase.table("logs").insert(entry).execute()
             return result.data[0] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     "INSERT INTO logs (user_id, ip, action, details, status) VALUES (?, ?, ?, ?, ?)",
@@ -593,73 +1639,117 @@ class Database:
                 cursor.execute("SELECT * FROM logs WHERE id = ?", (log_id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
+            return await run_sqlite(_execute)
     
-    async def get_logs(self, limit: int = 100, offset: int = 0, action: Optional[str] = None) -> List[Dict[str, Any]]:
+    async def insert_logs(self, entries: List[Dict[str, Any]]) -> int:
+        """Bulk insert audit log entries (used by the log buffer); created_at is a UTC datetime"""
+        if not entries:
+            return 0
         if self.use_supabase:
-            query = supabase.table("logs").select("*")
-            if action:
-                query = query.eq("action", action)
-            result = query.order("created_at", desc=True).range(offset, offset + limit - 1).execute()
-            return result.data
+            await supabase.table("logs").insert([
+                {**e, "created_at": e["created_at"].isoformat() + "+00:00"} for e in entries
+            ]).execute()
+            return len(entries)
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                if action:
-                    cursor.execute(
-                        "SELECT * FROM logs WHERE action = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                        (action, limit, offset)
-                    )
-                else:
-                    cursor.execute(
-                        "SELECT * FROM logs ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                        (limit, offset)
-                    )
-                return [dict(row) for row in cursor.fetchall()]
+                cursor.executemany(
+                    "INSERT INTO logs (user_id, ip, action, details, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(e["user_id"], e["ip"], e["action"], e["details"], e["status"],
+                      e["created_at"].strftime("%Y-%m-%d %H:%M:%S")) for e in entries]
+                )
+                return len(entries)
+            return await run_sqlite(_execute)
+    
+    async def get_logs(self, limit: int = 100, offset: int = 0, action: Optional[str] = None,
+                       cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Audit logs (optionally by action), newest first; pass `cursor` for keyset pagination"""
+        return await self._fetch_page("logs", {"action": action} if action else {}, limit, offset, cursor)
     
     # -------------------- App Settings --------------------
     
     async def get_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """Get an application setting by key"""
         if self.use_supabase:
-            result = supabase.table("app_settings").select("value").eq("key", key).execute()
+            result = await supabase.table("app_settings").select("value").eq("key", key).execute()
             if result.data:
                 return result.data[0]["value"]
             return default
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT value FROM app_settings WHERE key = ?", (key,))
                 row = cursor.fetchone()
                 return row["value"] if row else default
+            return await run_sqlite(_execute)
     
     async def set_setting(self, key: str, value: str) -> bool:
         """Set an application setting (upsert)"""
         if self.use_supabase:
-            result = supabase.table("app_settings").upsert({
+            result = await supabase.table("app_settings").upsert({
                 "key": key,
                 "value": value,
                 "updated_at": datetime.utcnow().isoformat()
             }).execute()
             return bool(result.data)
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     "INSERT OR REPLACE INTO app_settings (key, value, updated_at) VALUES (?, ?, ?)",
                     (key, value, datetime.utcnow().isoformat())
                 )
                 return True
+            return await run_sqlite(_execute)
     
     async def get_all_settings(self) -> Dict[str, str]:
         """Get all application settings as a dictionary"""
         if self.use_supabase:
-            result = supabase.table("app_settings").select("*").execute()
+            result = await supabase.table("app_settings").select("*").execute()
             return {row["key"]: row["value"] for row in result.data}
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute("SELECT key, value FROM app_settings")
                 return {row["key"]: row["value"] for row in cursor.fetchall()}
+            return await run_sqlite(_execute)
+    
+    # -------------------- ComfyUI Startups --------------------
+    
+    async def record_comfyui_startup(self, attempt: Dict[str, Any]) -> Optional[int]:
+        """Store one container start attempt (keys are the comfyui_startups columns)"""
+        row = {key: attempt.get(key) for key in STARTUP_COLUMNS}
+        if self.use_supabase:
+            row["image_pulled"] = bool(row["image_pulled"])
+            row["container_created"] = bool(row["container_created"])
+            result = await supabase.table("comfyui_startups").insert(row).execute()
+            return result.data[0]["id"] if result.data else None
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"INSERT INTO comfyui_startups ({', '.join(STARTUP_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(STARTUP_COLUMNS))})",
+                    [row[key] for key in STARTUP_COLUMNS]
+                )
+                return cursor.lastrowid
+            return await run_sqlite(_execute)
+    
+    async def get_comfyui_startups(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent container start attempts, newest first"""
+        if self.use_supabase:
+            result = await supabase.table("comfyui_startups").select("*")\
+                .order("started_at", desc=True).limit(limit).execute()
+            return result.data
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT * FROM comfyui_startups ORDER BY started_at DESC, id DESC LIMIT ?",
+                    (limit,)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
     
     # -------------------- GPU Usage --------------------
     
@@ -679,7 +1769,7 @@ class Database:
     ) -> Optional[int]:
         """Log GPU usage record"""
         if self.use_supabase:
-            result = supabase.table("gpu_usage").insert({
+            result = await supabase.table("gpu_usage").insert({
                 "user_id": user_id,
                 "job_id": job_id,
                 "gpu_id": gpu_id,
@@ -694,7 +1784,7 @@ class Database:
             }).execute()
             return result.data[0]["id"] if result.data else None
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
                 cursor.execute(
                     """INSERT INTO gpu_usage 
@@ -704,34 +1794,90 @@ class Database:
                     (user_id, job_id, gpu_id, gpu_name, memory_used_mb, memory_total_mb,
                      gpu_utilization, memory_utilization, temperature_c, power_draw_w, duration_seconds)
                 )
-                return cursor.lastrowid
+                record_id = cursor.lastrowid
+                _apply_sqlite_usage_rollups(cursor, record_id)
+                return record_id
+            return await run_sqlite(_execute)
     
-    async def get_gpu_usage_stats(self, user_id: Optional[int] = None, days: int = 30) -> Dict[str, Any]:
-        """Get GPU usage statistics, optionally filtered by user"""
+    async def insert_gpu_usage(self, rows: List[Dict[str, Any]]) -> int:
+        """Bulk insert gpu_usage rows (per-job summaries from the GPU usage recorder)"""
+        if not rows:
+            return 0
         if self.use_supabase:
-            query = supabase.table("gpu_usage").select("*")
+            await supabase.table("gpu_usage").insert(rows).execute()
+            return len(rows)
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                # Hold the write lock so every id above the current maximum is from this batch
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM gpu_usage")
+                first_id = cursor.fetchone()[0] + 1
+                cursor.executemany(
+                    f"INSERT INTO gpu_usage ({', '.join(GPU_USAGE_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(GPU_USAGE_COLUMNS))})",
+                    [[row.get(key) for key in GPU_USAGE_COLUMNS] for row in rows]
+                )
+                _apply_sqlite_usage_rollups(cursor, first_id)
+                return len(rows)
+            return await run_sqlite(_execute)
+    
+    async def get_gpu_usage_stats(self, user_id: Optional[int] = None, days: int = 30,
+                                  hours: Optional[float] = None) -> Dict[str, Any]:
+        """
+        GPU usage statistics, optionally filtered by user. Totals come from the rollup
+        resolution that fits the window, so their cost does not grow with its length.
+        """
+        window = hours * 3600 if hours else days * 86400
+        resolution, bucket_since = rollup_window(window)
+        since = (datetime.utcnow() - timedelta(seconds=window)).isoformat()
+        if self.use_supabase:
+            query = supabase.table("gpu_usage").select("*").gte("recorded_at", since)
             if user_id:
                 query = query.eq("user_id", user_id)
-            result = query.gte("recorded_at", (datetime.utcnow() - timedelta(days=days)).isoformat()).execute()
-            records = result.data
+            summary_result, records_result = await asyncio.gather(
+                supabase.rpc("get_gpu_usage_summary", {
+                    "p_resolution": resolution,
+                    "p_since": bucket_since.isoformat(),
+                    "p_user_id": user_id or None
+                }).execute(),
+                query.order("recorded_at", desc=True).limit(100).execute()
+            )
+            summary = summary_result.data[0] if summary_result.data else {}
+            records = records_result.data
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                date_threshold = (datetime.utcnow() - timedelta(days=days)).isoformat()
+                where = "resolution = ? AND bucket >= ?"
+                params: list = [resolution, bucket_since.strftime("%Y-%m-%d %H:%M:%S")]
                 if user_id:
-                    cursor.execute(
-                        "SELECT * FROM gpu_usage WHERE user_id = ? AND recorded_at >= ? ORDER BY recorded_at DESC",
-                        (user_id, date_threshold)
-                    )
-                else:
-                    cursor.execute(
-                        "SELECT * FROM gpu_usage WHERE recorded_at >= ? ORDER BY recorded_at DESC",
-                        (date_threshold,)
-                    )
-                records = [dict(row) for row in cursor.fetchall()]
+                    where += " AND user_id = ?"
+                    params.append(user_id)
+                cursor.execute(
+                    f"""SELECT COALESCE(SUM(records), 0) as total_records,
+                               COALESCE(SUM(duration_seconds), 0) as total_duration_seconds,
+                               SUM(gpu_utilization_sum) / NULLIF(SUM(gpu_utilization_count), 0) as avg_gpu_utilization,
+                               SUM(memory_utilization_sum) / NULLIF(SUM(memory_utilization_count), 0) as avg_memory_utilization,
+                               MAX(peak_memory_mb) as peak_memory_mb,
+                               SUM(power_draw_sum) / NULLIF(SUM(power_draw_count), 0) as avg_power_draw_w,
+                               COALESCE(SUM(energy_wh), 0) as total_energy_wh
+                        FROM gpu_usage_rollups WHERE {where}""",
+                    params
+                )
+                summary = dict(cursor.fetchone())
+                where = "recorded_at >= ?"
+                params = [since.replace("T", " ")]
+                if user_id:
+                    where += " AND user_id = ?"
+                    params.append(user_id)
+                cursor.execute(
+                    f"SELECT * FROM gpu_usage WHERE {where} ORDER BY recorded_at DESC LIMIT 100",
+                    params
+                )
+                return summary, [dict(row) for row in cursor.fetchall()]
+            summary, records = await run_sqlite(_execute)
         
-        # Calculate statistics
-        if not records:
+        if not summary.get("total_records"):
             return {
                 "total_records": 0,
                 "total_duration_seconds": 0,
@@ -739,80 +1885,376 @@ class Database:
                 "avg_memory_utilization": 0,
                 "peak_memory_mb": 0,
                 "avg_power_draw_w": 0,
+                "total_energy_wh": 0,
+                "resolution": resolution,
                 "records": []
             }
         
-        total_duration = sum(r.get("duration_seconds") or 0 for r in records)
-        gpu_utils = [r.get("gpu_utilization") for r in records if r.get("gpu_utilization") is not None]
-        mem_utils = [r.get("memory_utilization") for r in records if r.get("memory_utilization") is not None]
-        mem_used = [r.get("memory_used_mb") for r in records if r.get("memory_used_mb") is not None]
-        power = [r.get("power_draw_w") for r in records if r.get("power_draw_w") is not None]
-        
+        total_duration = summary.get("total_duration_seconds") or 0
         return {
-            "total_records": len(records),
+            "total_records": summary["total_records"],
             "total_duration_seconds": total_duration,
             "total_duration_hours": round(total_duration / 3600, 2),
-            "avg_gpu_utilization": round(sum(gpu_utils) / len(gpu_utils), 1) if gpu_utils else 0,
-            "avg_memory_utilization": round(sum(mem_utils) / len(mem_utils), 1) if mem_utils else 0,
-            "peak_memory_mb": max(mem_used) if mem_used else 0,
-            "avg_power_draw_w": round(sum(power) / len(power), 1) if power else 0,
-            "records": records[:100]  # Return last 100 records
+            "avg_gpu_utilization": round(summary.get("avg_gpu_utilization") or 0, 1),
+            "avg_memory_utilization": round(summary.get("avg_memory_utilization") or 0, 1),
+            "peak_memory_mb": summary.get("peak_memory_mb") or 0,
+            "avg_power_draw_w": round(summary.get("avg_power_draw_w") or 0, 1),
+            "total_energy_wh": round(summary.get("total_energy_wh") or 0, 3),
+            "resolution": resolution,
+            "records": records  # Last 100 records
         }
     
-    async def get_gpu_usage_by_user(self, days: int = 30) -> List[Dict[str, Any]]:
-        """Get GPU usage aggregated by user"""
+    async def get_gpu_usage_by_user(self, days: int = 30, hours: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Get GPU usage aggregated by user (from the rollups, like get_gpu_usage_stats)"""
+        resolution, since = rollup_window(hours * 3600 if hours else days * 86400)
         if self.use_supabase:
-            # Supabase doesn't support GROUP BY easily, fetch all and aggregate in Python
-            result = supabase.table("gpu_usage").select("*").gte(
-                "recorded_at", (datetime.utcnow() - timedelta(days=days)).isoformat()
-            ).execute()
-            records = result.data
+            result = await supabase.rpc("get_gpu_usage_by_user", {
+                "p_resolution": resolution,
+                "p_since": since.isoformat()
+            }).execute()
+            return result.data or []
         else:
-            with get_sqlite_connection() as conn:
+            def _execute(conn):
                 cursor = conn.cursor()
-                date_threshold = (datetime.utcnow() - timedelta(days=days)).isoformat()
                 cursor.execute(
-                    """SELECT user_id, 
-                              COUNT(*) as record_count,
+                    """SELECT NULLIF(user_id, 0) as user_id,
+                              SUM(records) as record_count,
                               SUM(duration_seconds) as total_duration,
-                              AVG(gpu_utilization) as avg_gpu_util,
-                              AVG(memory_utilization) as avg_mem_util,
-                              MAX(memory_used_mb) as peak_memory
-                       FROM gpu_usage 
-                       WHERE recorded_at >= ?
+                              COALESCE(ROUND(SUM(gpu_utilization_sum) / NULLIF(SUM(gpu_utilization_count), 0), 1), 0) as avg_gpu_util,
+                              COALESCE(ROUND(SUM(memory_utilization_sum) / NULLIF(SUM(memory_utilization_count), 0), 1), 0) as avg_mem_util,
+                              COALESCE(MAX(peak_memory_mb), 0) as peak_memory,
+                              SUM(energy_wh) as total_energy_wh
+                       FROM gpu_usage_rollups
+                       WHERE resolution = ? AND bucket >= ?
                        GROUP BY user_id
                        ORDER BY total_duration DESC""",
-                    (date_threshold,)
+                    (resolution, since.strftime("%Y-%m-%d %H:%M:%S"))
                 )
                 return [dict(row) for row in cursor.fetchall()]
+            return await run_sqlite(_execute)
+    
+    async def add_gpu_metric_minutes(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Merge per-minute GPU metric aggregates (bucket "YYYY-MM-DD HH:MM:00" UTC plus
+        GPU_METRIC_COLUMNS) into the minute, hour and day rows of gpu_metric_rollups
+        """
+        if not rows:
+            return 0
+        if self.use_supabase:
+            await supabase.rpc("add_gpu_metric_minutes", {"p_rows": rows}).execute()
+            return len(rows)
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                for resolution, (_, bucket_format) in ROLLUP_RESOLUTIONS.items():
+                    cursor.executemany(
+                        f"""INSERT INTO gpu_metric_rollups (resolution, bucket, {', '.join(GPU_METRIC_COLUMNS)})
+                            VALUES (?, strftime(?, ?), {', '.join('?' * len(GPU_METRIC_COLUMNS))})
+                            ON CONFLICT (resolution, bucket, gpu_id) DO UPDATE SET
+                                samples = samples + excluded.samples,
+                                gpu_utilization_sum = gpu_utilization_sum + excluded.gpu_utilization_sum,
+                                memory_used_sum = memory_used_sum + excluded.memory_used_sum,
+                                memory_used_max = MAX(COALESCE(memory_used_max, excluded.memory_used_max), COALESCE(excluded.memory_used_max, memory_used_max)),
+                                power_draw_sum = power_draw_sum + excluded.power_draw_sum,
+                                power_draw_count = power_draw_count + excluded.power_draw_count,
+                                temperature_max = MAX(COALESCE(temperature_max, excluded.temperature_max), COALESCE(excluded.temperature_max, temperature_max))""",
+                        [[resolution, bucket_format, row["bucket"]] + [row.get(key) for key in GPU_METRIC_COLUMNS]
+                         for row in rows]
+                    )
+                return len(rows)
+            return await run_sqlite(_execute)
+    
+    async def get_gpu_metric_series(self, gpu_id: int = 0, hours: float = 24) -> Dict[str, Any]:
+        """One point per rollup bucket of the window (at most GPU_ROLLUP_MAX_BUCKETS), oldest first"""
+        resolution, since = rollup_window(hours * 3600)
+        columns = f"bucket, {', '.join(GPU_METRIC_COLUMNS)}"
+        if self.use_supabase:
+            result = await supabase.table("gpu_metric_rollups").select(columns) \
+                .eq("resolution", resolution).eq("gpu_id", gpu_id).gte("bucket", since.isoformat()) \
+                .order("bucket").limit(GPU_ROLLUP_MAX_BUCKETS + 1).execute()
+            rows = result.data
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""SELECT {columns} FROM gpu_metric_rollups
+                        WHERE resolution = ? AND gpu_id = ? AND bucket >= ?
+                        ORDER BY bucket""",
+                    (resolution, gpu_id, since.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                return [dict(row) for row in cursor.fetchall()]
+            rows = await run_sqlite(_execute)
         
-        # Aggregate in Python for Supabase
-        from collections import defaultdict
-        user_stats = defaultdict(lambda: {
-            "record_count": 0, "total_duration": 0, "gpu_utils": [], "mem_utils": [], "peak_memory": 0
-        })
-        for r in records:
-            uid = r.get("user_id")
-            user_stats[uid]["record_count"] += 1
-            user_stats[uid]["total_duration"] += r.get("duration_seconds") or 0
-            if r.get("gpu_utilization") is not None:
-                user_stats[uid]["gpu_utils"].append(r["gpu_utilization"])
-            if r.get("memory_utilization") is not None:
-                user_stats[uid]["mem_utils"].append(r["memory_utilization"])
-            if r.get("memory_used_mb") and r["memory_used_mb"] > user_stats[uid]["peak_memory"]:
-                user_stats[uid]["peak_memory"] = r["memory_used_mb"]
-        
-        result = []
-        for uid, stats in user_stats.items():
-            result.append({
-                "user_id": uid,
-                "record_count": stats["record_count"],
-                "total_duration": stats["total_duration"],
-                "avg_gpu_util": round(sum(stats["gpu_utils"]) / len(stats["gpu_utils"]), 1) if stats["gpu_utils"] else 0,
-                "avg_mem_util": round(sum(stats["mem_utils"]) / len(stats["mem_utils"]), 1) if stats["mem_utils"] else 0,
-                "peak_memory": stats["peak_memory"]
+        points = []
+        for row in rows:
+            samples = row["samples"] or 0
+            if not samples:
+                continue
+            points.append({
+                "bucket": str(row["bucket"]),
+                "samples": samples,
+                "gpu_utilization": round(row["gpu_utilization_sum"] / samples, 1),
+                "memory_used_mb": round(row["memory_used_sum"] / samples),
+                "memory_used_max_mb": row["memory_used_max"],
+                "power_draw_w": round(row["power_draw_sum"] / row["power_draw_count"], 1) if row["power_draw_count"] else None,
+                "temperature_max_c": row["temperature_max"],
             })
-        return sorted(result, key=lambda x: x["total_duration"], reverse=True)
+        return {"resolution": resolution, "since": since.isoformat(), "points": points}
+    
+    async def prune_gpu_rollups(self) -> int:
+        """Delete minute and hour rollups older than GPU_ROLLUP_RETENTION_DAYS. Returns rows deleted."""
+        cutoffs = {
+            resolution: datetime.utcnow() - timedelta(days=days)
+            for resolution, days in GPU_ROLLUP_RETENTION_DAYS.items()
+        }
+        if self.use_supabase:
+            deleted = 0
+            for table in ("gpu_usage_rollups", "gpu_metric_rollups"):
+                for resolution, cutoff in cutoffs.items():
+                    result = await supabase.table(table).delete() \
+                        .eq("resolution", resolution).lt("bucket", cutoff.isoformat()).execute()
+                    deleted += len(result.data or [])
+            return deleted
+        else:
+            def _execute(conn):
+                cursor = conn.cursor()
+                deleted = 0
+                for table in ("gpu_usage_rollups", "gpu_metric_rollups"):
+                    for resolution, cutoff in cutoffs.items():
+                        cursor.execute(
+                            f"DELETE FROM {table} WHERE resolution = ? AND bucket < ?",
+                            (resolution, cutoff.strftime("%Y-%m-%d %H:%M:%S"))
+                        )
+                        deleted += cursor.rowcount
+                return deleted
+            return await run_sqlite(_execute)
+    
+    async def _fetch_columns(self, table: str, columns: tuple, since_column: str,
+                             since: datetime, limit: int) -> Dict[str, np.ndarray]:
+        """
+        The given (name, dtype) columns of the newest `limit` rows with since_column >= since,
+        as one NumPy array per column; NULL integers read as 0 and NULL floats as NaN.
+        SQLite streams the cursor straight into a record array; Supabase returns the
+        columns from one RPC call (get_<table>_stat_columns) instead of 1000-row pages.
+        """
+        dtype = np.dtype(list(columns))
+        if self.use_supabase:
+            result = await supabase.rpc(f"get_{table}_stat_columns", {
+                "p_since": since.isoformat(),
+                "p_limit": limit
+            }).execute()
+            data = result.data or {}
+            return {name: np.array(data.get(name) or [], dtype=kind) for name, kind in columns}
+        else:
+            def _execute(conn):
+                # Floats are never negative here; -1 stands for NULL (SQLite has no NaN)
+                select = ", ".join(
+                    name if kind.startswith("U") else f"COALESCE({name}, {0 if kind == 'i8' else -1})"
+                    for name, kind in columns
+                )
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(
+                    f"""SELECT {select} FROM {table}
+                        WHERE {since_column} >= ? ORDER BY id DESC LIMIT ?""",
+                    (since.strftime("%Y-%m-%d %H:%M:%S"), limit)
+                )
+                return np.fromiter(cursor, dtype=dtype)
+            rows = await run_sqlite(_execute)
+            data = {name: np.ascontiguousarray(rows[name]) for name, _ in columns}
+            for name, kind in columns:
+                if kind == "f8":
+                    data[name][data[name] < 0] = np.nan
+            return data
+    
+    async def get_job_stat_columns(self, since: datetime, limit: int) -> Dict[str, np.ndarray]:
+        """id, type, user_id and duration_ms of jobs created since `since`, as arrays"""
+        return await self._fetch_columns("jobs", JOB_STAT_COLUMNS, "created_at", since, limit)
+    
+    async def get_gpu_usage_stat_columns(self, since: datetime, limit: int) -> Dict[str, np.ndarray]:
+        """job_id, user_id, GPU utilisation and memory of gpu_usage rows since `since`, as arrays"""
+        return await self._fetch_columns("gpu_usage", GPU_USAGE_STAT_COLUMNS, "recorded_at", since, limit)
+
+# ============================================
+# Buffered Audit Log Writer
+# ============================================
+
+# Audit logs are written in batches off the request path (LOG_BUFFER_ENABLED=false writes inline)
+LOG_BUFFER_ENABLED = os.getenv("LOG_BUFFER_ENABLED", "true").lower() == "true"
+LOG_BUFFER_MAX_SIZE = int(os.getenv("LOG_BUFFER_MAX_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+
+
+class LogBuffer:
+    """
+    Write-behind buffer for audit log entries.
+    Entries are flushed with one bulk insert when LOG_BATCH_SIZE are pending or
+    every LOG_FLUSH_INTERVAL seconds. Memory is bounded by LOG_BUFFER_MAX_SIZE:
+    when full, the caller waits for a flush instead of entries being dropped.
+    """
+    
+    def __init__(self, max_size: int, batch_size: int, interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._pending: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+    
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flusher and write out everything still pending"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Let the loop finish its current insert instead of cancelling it mid-batch
+        self._stopping = True
+        self._wakeup.set()
+        await task
+        await self.flush()
+    
+    async def add(self, entry: Dict[str, Any]):
+        entry["created_at"] = datetime.utcnow()
+        if len(self._pending) >= self.max_size:
+            await self.flush()
+            if len(self._pending) >= self.max_size:
+                # Database is failing; write this entry directly so errors reach the caller
+                await db.insert_logs([entry])
+                return
+        self._pending.append(entry)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+    
+    async def flush(self) -> int:
+        """Write all pending entries in batches. Returns the number written."""
+        written = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                try:
+                    written += await db.insert_logs(batch)
+                except asyncio.CancelledError:
+                    # The caller was cancelled (e.g. client disconnect); keep the batch for the next flush
+                    self._pending.extendleft(reversed(batch))
+                    raise
+                except Exception as e:
+                    # Put the batch back (up to the memory bound) and retry on the next flush
+                    room = max(0, self.max_size - len(self._pending))
+                    self._pending.extendleft(reversed(batch[:room]))
+                    self.dropped += len(batch) - min(room, len(batch))
+                    print(f"[WARNING] Failed to write {len(batch)} audit log entries: {e}")
+                    break
+        return written
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+log_buffer = LogBuffer(LOG_BUFFER_MAX_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL)
+
+
+# ============================================
+# Authenticated Principal Cache
+# ============================================
+
+# Users resolved from access tokens are cached for a few seconds so bursts of
+# authenticated requests (e.g. gallery thumbnails) skip the users lookup.
+# AUTH_CACHE_TTL=0 disables the cache.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+
+
+class PrincipalCache:
+    """
+    Size-bounded LRU of rows (user rows by user id, API keys by prefix), each
+    entry valid for `ttl` seconds. Database.update_user and revoke_api_key
+    invalidate the affected entry, so role changes and revocations apply on the
+    next request in this process; other workers pick them up when their entry
+    expires.
+    """
+    
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+    
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, row = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Callers get their own copy so request handlers cannot mutate the cached row
+        return dict(row)
+    
+    def put(self, key, row: Dict[str, Any]):
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, dict(row))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl,
+            "max_size": self.max_size,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+principal_cache = PrincipalCache(AUTH_CACHE_TTL, AUTH_CACHE_MAX_SIZE)
+api_key_cache = PrincipalCache(AUTH_CACHE_TTL, AUTH_CACHE_MAX_SIZE)
 
 
 # ============================================
@@ -827,5 +2269,20 @@ def init_db():
         print("✅ Using Supabase - ensure tables are created via Supabase dashboard")
 
 
+def start_log_buffer():
+    """Start buffered audit log writes (call from a running event loop)"""
+    if LOG_BUFFER_ENABLED:
+        log_buffer.start()
+
+
+async def close_db():
+    """Flush buffered logs, then release database resources (Supabase HTTP pool, SQLite connection pool)"""
+    await log_buffer.stop()
+    if supabase is not None:
+        await supabase.aclose()
+    if sqlite_pool is not None:
+        sqlite_pool.close()
+
+
 # Global database instance
 db = Database()
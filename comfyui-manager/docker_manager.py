@@ -10,15 +10,22 @@ Requires Docker socket mounted at /var/run/docker.sock when containerized.
 import asyncio
 import os
 import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Set
 from enum import Enum
-from datetime import datetime
+from datetime import datetime, timedelta, date
 
 import docker
+import httpx
 from docker.errors import NotFound, APIError, ImageNotFound
 from dotenv import load_dotenv
 
+from database import db
+
 load_dotenv()
 
 # Get the directory for logs
@@ -30,6 +37,37 @@ STARTUP_LOG_FILE = LOGS_DIR / "comfyui_startup.log"
 COMFYUI_PORT = int(os.getenv("COMFYUI_PORT", "8188"))
 COMFYUI_PUBLIC_PORT = int(os.getenv("COMFYUI_PUBLIC_PORT", os.getenv("COMFYUI_PORT", "8188")))
 COMFYUI_INTERNAL_HOST = os.getenv("COMFYUI_INTERNAL_HOST", "localhost")
+COMFYUI_INTERNAL_URL = f"http://{COMFYUI_INTERNAL_HOST}:{COMFYUI_PORT}"
+
+# Docker SDK calls are blocking; they run on this many dedicated threads
+DOCKER_EXECUTOR_WORKERS = int(os.getenv("DOCKER_EXECUTOR_WORKERS", "4"))
+DOCKER_STOP_TIMEOUT = int(os.getenv("DOCKER_STOP_TIMEOUT", "30"))
+# Finished stop/restart operations kept for GET /comfyui/operations/{id}
+DOCKER_OPERATION_HISTORY = 50
+# Container state is kept in memory from the Docker events API, with a full resync this often
+DOCKER_RESYNC_INTERVAL = float(os.getenv("DOCKER_RESYNC_INTERVAL", "30"))
+# Startup log: buffered file writes flushed at this interval, recent lines kept in memory
+STARTUP_LOG_FLUSH_INTERVAL = float(os.getenv("STARTUP_LOG_FLUSH_INTERVAL", "1.0"))
+STARTUP_LOG_RING_LINES = int(os.getenv("STARTUP_LOG_RING_LINES", "2000"))
+# ComfyUI is ready once /system_stats answers; polled from container start with exponential
+# backoff (STARTUP_PROBE_INTERVAL doubling up to STARTUP_PROBE_MAX_INTERVAL seconds)
+STARTUP_PROBE_INTERVAL = float(os.getenv("STARTUP_PROBE_INTERVAL", "0.25"))
+STARTUP_PROBE_MAX_INTERVAL = float(os.getenv("STARTUP_PROBE_MAX_INTERVAL", "5"))
+STARTUP_READY_TIMEOUT = float(os.getenv("STARTUP_READY_TIMEOUT", "600"))
+# Longest a client may block in wait_until_ready (GET /comfyui/ready, POST /comfyui/start?wait=true)
+READY_WAIT_MAX_TIMEOUT = float(os.getenv("READY_WAIT_MAX_TIMEOUT", "120"))
+# Lifecycle: stop ComfyUI after this many minutes without jobs (0 = never), checked every
+# LIFECYCLE_CHECK_INTERVAL seconds; pre-warm on the first login of the day and on queued jobs
+IDLE_SHUTDOWN_MINUTES = float(os.getenv("IDLE_SHUTDOWN_MINUTES", "30"))
+LIFECYCLE_CHECK_INTERVAL = float(os.getenv("LIFECYCLE_CHECK_INTERVAL", "60"))
+PREWARM_ON_FIRST_LOGIN = os.getenv("PREWARM_ON_FIRST_LOGIN", "true").lower() == "true"
+PREWARM_ON_QUEUED_JOBS = os.getenv("PREWARM_ON_QUEUED_JOBS", "true").lower() == "true"
+# Queued/running jobs older than this are treated as abandoned, not as activity
+ACTIVE_JOB_MAX_AGE = timedelta(hours=6)
+# Cap on one incremental read that has to fall back to the file
+STARTUP_LOG_MAX_READ = 256 * 1024
+# Docker events that change what get_status reports
+WATCHED_EVENTS = ["create", "start", "restart", "stop", "die", "kill", "destroy", "health_status"]
 
 # Container configuration (matches docker-compose-comfyui.yml)
 CONTAINER_NAME = "comfyui"
@@ -82,15 +120,204 @@ class ContainerStatus(str, Enum):
     NOT_FOUND = "not_found"
 
 
+class OperationState(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class StartupLog:
+    """
+    Startup/pull log written by the startup thread and read by request handlers.
+    One buffered file handle per startup, flushed every STARTUP_LOG_FLUSH_INTERVAL
+    seconds by a timer thread (also through quiet phases), plus a ring buffer of the last STARTUP_LOG_RING_LINES lines with their
+    byte offsets, so readers fetch only what was written after a given offset.
+    """
+    
+    def __init__(self, path: Path, ring_lines: int, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.size = 0  # bytes written since begin(), i.e. the offset of the next line
+        self._ring: deque = deque(maxlen=ring_lines)  # (start_offset, line)
+        self._file = None
+        self._stop_flusher: Optional[threading.Event] = None
+        self._lock = threading.Lock()
+        # Pick up a log left by a previous process so it is still viewable
+        if path.exists():
+            self.size = path.stat().st_size
+    
+    def begin(self, header: str):
+        """Start a new log (truncates the file and resets offsets)"""
+        self.close()
+        with self._lock:
+            self._file = open(self.path, 'w', encoding='utf-8', buffering=64 * 1024)
+            self._ring.clear()
+            self.size = 0
+            self._stop_flusher = threading.Event()
+        threading.Thread(target=self._flush_periodically, args=(self._stop_flusher,),
+                         name="startup-log-flush", daemon=True).start()
+        self.write(header)
+    
+    def write(self, text: str):
+        """Append text (one or more lines); the timer flushes it to disk within flush_interval"""
+        with self._lock:
+            for line in text.splitlines(keepends=True):
+                self._ring.append((self.size, line))
+                self.size += len(line.encode('utf-8'))
+                if self._file is not None:
+                    self._file.write(line)
+    
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+    
+    def close(self):
+        """Flush and close the file at the end of a startup"""
+        with self._lock:
+            if self._stop_flusher is not None:
+                self._stop_flusher.set()
+                self._stop_flusher = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def _flush_periodically(self, stop: threading.Event):
+        while not stop.wait(self.flush_interval):
+            self.flush()
+    
+    def read(self, after_offset: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Text written after `after_offset` (None = the buffered tail).
+        Returns {"text", "offset"}; pass "offset" back as after_offset for the next read.
+        "reset" is set when after_offset is from an earlier startup.
+        """
+        with self._lock:
+            size = self.size
+            reset = after_offset is not None and after_offset > size
+            if after_offset is None or reset:
+                # Tail: everything still in memory, or the end of a log left by a previous process
+                after_offset = self._ring[0][0] if self._ring else max(0, size - STARTUP_LOG_MAX_READ)
+            if after_offset >= size:
+                return {"text": "", "offset": size, "reset": reset}
+            if self._ring and after_offset >= self._ring[0][0]:
+                lines = [line for start, line in self._ring if start >= after_offset]
+                # after_offset normally falls on a line boundary (a previous "offset")
+                return {"text": "".join(lines), "offset": size, "reset": reset}
+            if self._file is not None:
+                self._file.flush()
+        
+        # Older than the ring buffer: read that range from the file, capped
+        with open(self.path, 'rb') as f:
+            f.seek(after_offset)
+            data = f.read(min(size - after_offset, STARTUP_LOG_MAX_READ))
+        return {"text": data.decode('utf-8', errors='replace'), "offset": after_offset + len(data), "reset": reset}
+
+
+startup_log = StartupLog(STARTUP_LOG_FILE, STARTUP_LOG_RING_LINES, STARTUP_LOG_FLUSH_INTERVAL)
+
+
+class StartupTiming:
+    """
+    Phase timings (seconds) of one container start attempt.
+    prepare/image/create/start run back to back; first_log and ready are measured
+    from the moment container.start() returned; total covers the whole attempt.
+    """
+    
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self.outcome = "running"
+        self.error: Optional[str] = None
+        self.image_pulled = False
+        self.container_created = False
+        self.pull_bytes: Optional[int] = None
+        self.phases: Dict[str, float] = {}
+        self._begin = self._mark = time.monotonic()
+        self._container_started: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def lap(self, phase: Optional[str]):
+        """Close the current phase (None = discard the time since the last lap)"""
+        now = time.monotonic()
+        if phase:
+            self.phases[phase] = now - self._mark
+        self._mark = now
+        if phase == "start":
+            self._container_started = now
+    
+    @property
+    def container_started(self) -> bool:
+        return self._container_started is not None
+    
+    def since_container_start(self, phase: str):
+        """Record a milestone measured from container.start() (first one wins)"""
+        if self._container_started is not None and phase not in self.phases:
+            self.phases[phase] = time.monotonic() - self._container_started
+    
+    def finish(self, outcome: str, error: Optional[str] = None) -> bool:
+        """Mark the attempt finished; False if it already was"""
+        with self._lock:
+            if self.outcome != "running":
+                return False
+            self.outcome = outcome
+            self.error = error
+            self.phases["total"] = time.monotonic() - self._begin
+            return True
+    
+    @property
+    def finished(self) -> bool:
+        return self.outcome != "running"
+    
+    def as_row(self) -> Dict[str, Any]:
+        """comfyui_startups row (phases still running are reported as elapsed so far)"""
+        row = {
+            "started_at": self.started_at.isoformat(),
+            "outcome": self.outcome,
+            "image_pulled": int(self.image_pulled),
+            "container_created": int(self.container_created),
+            "pull_bytes": self.pull_bytes,
+            "error": self.error,
+        }
+        phases = dict(self.phases)
+        phases.setdefault("total", time.monotonic() - self._begin)
+        for phase in ("prepare", "image", "create", "start", "first_log", "ready", "total"):
+            value = phases.get(phase)
+            row[f"{phase}_seconds"] = round(value, 3) if value is not None else None
+        return row
+
+
 class DockerManager:
-    """Manages ComfyUI Docker container operations using Python Docker SDK"""
+    """
+    Manages ComfyUI Docker container operations using Python Docker SDK.
+    SDK calls run on a dedicated thread pool so they never block the event loop;
+    stop and restart are tracked operations that return an operation id at once.
+    """
     
     def __init__(self):
         self.container_name = CONTAINER_NAME
         self.image_name = IMAGE_NAME
         self._status_lock = asyncio.Lock()
         self._startup_thread = None
+        self.current_startup: Optional[StartupTiming] = None
+        self.cold_starts = 0  # image pulled or container created
+        self.warm_starts = 0  # existing container started
         self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=DOCKER_EXECUTOR_WORKERS, thread_name_prefix="docker")
+        self._operations: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._operation_tasks: Dict[str, asyncio.Task] = {}
+        
+        # In-memory container state, maintained by watch() from Docker events
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._snapshot_at: Optional[datetime] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._event_stream = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: set = set()
+        
+        # ComfyUI readiness, set by the /system_stats prober
+        self._ready_event = asyncio.Event()
+        self._probe_task: Optional[asyncio.Task] = None
         
         # Ensure logs directory exists
         LOGS_DIR.mkdir(exist_ok=True)
@@ -168,63 +395,160 @@ class DockerManager:
             dir_path.mkdir(parents=True, exist_ok=True)
             print(f"[INFO] Ensured directory exists: {dir_path}")
     
+    async def _call(self, fn: Callable, *args):
+        """Run a blocking Docker SDK call on the Docker executor"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    
     async def get_status(self) -> Dict[str, Any]:
         """
         Get the current status of the ComfyUI container
+        Served from the event-fed snapshot while watch() runs, otherwise read from Docker.
         Returns: dict with status info
         """
+        if self._snapshot is not None:
+            return self._with_operation(dict(self._snapshot))
+        return self._with_operation(await self._call(self._read_status))
+    
+    def _with_operation(self, status: Dict[str, Any]) -> Dict[str, Any]:
+        # The container is up before ComfyUI serves; "ready" comes from the prober
+        status["ready"] = self.is_ready
+        if status["status"] == ContainerStatus.RUNNING and status.get("health") != "unhealthy":
+            status["message"] = ("ComfyUI is running and ready" if self.is_ready
+                                 else "Container is running, waiting for ComfyUI to respond...")
+        
+        # A stop/restart in flight takes precedence over the container's last reported state
+        operation = self.get_active_operation()
+        if operation:
+            status["status"] = ContainerStatus.STOPPING if operation["type"] == "stop" else ContainerStatus.STARTING
+            status["message"] = operation["progress"]
+            status["operation_id"] = operation["id"]
+        return status
+    
+    # -------------------- Event-driven state --------------------
+    
+    def watch(self):
+        """Keep the status snapshot current from Docker events (call from a running event loop)"""
+        if self._watch_task is None:
+            self._loop = asyncio.get_running_loop()
+            self._watch_task = asyncio.create_task(self._watch())
+    
+    async def stop_watching(self):
+        if self._watch_task is None:
+            return
+        task, self._watch_task = self._watch_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if self._event_stream is not None:
+            self._event_stream.close()
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+        self._snapshot = None
+    
+    def subscribe(self) -> asyncio.Queue:
+        """Queue that receives a wake-up whenever the status changes (pair with unsubscribe)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+    
+    def _publish(self):
+        # Subscribers re-read get_status, so one pending wake-up per queue is enough
+        for queue in self._subscribers:
+            if queue.empty():
+                queue.put_nowait(None)
+    
+    def _set_progress(self, operation: Dict[str, Any], progress: str):
+        operation["progress"] = progress
+        self._publish()
+    
+    def _set_snapshot(self, status: Dict[str, Any]):
+        changed = self._snapshot is None or any(
+            self._snapshot.get(k) != status.get(k) for k in ("status", "message", "health")
+        )
+        self._snapshot = status
+        self._snapshot_at = datetime.utcnow()
+        # Probe a container that is up (also one started outside the portal); forget readiness once it is down
+        if status["status"] == ContainerStatus.RUNNING:
+            self.probe_readiness()
+        elif status["status"] != ContainerStatus.ERROR:
+            self._clear_ready()
+        if changed:
+            self._publish()
+    
+    async def resync(self):
+        """Replace the snapshot with a full read from Docker"""
+        self._set_snapshot(await self._call(self._read_status))
+    
+    def _apply_event(self, event: Dict[str, Any]):
+        """Update the snapshot from one Docker container event (event loop thread)"""
+        action = event.get("Action") or event.get("status", "")
+        health = (self._snapshot or {}).get("health", "")
+        if action.startswith("health_status"):
+            health = action.split(":", 1)[1].strip()
+            self._set_snapshot(self._describe("running", health))
+        elif action in ("start", "restart"):
+            # A container with a healthcheck reports "starting" until the first probe passes
+            self._set_snapshot(self._describe("running", "starting" if health else ""))
+        elif action == "create":
+            self._set_snapshot(self._describe("created"))
+        elif action in ("stop", "die", "kill"):
+            self._set_snapshot(self._describe("exited"))
+        elif action == "destroy":
+            self._set_snapshot(self._describe(None))
+    
+    def _read_events(self):
+        """Blocking Docker events subscription (runs on its own thread until the stream closes)"""
+        client = self._get_client()
+        if not client:
+            return
+        try:
+            self._event_stream = client.events(decode=True, filters={
+                "type": "container",
+                "container": self.container_name,
+                "event": WATCHED_EVENTS,
+            })
+            for event in self._event_stream:
+                self._loop.call_soon_threadsafe(self._apply_event, event)
+        except Exception as e:
+            print(f"[WARNING] Docker events stream ended: {e}")
+        finally:
+            self._event_stream = None
+    
+    async def _watch(self):
+        reader = None
+        while True:
+            # Subscribe before resyncing so no event between the two is missed
+            if reader is None or not reader.is_alive():
+                reader = threading.Thread(target=self._read_events, daemon=True, name="docker-events")
+                reader.start()
+            try:
+                await self.resync()
+            except Exception as e:
+                print(f"[WARNING] Docker status resync failed: {e}")
+            await asyncio.sleep(DOCKER_RESYNC_INTERVAL)
+    
+    def _read_status(self) -> Dict[str, Any]:
+        """Blocking status read (runs on the Docker executor)"""
         try:
             container = self._get_container()
             
             if container is None:
-                return {
-                    "status": ContainerStatus.NOT_FOUND,
-                    "message": "Container not created yet. Click Start to create and run it.",
-                    "container_name": self.container_name
-                }
+                return self._describe(None)
             
             # Refresh container state
             container.reload()
-            container_status = container.status
             
             # Get health status if available
             health_status = ""
             if container.attrs.get("State", {}).get("Health"):
                 health_status = container.attrs["State"]["Health"].get("Status", "")
             
-            if container_status == "running":
-                status = ContainerStatus.RUNNING
-                if health_status == "starting":
-                    message = "Container is starting, health check in progress..."
-                elif health_status == "healthy":
-                    message = "ComfyUI is running and healthy"
-                elif health_status == "unhealthy":
-                    message = "ComfyUI is running but unhealthy"
-                else:
-                    message = "ComfyUI is running"
-            elif container_status in ["created", "restarting"]:
-                status = ContainerStatus.STARTING
-                message = "Container is starting..."
-            elif container_status == "exited":
-                status = ContainerStatus.STOPPED
-                message = "Container has stopped"
-            else:
-                status = ContainerStatus.STOPPED
-                message = f"Container status: {container_status}"
-            
-            # Get port if running (URL will be built by the caller based on request host)
-            extra_info = {}
-            if status == ContainerStatus.RUNNING:
-                extra_info["port"] = COMFYUI_PUBLIC_PORT  # External port for user-facing URLs
-                extra_info["internal_url"] = f"http://{COMFYUI_INTERNAL_HOST}:{COMFYUI_PORT}"
-            
-            return {
-                "status": status,
-                "message": message,
-                "container_name": self.container_name,
-                "health": health_status,
-                **extra_info
-            }
+            return self._describe(container.status, health_status)
             
         except Exception as e:
             return {
@@ -233,67 +557,110 @@ class DockerManager:
                 "container_name": self.container_name
             }
     
+    def _describe(self, container_status: Optional[str], health_status: str = "") -> Dict[str, Any]:
+        """Status dict for a Docker container state (None = container does not exist)"""
+        if container_status is None:
+            return {
+                "status": ContainerStatus.NOT_FOUND,
+                "message": "Container not created yet. Click Start to create and run it.",
+                "container_name": self.container_name
+            }
+        
+        if container_status == "running":
+            status = ContainerStatus.RUNNING
+            if health_status == "starting":
+                message = "Container is starting, health check in progress..."
+            elif health_status == "healthy":
+                message = "ComfyUI is running and healthy"
+            elif health_status == "unhealthy":
+                message = "ComfyUI is running but unhealthy"
+            else:
+                message = "ComfyUI is running"
+        elif container_status in ["created", "restarting"]:
+            status = ContainerStatus.STARTING
+            message = "Container is starting..."
+        elif container_status == "exited":
+            status = ContainerStatus.STOPPED
+            message = "Container has stopped"
+        else:
+            status = ContainerStatus.STOPPED
+            message = f"Container status: {container_status}"
+        
+        # Get port if running (URL will be built by the caller based on request host)
+        extra_info = {}
+        if status == ContainerStatus.RUNNING:
+            extra_info["port"] = COMFYUI_PUBLIC_PORT  # External port for user-facing URLs
+            extra_info["internal_url"] = f"http://{COMFYUI_INTERNAL_HOST}:{COMFYUI_PORT}"
+        
+        return {
+            "status": status,
+            "message": message,
+            "container_name": self.container_name,
+            "health": health_status,
+            **extra_info
+        }
+    
     def _run_startup_in_background(self):
-        """Pull image if needed and start the container"""
+        """Pull image if needed and start the container, timing each phase"""
+        timing = self.current_startup = StartupTiming()
         client = self._get_client()
         if not client:
-            with open(STARTUP_LOG_FILE, 'w') as f:
-                f.write("[ERROR] Docker client not available\n")
+            startup_log.begin("[ERROR] Docker client not available\n")
+            startup_log.close()
+            self._finish_startup(timing, "failed", "Docker client not available")
             return
         
         try:
-            # Clear previous startup log
-            with open(STARTUP_LOG_FILE, 'w') as f:
-                f.write(f"=== ComfyUI Startup Log - {datetime.now().isoformat()} ===\n\n")
+            # Start a fresh startup log
+            startup_log.begin(f"=== ComfyUI Startup Log - {datetime.now().isoformat()} ===\n\n")
             
             # Ensure network and volumes exist
-            with open(STARTUP_LOG_FILE, 'a') as f:
-                f.write("[INFO] Ensuring network and volumes exist...\n")
-                f.flush()
+            startup_log.write("[INFO] Ensuring network and volumes exist...\n")
             
             self._ensure_network()
             self._ensure_volumes()
+            timing.lap("prepare")
             
             # Check if image exists, pull if needed
-            with open(STARTUP_LOG_FILE, 'a') as f:
-                f.write(f"[INFO] Checking image: {self.image_name}\n")
-                f.flush()
+            startup_log.write(f"[INFO] Checking image: {self.image_name}\n")
             
             try:
                 client.images.get(self.image_name)
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write("[INFO] Image already exists locally\n")
-                    f.flush()
+                startup_log.write("[INFO] Image already exists locally\n")
+                timing.lap("image")
             except ImageNotFound:
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write(f"[INFO] Pulling image: {self.image_name} (this may take several minutes)...\n")
-                    f.flush()
+                startup_log.write(f"[INFO] Pulling image: {self.image_name} (this may take several minutes)...\n")
                 
-                # Pull with progress
+                # Pull with progress; layer sizes come from the "Downloading" progress details
+                layer_bytes: Dict[str, int] = {}
                 for line in client.api.pull(self.image_name, stream=True, decode=True):
                     status = line.get('status', '')
                     progress = line.get('progress', '')
                     layer_id = line.get('id', '')
+                    total = (line.get('progressDetail') or {}).get('total')
                     
-                    with open(STARTUP_LOG_FILE, 'a') as f:
-                        if layer_id:
-                            f.write(f"  {layer_id}: {status} {progress}\n")
-                        else:
-                            f.write(f"  {status} {progress}\n")
-                        f.flush()
+                    if layer_id:
+                        if total:
+                            layer_bytes[layer_id] = total
+                        startup_log.write(f"  {layer_id}: {status} {progress}\n")
+                    else:
+                        startup_log.write(f"  {status} {progress}\n")
                 
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write("[INFO] Image pull complete\n")
-                    f.flush()
+                timing.lap("image")
+                timing.image_pulled = True
+                timing.pull_bytes = sum(layer_bytes.values())
+                seconds = timing.phases["image"]
+                startup_log.write(
+                    f"[INFO] Image pull complete ({timing.pull_bytes / 1e6:.1f} MB in {seconds:.1f}s, "
+                    f"{timing.pull_bytes / 1e6 / max(seconds, 0.001):.1f} MB/s)\n"
+                )
             
             # Check if container exists
             container = self._get_container()
             
             if container is None:
                 # Create new container
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write("[INFO] Creating new container...\n")
-                    f.flush()
+                startup_log.write("[INFO] Creating new container...\n")
                 
                 container = client.containers.create(
                     image=self.image_name,
@@ -307,168 +674,355 @@ class DockerManager:
                     healthcheck=CONTAINER_CONFIG["healthcheck"],
                     network=CONTAINER_CONFIG["network"],
                 )
+                timing.lap("create")
+                timing.container_created = True
                 
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write(f"[INFO] Container created: {container.id[:12]}\n")
-                    f.flush()
+                startup_log.write(f"[INFO] Container created: {container.id[:12]}\n")
+            else:
+                timing.lap(None)
             
             # Start the container
-            with open(STARTUP_LOG_FILE, 'a') as f:
-                f.write("[INFO] Starting container...\n")
-                f.flush()
+            startup_log.write("[INFO] Starting container...\n")
             
+            started_at = time.time()
             container.start()
+            timing.lap("start")
+            if timing.image_pulled or timing.container_created:
+                self.cold_starts += 1
+            else:
+                self.warm_starts += 1
+            # Probe right away instead of waiting for the container healthcheck
+            self._loop.call_soon_threadsafe(self.probe_readiness, True)
             
-            with open(STARTUP_LOG_FILE, 'a') as f:
-                f.write("[INFO] Container started successfully\n")
-                f.write("\n=== Streaming container logs ===\n\n")
-                f.flush()
+            startup_log.write("[INFO] Container started successfully\n")
+            startup_log.write("\n=== Streaming container logs ===\n\n")
             
-            # Stream logs
-            for line in container.logs(stream=True, follow=True, tail=50):
-                with open(STARTUP_LOG_FILE, 'a') as f:
-                    f.write(line.decode('utf-8', errors='replace'))
-                    f.flush()
-                
-                # Check if container is still running
-                container.reload()
-                if container.status != "running":
-                    break
+            # Stream this run's logs (the follow stream ends when the container stops)
+            for line in container.logs(stream=True, follow=True, since=started_at):
+                timing.since_container_start("first_log")
+                startup_log.write(line.decode('utf-8', errors='replace'))
+            
+            self._finish_startup(timing, "failed", "Container stopped before ComfyUI became ready")
             
         except Exception as e:
-            with open(STARTUP_LOG_FILE, 'a') as f:
-                f.write(f"\n=== ERROR: {str(e)} ===\n")
+            startup_log.write(f"\n=== ERROR: {str(e)} ===\n")
+            self._finish_startup(timing, "failed", str(e))
+        finally:
+            startup_log.close()
+    
+    def _finish_startup(self, timing: StartupTiming, outcome: str, error: Optional[str] = None) -> bool:
+        """Close the attempt once and store its timings (any thread)"""
+        if not timing.finish(outcome, error):
+            return False
+        if self._loop is None:
+            return True
+        self._loop.call_soon_threadsafe(self._publish)
+        future = asyncio.run_coroutine_threadsafe(db.record_comfyui_startup(timing.as_row()), self._loop)
+        
+        def _report(f):
+            if not f.cancelled() and f.exception():
+                print(f"[WARNING] Failed to record startup timing: {f.exception()}")
+        future.add_done_callback(_report)
+        return True
     
     async def start(self) -> Dict[str, Any]:
         """
         Start the ComfyUI container
         Returns: dict with result info
         """
+        busy = self._busy_response("start")
+        if busy:
+            return busy
         async with self._status_lock:
-            try:
-                # Check current status first
-                current_status = await self.get_status()
-                if current_status["status"] == ContainerStatus.RUNNING:
-                    return {
-                        "success": True,
-                        "message": "ComfyUI is already running",
-                        "status": ContainerStatus.RUNNING
-                    }
-                
-                # Check if startup is already in progress
-                if self._startup_thread and self._startup_thread.is_alive():
-                    return {
-                        "success": True,
-                        "message": "ComfyUI startup already in progress",
-                        "status": ContainerStatus.STARTING
-                    }
-                
-                # Start container in background thread
-                self._startup_thread = threading.Thread(
-                    target=self._run_startup_in_background,
-                    daemon=True
-                )
-                self._startup_thread.start()
-                
+            return await self._start_unlocked()
+    
+    async def _start_unlocked(self) -> Dict[str, Any]:
+        try:
+            # Check current status first
+            current_status = await self._call(self._read_status)
+            if current_status["status"] == ContainerStatus.RUNNING:
                 return {
                     "success": True,
-                    "message": "ComfyUI container starting. Check logs for progress.",
-                    "status": ContainerStatus.STARTING
+                    "message": "ComfyUI is already running",
+                    "status": ContainerStatus.RUNNING
                 }
-                
-            except Exception as e:
+            
+            # Check if startup is already in progress
+            if self._startup_thread and self._startup_thread.is_alive():
                 return {
-                    "success": False,
-                    "message": f"Error starting container: {str(e)}",
-                    "status": ContainerStatus.ERROR
+                    "success": True,
+                    "message": "ComfyUI startup already in progress",
+                    "status": ContainerStatus.STARTING
                 }
+            
+            # Start container in background thread (its timings are stored from this loop)
+            self._loop = asyncio.get_running_loop()
+            self._startup_thread = threading.Thread(
+                target=self._run_startup_in_background,
+                daemon=True
+            )
+            self._startup_thread.start()
+            
+            return {
+                "success": True,
+                "message": "ComfyUI container starting. Check logs for progress.",
+                "status": ContainerStatus.STARTING
+            }
+            
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Error starting container: {str(e)}",
+                "status": ContainerStatus.ERROR
+            }
     
     async def stop(self) -> Dict[str, Any]:
         """
-        Stop the ComfyUI container
-        Returns: dict with result info
+        Stop the ComfyUI container in the background
+        Returns: dict with the operation id to poll via get_operation
         """
-        async with self._status_lock:
-            try:
-                container = self._get_container()
-                
-                if container is None:
-                    return {
-                        "success": True,
-                        "message": "Container does not exist",
-                        "status": ContainerStatus.NOT_FOUND
-                    }
-                
-                container.reload()
-                if container.status != "running":
-                    return {
-                        "success": True,
-                        "message": "ComfyUI is already stopped",
-                        "status": ContainerStatus.STOPPED
-                    }
-                
-                # Stop the container
-                container.stop(timeout=30)
-                
-                return {
-                    "success": True,
-                    "message": "ComfyUI container stopped successfully",
-                    "status": ContainerStatus.STOPPED
-                }
-                
-            except Exception as e:
-                return {
-                    "success": False,
-                    "message": f"Error stopping container: {str(e)}",
-                    "status": ContainerStatus.ERROR
-                }
+        return self._begin_operation("stop", self._stop_operation, ContainerStatus.STOPPING,
+                                     "Stopping ComfyUI container")
     
     async def restart(self) -> Dict[str, Any]:
         """
-        Restart the ComfyUI container
-        Returns: dict with result info
+        Restart the ComfyUI container in the background
+        Returns: dict with the operation id to poll via get_operation
         """
-        async with self._status_lock:
-            try:
-                container = self._get_container()
-                
-                if container is None:
-                    # No container exists, just start
-                    return await self.start()
-                
-                # Restart the container
-                container.restart(timeout=30)
-                
-                return {
-                    "success": True,
-                    "message": "ComfyUI container restarted successfully",
-                    "status": ContainerStatus.STARTING
-                }
-                
-            except Exception as e:
-                return {
-                    "success": False,
-                    "message": f"Error restarting container: {str(e)}",
-                    "status": ContainerStatus.ERROR
-                }
+        return self._begin_operation("restart", self._restart_operation, ContainerStatus.STARTING,
+                                     "Restarting ComfyUI container")
+    
+    async def _stop_operation(self, operation: Dict[str, Any]) -> ContainerStatus:
+        self._set_progress(operation, "Looking up container")
+        container = await self._call(self._get_container)
+        if container is None:
+            self._set_progress(operation, "Container does not exist")
+            return ContainerStatus.NOT_FOUND
+        
+        await self._call(container.reload)
+        if container.status != "running":
+            self._set_progress(operation, "ComfyUI is already stopped")
+            return ContainerStatus.STOPPED
+        
+        self._set_progress(operation, f"Stopping container (waiting up to {DOCKER_STOP_TIMEOUT}s for ComfyUI to exit)")
+        self._clear_ready()
+        await self._call(lambda: container.stop(timeout=DOCKER_STOP_TIMEOUT))
+        self._set_progress(operation, "ComfyUI container stopped successfully")
+        return ContainerStatus.STOPPED
+    
+    async def _restart_operation(self, operation: Dict[str, Any]) -> ContainerStatus:
+        self._set_progress(operation, "Looking up container")
+        container = await self._call(self._get_container)
+        if container is None:
+            # No container exists, just start
+            result = await self._start_unlocked()
+            if not result["success"]:
+                raise RuntimeError(result["message"])
+            self._set_progress(operation, result["message"])
+            return result["status"]
+        
+        self._set_progress(operation, f"Restarting container (waiting up to {DOCKER_STOP_TIMEOUT}s for ComfyUI to exit)")
+        self._clear_ready()
+        await self._call(lambda: container.restart(timeout=DOCKER_STOP_TIMEOUT))
+        self.probe_readiness(restart=True)
+        self._set_progress(operation, "ComfyUI container restarted successfully")
+        return ContainerStatus.STARTING
+    
+    # -------------------- Readiness --------------------
+    
+    @property
+    def is_ready(self) -> bool:
+        """ComfyUI answered /system_stats since the container last started"""
+        return self._ready_event.is_set()
+    
+    def probe_readiness(self, restart: bool = False):
+        """Poll /system_stats until ComfyUI answers (event loop thread; no-op while a probe runs)"""
+        if self._probe_task is not None and not self._probe_task.done():
+            if not restart:
+                return
+            self._probe_task.cancel()
+        elif self.is_ready and not restart:
+            return
+        self._ready_event.clear()
+        self._probe_task = asyncio.create_task(self._probe_until_ready())
+    
+    def _clear_ready(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self.is_ready:
+            self._ready_event.clear()
+            self._publish()
+    
+    async def _probe_until_ready(self):
+        deadline = time.monotonic() + STARTUP_READY_TIMEOUT
+        interval = STARTUP_PROBE_INTERVAL
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(f"{COMFYUI_INTERNAL_URL}/system_stats")).status_code == 200:
+                        self._set_ready()
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, STARTUP_PROBE_MAX_INTERVAL)
+        
+        timing = self.current_startup
+        if timing is not None and timing.container_started:
+            self._finish_startup(timing, "timeout", f"ComfyUI not ready after {STARTUP_READY_TIMEOUT:.0f}s")
+        self._publish()
+    
+    def _set_ready(self):
+        self._ready_event.set()
+        timing = self.current_startup
+        if timing is not None and timing.container_started and not timing.finished:
+            timing.since_container_start("ready")
+            if self._finish_startup(timing, "ready"):
+                startup_log.write(
+                    f"\n[INFO] ComfyUI ready {timing.phases['ready']:.1f}s after container start "
+                    f"({timing.phases['total']:.1f}s total)\n"
+                )
+        self._publish()
+    
+    def _starting(self) -> bool:
+        """A start, restart or readiness probe is in flight"""
+        return bool(
+            (self._startup_thread and self._startup_thread.is_alive())
+            or (self._probe_task and not self._probe_task.done())
+            or self.get_active_operation()
+        )
+    
+    async def wait_until_ready(self, timeout: float) -> bool:
+        """
+        Wait until ComfyUI answers /system_stats (at most READY_WAIT_MAX_TIMEOUT seconds).
+        Returns False on timeout, or at once when ComfyUI is neither up nor starting.
+        """
+        deadline = time.monotonic() + min(timeout, READY_WAIT_MAX_TIMEOUT)
+        queue = self.subscribe()
+        try:
+            while not self.is_ready:
+                if not self._starting():
+                    status = await self.get_status()
+                    if status["status"] != ContainerStatus.RUNNING:
+                        return False
+                    self.probe_readiness()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+            return True
+        finally:
+            self.unsubscribe(queue)
+    
+    # -------------------- Tracked operations --------------------
+    
+    def get_operation(self, operation_id: str) -> Optional[Dict[str, Any]]:
+        """Snapshot of a stop/restart operation, or None if unknown/expired"""
+        operation = self._operations.get(operation_id)
+        return dict(operation) if operation else None
+    
+    def get_active_operation(self) -> Optional[Dict[str, Any]]:
+        """The stop/restart operation currently pending or running, if any"""
+        for operation in reversed(self._operations.values()):
+            if operation["state"] in (OperationState.PENDING, OperationState.RUNNING):
+                return dict(operation)
+        return None
+    
+    async def wait_for_operation(self, operation_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait until an operation has finished and return its final snapshot"""
+        task = self._operation_tasks.get(operation_id)
+        if task is not None:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        return self.get_operation(operation_id)
+    
+    def _busy_response(self, requested: str) -> Optional[Dict[str, Any]]:
+        active = self.get_active_operation()
+        if active is None:
+            return None
+        same = active["type"] == requested
+        return {
+            "success": same,
+            "message": f"ComfyUI {active['type']} already in progress" if same
+                       else f"Cannot {requested} while a {active['type']} is in progress",
+            "status": ContainerStatus.STOPPING if active["type"] == "stop" else ContainerStatus.STARTING,
+            "operation_id": active["id"],
+            "operation": active
+        }
+    
+    def _begin_operation(self, op_type: str, work: Callable, status: ContainerStatus, message: str) -> Dict[str, Any]:
+        busy = self._busy_response(op_type)
+        if busy:
+            return busy
+        
+        operation = {
+            "id": uuid.uuid4().hex,
+            "type": op_type,
+            "state": OperationState.PENDING,
+            "progress": "Queued",
+            "result": None,
+            "error": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._operations[operation["id"]] = operation
+        while len(self._operations) > DOCKER_OPERATION_HISTORY:
+            oldest_id = next(iter(self._operations))
+            if oldest_id in self._operation_tasks:
+                break
+            del self._operations[oldest_id]
+        self._operation_tasks[operation["id"]] = asyncio.create_task(self._run_operation(operation, work))
+        self._publish()
+        
+        return {
+            "success": True,
+            "message": f"{message}. Poll the operation for progress.",
+            "status": status,
+            "operation_id": operation["id"],
+            "operation": dict(operation)
+        }
+    
+    async def _run_operation(self, operation: Dict[str, Any], work: Callable):
+        try:
+            async with self._status_lock:
+                operation["state"] = OperationState.RUNNING
+                operation["started_at"] = datetime.utcnow().isoformat()
+                operation["result"] = await work(operation)
+                operation["state"] = OperationState.SUCCEEDED
+        except Exception as e:
+            operation["state"] = OperationState.FAILED
+            operation["error"] = str(e)
+            operation["progress"] = f"Error during {operation['type']}: {str(e)}"
+        finally:
+            operation["finished_at"] = datetime.utcnow().isoformat()
+            self._operation_tasks.pop(operation["id"], None)
+            if self._watch_task is not None:
+                await self.resync()
+            self._publish()
     
     async def get_logs(self, lines: int = 100) -> Dict[str, Any]:
         """
         Get recent logs from the ComfyUI container and startup log
         Returns: dict with logs
         """
+        return await self._call(self._read_logs, lines)
+    
+    def _read_logs(self, lines: int) -> Dict[str, Any]:
+        """Blocking log read (runs on the Docker executor)"""
         try:
             logs_parts = []
             
-            # First, get startup logs if they exist
-            if STARTUP_LOG_FILE.exists():
-                try:
-                    with open(STARTUP_LOG_FILE, 'r') as f:
-                        startup_logs = f.read()
-                    if startup_logs.strip():
-                        logs_parts.append("=== STARTUP/PULL LOG ===\n" + startup_logs)
-                except Exception as e:
-                    logs_parts.append(f"(Error reading startup log: {e})\n")
+            # First, the recent startup log lines (kept in memory)
+            try:
+                startup_logs = startup_log.read()["text"]
+                if startup_logs.strip():
+                    logs_parts.append("=== STARTUP/PULL LOG ===\n" + startup_logs)
+            except Exception as e:
+                logs_parts.append(f"(Error reading startup log: {e})\n")
             
             # Then get container logs
             container = self._get_container()
@@ -500,28 +1054,33 @@ class DockerManager:
                 "logs": ""
             }
     
-    async def get_startup_logs(self) -> Dict[str, Any]:
+    async def get_startup_logs(self, after_offset: Optional[int] = None) -> Dict[str, Any]:
         """
         Get only the startup/pull logs
+        With after_offset, only the text written after it (pass back the returned "offset").
         Returns: dict with logs
         """
         try:
-            if not STARTUP_LOG_FILE.exists():
+            if startup_log.size == 0:
                 return {
                     "success": True,
                     "message": "No startup logs yet",
-                    "logs": "(No startup initiated yet)"
+                    "logs": "(No startup initiated yet)",
+                    "offset": 0
                 }
             
-            with open(STARTUP_LOG_FILE, 'r') as f:
-                logs = f.read()
-            
-            is_running = self._startup_thread and self._startup_thread.is_alive()
+            chunk = startup_log.read(after_offset)
+            is_running = bool(self._startup_thread and self._startup_thread.is_alive())
+            logs = chunk["text"]
+            if after_offset is None and not logs.strip():
+                logs = "(Waiting for output...)"
             
             return {
                 "success": True,
                 "message": "Startup in progress..." if is_running else "Startup logs",
-                "logs": logs if logs.strip() else "(Waiting for output...)",
+                "logs": logs,
+                "offset": chunk["offset"],
+                "reset": chunk["reset"],
                 "in_progress": is_running
             }
             
@@ -533,5 +1092,186 @@ class DockerManager:
             }
 
 
+
+class LifecycleController:
+    """
+    Idle shutdown and pre-warming of the ComfyUI container.
+    Stops the container after IDLE_SHUTDOWN_MINUTES without portal jobs or ComfyUI queue
+    entries; the stopped container is kept, so the next start skips the image check and
+    create. Starts it ahead of demand on the first login of the day and when jobs of
+    users with credits are queued after an idle stop.
+    """
+    
+    def __init__(self, manager: DockerManager, idle_minutes: float, interval: float):
+        self.manager = manager
+        self.idle_seconds = idle_minutes * 60
+        self.interval = interval
+        self.idle_stops = 0
+        self.prewarms: Dict[str, int] = {"first_login": 0, "queued_jobs": 0}
+        self.last_error: Optional[str] = None
+        self._last_activity = time.monotonic()
+        self._was_running = False
+        self._idle_stopped_at: Optional[float] = None
+        self._idle_seconds_saved = 0.0
+        self._last_login_day: Optional[date] = None
+        self._login_users: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start the lifecycle loop on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._last_activity = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    def note_activity(self, wake: bool = False):
+        """A job was created or finished; wake=True checks at once (pre-warm for queued jobs)"""
+        self._last_activity = time.monotonic()
+        if wake and self._wakeup is not None:
+            self._wakeup.set()
+    
+    def note_login(self, user_id: int):
+        """Queue a pre-warm until the day's first login with credits finds ComfyUI up (returns immediately)"""
+        if not PREWARM_ON_FIRST_LOGIN or self._last_login_day == datetime.now().date():
+            return
+        self._login_users.add(user_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def check(self) -> Optional[str]:
+        """Run one lifecycle pass. Returns "idle_stop", "first_login", "queued_jobs" or None."""
+        status = await self.manager.get_status()
+        running = status.get("status") == ContainerStatus.RUNNING
+        if self.manager.get_active_operation():
+            # Pending logins stay queued until a pass can act on them
+            return None
+        
+        if running:
+            if self._login_users:
+                self._login_users.clear()
+                self._last_login_day = datetime.now().date()
+            if not self._was_running:
+                self._mark_started()
+            self._was_running = True
+            if await self._is_busy():
+                self._last_activity = time.monotonic()
+                return None
+            if self.idle_seconds and time.monotonic() - self._last_activity >= self.idle_seconds:
+                await self._idle_stop()
+                return "idle_stop"
+            return None
+        
+        self._was_running = False
+        if status.get("status") not in (ContainerStatus.STOPPED, ContainerStatus.NOT_FOUND):
+            return None
+        login_users, self._login_users = self._login_users, set()
+        if login_users and await self._has_credits(login_users):
+            return await self._prewarm("first_login")
+        # Only undo our own idle stop: a user's /comfyui/stop or the no-credits stop stays down
+        if PREWARM_ON_QUEUED_JOBS and self._idle_stopped_at is not None:
+            owners = await db.get_active_job_user_ids(datetime.utcnow() - ACTIVE_JOB_MAX_AGE)
+            if owners and await self._has_credits(owners):
+                return await self._prewarm("queued_jobs")
+        return None
+    
+    async def _is_busy(self) -> bool:
+        """Portal jobs queued/running, or work queued in ComfyUI itself (its own UI)"""
+        if await db.count_active_jobs(datetime.utcnow() - ACTIVE_JOB_MAX_AGE):
+            return True
+        if not self.manager.is_ready:
+            return False
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                queue = (await client.get(f"{COMFYUI_INTERNAL_URL}/queue")).json()
+            return bool(queue.get("queue_running") or queue.get("queue_pending"))
+        except (httpx.HTTPError, ValueError):
+            return False
+    
+    async def _has_credits(self, user_ids: Set[int]) -> bool:
+        balances = await db.get_balances(list(user_ids))
+        for user_id in user_ids:
+            if balances.get(user_id, 0) > 0:
+                return True
+            user = await db.get_user_by_id(user_id)
+            if user and user.get("is_admin", False):
+                return True
+        return False
+    
+    async def _idle_stop(self):
+        result = await self.manager.stop()
+        if not result.get("success"):
+            raise RuntimeError(result.get("message"))
+        operation = await self.manager.wait_for_operation(result["operation_id"])
+        if operation and operation["state"] == OperationState.FAILED:
+            raise RuntimeError(operation["error"])
+        self.idle_stops += 1
+        self._was_running = False
+        self._idle_stopped_at = time.monotonic()
+        await db.add_log(
+            action="comfyui_idle_stop",
+            details=f"ComfyUI stopped after {self.idle_seconds / 60:.0f} minutes without jobs"
+        )
+    
+    async def _prewarm(self, reason: str) -> Optional[str]:
+        result = await self.manager.start()
+        if not result.get("success"):
+            raise RuntimeError(result.get("message"))
+        self.prewarms[reason] += 1
+        if reason == "first_login":
+            self._last_login_day = datetime.now().date()
+        self._mark_started()
+        self._was_running = True
+        await db.add_log(action="comfyui_prewarm", details=f"ComfyUI pre-warmed ({reason})")
+        return reason
+    
+    def _mark_started(self):
+        # The idle period counts from the start; GPU time saved ends when the container runs again
+        self._last_activity = time.monotonic()
+        if self._idle_stopped_at is not None:
+            self._idle_seconds_saved += time.monotonic() - self._idle_stopped_at
+            self._idle_stopped_at = None
+    
+    def stats(self) -> Dict[str, Any]:
+        saved = self._idle_seconds_saved
+        if self._idle_stopped_at is not None:
+            saved += time.monotonic() - self._idle_stopped_at
+        return {
+            "idle_shutdown_minutes": self.idle_seconds / 60,
+            "idle_for_seconds": round(time.monotonic() - self._last_activity, 1) if self._was_running else None,
+            "idle_stops": self.idle_stops,
+            "prewarms": dict(self.prewarms),
+            "cold_starts": self.manager.cold_starts,
+            "warm_starts": self.manager.warm_starts,
+            "idle_gpu_minutes_saved": round(saved / 60, 1),
+            "last_error": self.last_error,
+        }
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.check()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[WARNING] ComfyUI lifecycle check failed: {e}")
+
+
 # Singleton instance
 docker_manager = DockerManager()
+lifecycle = LifecycleController(docker_manager, IDLE_SHUTDOWN_MINUTES, LIFECYCLE_CHECK_INTERVAL)
@@ -0,0 +1,721 @@
+"""
+GPU monitoring for ComfyUI Manager
+One background sampler reads GPU metrics at a fixed interval and keeps the latest
+sample in memory; request handlers read that sample instead of running nvidia-smi.
+
+Backends are pluggable: NVML (nvidia-ml-py, in-process), nvidia-smi (inside the
+ComfyUI container or on the host) and a fake backend for machines without a GPU.
+Samples are attributed to running jobs (gpu_usage), rolled up per minute, hour
+and day (gpu_metric_rollups) for the admin charts, and kept for the last few
+minutes in a ring buffer that live dashboards follow over SSE.
+"""
+
+import os
+import json
+import math
+import asyncio
+import subprocess
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Callable
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database import db, JobStatus
+
+try:
+    import pynvml
+except ImportError:  # nvidia-ml-py is optional; nvidia-smi is used instead
+    pynvml = None
+
+load_dotenv()
+
+# auto (NVML if available, else nvidia-smi), nvml, nvidia-smi or fake
+GPU_SAMPLER_BACKEND = os.getenv("GPU_SAMPLER_BACKEND", "auto").lower()
+GPU_SAMPLE_INTERVAL = float(os.getenv("GPU_SAMPLE_INTERVAL", "2"))
+# Number of GPUs reported by the fake backend
+GPU_FAKE_COUNT = int(os.getenv("GPU_FAKE_COUNT", "1"))
+# Per-job gpu_usage summaries are inserted in batches of up to GPU_USAGE_BATCH_SIZE,
+# at least every GPU_USAGE_FLUSH_INTERVAL seconds
+GPU_USAGE_BATCH_SIZE = int(os.getenv("GPU_USAGE_BATCH_SIZE", "100"))
+GPU_USAGE_FLUSH_INTERVAL = float(os.getenv("GPU_USAGE_FLUSH_INTERVAL", "30"))
+# Device running ComfyUI jobs (the container is pinned to GPU 0)
+JOB_GPU_ID = 0
+# Jobs running for longer than this are treated as abandoned and no longer get GPU samples
+JOB_GPU_MAX_AGE = timedelta(hours=6)
+# Seconds between deletions of minute/hour rollups past their retention
+GPU_ROLLUP_PRUNE_INTERVAL = 3600
+# Minutes of samples per GPU kept in memory for the live dashboards
+GPU_LIVE_WINDOW_MINUTES = float(os.getenv("GPU_LIVE_WINDOW_MINUTES", "15"))
+
+NVIDIA_SMI_QUERY = [
+    "nvidia-smi",
+    "--query-gpu=index,name,memory.used,memory.total,utilization.gpu,utilization.memory,temperature.gpu,power.draw",
+    "--format=csv,noheader,nounits"
+]
+
+
+class GpuBackendError(Exception):
+    """A backend could not read GPU metrics"""
+    pass
+
+
+# ============================================
+# Backends
+# ============================================
+# Each backend has a name and a blocking sample() returning one dict per GPU
+# (id, name, memory_used_mb, memory_total_mb, gpu_utilization, memory_utilization,
+# temperature_c, power_draw_w); it runs on a worker thread, never on the event loop.
+
+class NvmlBackend:
+    """In-process NVML reads (no subprocess per sample)"""
+
+    name = "nvml"
+
+    def __init__(self):
+        if pynvml is None:
+            raise GpuBackendError("nvidia-ml-py is not installed")
+        try:
+            pynvml.nvmlInit()
+        except pynvml.NVMLError as e:
+            raise GpuBackendError(f"NVML init failed: {e}")
+        self._handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        self._names = [self._decode(pynvml.nvmlDeviceGetName(h)) for h in self._handles]
+
+    @staticmethod
+    def _decode(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def sample(self) -> List[Dict[str, Any]]:
+        gpus = []
+        try:
+            for index, handle in enumerate(self._handles):
+                memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                utilization = pynvml.nvmlDeviceGetUtilizationRates(handle)
+                try:
+                    power_draw_w = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000
+                except pynvml.NVMLError:
+                    power_draw_w = None
+                gpus.append({
+                    "id": index,
+                    "name": self._names[index],
+                    "memory_used_mb": memory.used // (1024 * 1024),
+                    "memory_total_mb": memory.total // (1024 * 1024),
+                    "gpu_utilization": utilization.gpu,
+                    "memory_utilization": utilization.memory,
+                    "temperature_c": pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU),
+                    "power_draw_w": power_draw_w,
+                })
+        except pynvml.NVMLError as e:
+            raise GpuBackendError(str(e))
+        return gpus
+
+    def close(self):
+        try:
+            pynvml.nvmlShutdown()
+        except pynvml.NVMLError:
+            pass
+
+
+class NvidiaSmiBackend:
+    """nvidia-smi inside the ComfyUI container, falling back to the host's nvidia-smi"""
+
+    name = "nvidia-smi"
+
+    def __init__(self, container: str = "comfyui"):
+        self._commands = [["docker", "exec", container, *NVIDIA_SMI_QUERY], NVIDIA_SMI_QUERY]
+
+    def sample(self) -> List[Dict[str, Any]]:
+        error = "nvidia-smi not available"
+        for command in list(self._commands):
+            try:
+                result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+            except subprocess.TimeoutExpired:
+                error = "Timeout querying GPU stats"
+                continue
+            except FileNotFoundError:
+                error = "nvidia-smi not found"
+                continue
+            if result.returncode == 0:
+                # Try the command that worked first from now on
+                self._commands.remove(command)
+                self._commands.insert(0, command)
+                return self.parse(result.stdout)
+        raise GpuBackendError(error)
+
+    @staticmethod
+    def parse(output: str) -> List[Dict[str, Any]]:
+        gpus = []
+        for line in output.strip().split("\n"):
+            if not line.strip():
+                continue
+            parts = [p.strip() for p in line.split(",")]
+            if len(parts) >= 8:
+                try:
+                    gpus.append({
+                        "id": int(parts[0]),
+                        "name": parts[1],
+                        "memory_used_mb": int(float(parts[2])),
+                        "memory_total_mb": int(float(parts[3])),
+                        "gpu_utilization": int(float(parts[4])),
+                        "memory_utilization": int(float(parts[5])),
+                        "temperature_c": int(float(parts[6])),
+                        "power_draw_w": float(parts[7]) if parts[7] != "[N/A]" else None
+                    })
+                except (ValueError, IndexError):
+                    continue
+        return gpus
+
+    def close(self):
+        pass
+
+
+class FakeBackend:
+    """Synthetic, smoothly varying metrics for development and tests without a GPU"""
+
+    name = "fake"
+
+    def __init__(self, count: int = 1):
+        self.count = count
+        self._started = time.monotonic()
+
+    def sample(self) -> List[Dict[str, Any]]:
+        elapsed = time.monotonic() - self._started
+        gpus = []
+        for index in range(self.count):
+            load = (math.sin(elapsed / 30 + index) + 1) / 2  # 0..1, one cycle every ~3 minutes
+            gpus.append({
+                "id": index,
+                "name": "Fake GPU",
+                "memory_used_mb": int(2048 + load * 20000),
+                "memory_total_mb": 24576,
+                "gpu_utilization": int(load * 100),
+                "memory_utilization": int(load * 90),
+                "temperature_c": int(40 + load * 40),
+                "power_draw_w": round(60 + load * 290, 1),
+            })
+        return gpus
+
+    def close(self):
+        pass
+
+
+def create_backend(name: str = GPU_SAMPLER_BACKEND):
+    """Build the configured backend; "auto" prefers NVML and falls back to nvidia-smi"""
+    if name == "fake":
+        return FakeBackend(GPU_FAKE_COUNT)
+    if name == "nvidia-smi":
+        return NvidiaSmiBackend()
+    if name == "nvml":
+        return NvmlBackend()
+    try:
+        return NvmlBackend()
+    except GpuBackendError as e:
+        print(f"[INFO] NVML unavailable ({e}), sampling GPUs with nvidia-smi")
+        return NvidiaSmiBackend()
+
+
+# ============================================
+# Sampler
+# ============================================
+
+class GpuSampler:
+    """
+    Background task that samples the GPUs every `interval` seconds.
+    latest() serves the most recent sample, so any number of readers cost one read.
+    """
+
+    def __init__(self, interval: float, backend=None):
+        self.interval = interval
+        self.backend = backend
+        self.samples = 0
+        self.errors = 0
+        self.listener_errors = 0
+        self._latest: Optional[Dict[str, Any]] = None
+        self._last_sample_at: Optional[float] = None
+        self._listeners: List[Callable[[Dict[str, Any], float], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Start sampling on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if self.backend is not None:
+            self.backend.close()
+
+    def add_listener(self, listener: Callable[[Dict[str, Any], float], None]):
+        """Call listener(sample, seconds_covered) after every successful sample (event loop)"""
+        self._listeners.append(listener)
+
+    def latest(self) -> Dict[str, Any]:
+        """The last sample in the /admin/gpu/live format"""
+        if self._latest is None:
+            return {"available": False, "error": "No GPU sample yet", "gpus": []}
+        return self._latest
+
+    async def sample_once(self) -> Dict[str, Any]:
+        """Take one sample now and make it the latest"""
+        try:
+            if self.backend is None:
+                self.backend = await asyncio.to_thread(create_backend)
+            gpus = await asyncio.to_thread(self.backend.sample)
+        except Exception as e:
+            self.errors += 1
+            self._latest = {
+                "available": False,
+                "error": str(e),
+                "gpus": [],
+                "timestamp": datetime.utcnow().isoformat(),
+                "backend": getattr(self.backend, "name", None),
+            }
+            return self._latest
+
+        self._latest = {
+            "available": True,
+            "gpus": gpus,
+            "timestamp": datetime.utcnow().isoformat(),
+            "backend": self.backend.name,
+        }
+        self.samples += 1
+        # A sample stands for the time since the previous one (capped across outages)
+        now = time.monotonic()
+        covered = min(now - self._last_sample_at, 3 * self.interval) if self._last_sample_at else self.interval
+        self._last_sample_at = now
+        for listener in self._listeners:
+            # One failing consumer must not lose the sample for the others
+            try:
+                listener(self._latest, covered)
+            except Exception as e:
+                self.listener_errors += 1
+                print(f"[WARNING] GPU sample listener {getattr(listener, '__qualname__', listener)} failed: {e}")
+        return self._latest
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": getattr(self.backend, "name", None),
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "errors": self.errors,
+            "listener_errors": self.listener_errors,
+            "last_sample_at": self._latest.get("timestamp") if self._latest else None,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await self.sample_once()
+            # Fixed rate: a slow read (nvidia-smi) shortens the wait rather than the interval drifting
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+
+
+
+# ============================================
+# Per-job GPU usage
+# ============================================
+
+def _parse_utc(value: str) -> datetime:
+    """Naive UTC datetime from a stored timestamp (SQLite text or Supabase ISO with offset)"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00").replace(" ", "T"))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+class GpuUsageRecorder:
+    """
+    Attributes GPU samples to running jobs and stores one gpu_usage row per job.
+    Each sample of JOB_GPU_ID is split evenly between the jobs running at that moment;
+    a job's row (GPU-seconds, peak memory, average utilisation and power, energy) is
+    queued when it finishes and written with bulk inserts, never one row per sample.
+    Jobs still running after JOB_GPU_MAX_AGE (client crashed, status reset) are dropped.
+    """
+
+    def __init__(self, batch_size: int, interval: float):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.failed = 0
+        self.expired = 0
+        self._active: Dict[int, Dict[str, Any]] = {}
+        self._pending: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the batch writer on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and store what is pending (jobs still running are not written)"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Let the loop finish its current insert instead of cancelling it mid-batch
+        self._stopping = True
+        self._wakeup.set()
+        await task
+        await self.flush()
+
+    def job_started(self, job_id: int, user_id: int, started_at: Optional[datetime] = None):
+        if job_id not in self._active:
+            self._active[job_id] = {
+                "user_id": user_id, "started_at": started_at or datetime.utcnow(), "samples": 0, "gpu_seconds": 0.0, "energy_wh": 0.0,
+                "gpu_utilization": 0, "memory_utilization": 0, "power_samples": 0, "power_draw_w": 0.0,
+                "peak_memory_mb": 0, "memory_total_mb": None, "temperature_c": None, "gpu_name": None,
+            }
+
+    def job_finished(self, job_id: int):
+        """Queue the job's summary row (no-op for jobs that never ran while sampled)"""
+        usage = self._active.pop(job_id, None)
+        if not usage or not usage["samples"]:
+            return
+        samples = usage["samples"]
+        self._pending.append({
+            "user_id": usage["user_id"],
+            "job_id": job_id,
+            "gpu_id": JOB_GPU_ID,
+            "gpu_name": usage["gpu_name"],
+            "memory_used_mb": usage["peak_memory_mb"],
+            "memory_total_mb": usage["memory_total_mb"],
+            "gpu_utilization": round(usage["gpu_utilization"] / samples),
+            "memory_utilization": round(usage["memory_utilization"] / samples),
+            "temperature_c": usage["temperature_c"],
+            "power_draw_w": round(usage["power_draw_w"] / usage["power_samples"], 1) if usage["power_samples"] else None,
+            "duration_seconds": round(usage["gpu_seconds"], 3),
+            "energy_wh": round(usage["energy_wh"], 4),
+            "sample_count": samples,
+        })
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def observe(self, sample: Dict[str, Any], seconds: float):
+        """GpuSampler listener: add one sample to every running job"""
+        if not self._active:
+            return
+        self._expire(datetime.utcnow() - JOB_GPU_MAX_AGE)
+        if not self._active:
+            return
+        gpu = next((g for g in sample["gpus"] if g["id"] == JOB_GPU_ID), None)
+        if gpu is None:
+            return
+        share = seconds / len(self._active)
+        for usage in self._active.values():
+            usage["samples"] += 1
+            usage["gpu_seconds"] += share
+            usage["gpu_utilization"] += gpu["gpu_utilization"]
+            usage["memory_utilization"] += gpu["memory_utilization"]
+            usage["peak_memory_mb"] = max(usage["peak_memory_mb"], gpu["memory_used_mb"])
+            usage["memory_total_mb"] = gpu["memory_total_mb"]
+            usage["temperature_c"] = max(usage["temperature_c"] or 0, gpu["temperature_c"])
+            usage["gpu_name"] = gpu["name"]
+            if gpu["power_draw_w"] is not None:
+                usage["power_samples"] += 1
+                usage["power_draw_w"] += gpu["power_draw_w"]
+                usage["energy_wh"] += gpu["power_draw_w"] * share / 3600
+
+    def _expire(self, cutoff: datetime):
+        # Abandoned jobs would otherwise dilute every later sample's share and never leave memory
+        for job_id in [job_id for job_id, usage in self._active.items() if usage["started_at"] < cutoff]:
+            del self._active[job_id]
+            self.expired += 1
+
+    async def flush(self) -> int:
+        """Write pending rows in batches. Returns the number written."""
+        written = 0
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            try:
+                written += await db.insert_gpu_usage(batch)
+            except Exception as e:
+                # Keep the rows for the next flush
+                self._pending.extendleft(reversed(batch))
+                self.failed += 1
+                print(f"[WARNING] Failed to write {len(batch)} gpu_usage rows: {e}")
+                break
+        self.written += written
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running_jobs": len(self._active),
+            "expired_jobs": self.expired,
+            "pending_rows": len(self._pending),
+            "rows_written": self.written,
+            "failed_flushes": self.failed,
+        }
+
+    async def _resume_running_jobs(self):
+        # Jobs already running when the portal (re)started are tracked from now on, unless abandoned
+        cutoff = datetime.utcnow() - JOB_GPU_MAX_AGE
+        try:
+            for job in await db.get_all_jobs(limit=1000, status=JobStatus.RUNNING.value):
+                started = job.get("started_at") or job.get("created_at")
+                started_at = _parse_utc(started) if started else cutoff
+                if started_at >= cutoff:
+                    self.job_started(job["id"], job["user_id"], started_at)
+        except Exception as e:
+            print(f"[WARNING] Could not load running jobs for GPU attribution: {e}")
+
+    async def _run(self):
+        await self._resume_running_jobs()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+# ============================================
+# Metric rollups and chart downsampling
+# ============================================
+
+class GpuMetricRollup:
+    """
+    Aggregates every sample per GPU and minute in memory and merges the aggregates
+    into gpu_metric_rollups (minute, hour and day rows) every `interval` seconds.
+    Merging is additive, so a minute flushed in several parts adds up correctly.
+    Also prunes minute and hour rollups past their retention once an hour.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.written = 0
+        self.failed = 0
+        self._minutes: Dict[tuple, Dict[str, Any]] = {}
+        self._unsent: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the writer on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and merge what has been aggregated so far"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+
+    def observe(self, sample: Dict[str, Any], seconds: float):
+        """GpuSampler listener: add the sample to its minute"""
+        bucket = sample["timestamp"][:16].replace("T", " ") + ":00"
+        for gpu in sample["gpus"]:
+            minute = self._minutes.get((bucket, gpu["id"]))
+            if minute is None:
+                minute = self._minutes[(bucket, gpu["id"])] = {
+                    "bucket": bucket, "gpu_id": gpu["id"], "samples": 0, "gpu_utilization_sum": 0.0,
+                    "memory_used_sum": 0.0, "memory_used_max": 0, "power_draw_sum": 0.0,
+                    "power_draw_count": 0, "temperature_max": None,
+                }
+            minute["samples"] += 1
+            minute["gpu_utilization_sum"] += gpu["gpu_utilization"]
+            minute["memory_used_sum"] += gpu["memory_used_mb"]
+            minute["memory_used_max"] = max(minute["memory_used_max"], gpu["memory_used_mb"])
+            minute["temperature_max"] = max(minute["temperature_max"] or 0, gpu["temperature_c"])
+            if gpu["power_draw_w"] is not None:
+                minute["power_draw_count"] += 1
+                minute["power_draw_sum"] += gpu["power_draw_w"]
+
+    async def flush(self) -> int:
+        """Merge the aggregated minutes into the rollups. Returns the number of minute rows."""
+        rows = self._unsent + list(self._minutes.values())
+        self._unsent, self._minutes = [], {}
+        if not rows:
+            return 0
+        try:
+            written = await db.add_gpu_metric_minutes(rows)
+        except Exception as e:
+            # Retry with the next flush (rows for the same minute are added together)
+            self._unsent = rows
+            self.failed += 1
+            print(f"[WARNING] Failed to write {len(rows)} GPU metric rollup rows: {e}")
+            return 0
+        self.written += written
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_minutes": len(self._minutes) + len(self._unsent),
+            "rows_written": self.written,
+            "failed_flushes": self.failed,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        pruned_at = None
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+            if pruned_at is None or loop.time() - pruned_at >= GPU_ROLLUP_PRUNE_INTERVAL:
+                pruned_at = loop.time()
+                try:
+                    await db.prune_gpu_rollups()
+                except Exception as e:
+                    print(f"[WARNING] Failed to prune GPU rollups: {e}")
+
+
+def lttb(points: List[tuple], threshold: int) -> List[tuple]:
+    """
+    Downsample (x, y) points sorted by x to `threshold` points with Largest-Triangle-Three-Buckets:
+    keeps the first and last point and, from each bucket in between, the point forming the
+    largest triangle with the previously kept point and the average of the next bucket.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        following = points[end:min(int((i + 2) * every) + 1, count)]
+        avg_x = sum(p[0] for p in following) / len(following)
+        avg_y = sum(p[1] for p in following) / len(following)
+        kept_x, kept_y = points[kept]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((kept_x - avg_x) * (y - kept_y) - (kept_x - x) * (avg_y - kept_y))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
+
+
+# ============================================
+# Live ring buffer
+# ============================================
+
+class GpuLiveBuffer:
+    """
+    The last `capacity` samples of every GPU in fixed-size NumPy arrays, overwritten
+    in place once full, so memory stays constant however long the portal runs.
+    Samples are numbered; since(seq) returns only the newer ones (the deltas pushed
+    to live dashboards). The delta of the newest sample is serialised once and
+    shared by every subscriber, so N open dashboards cost one sampler and a broadcast.
+    """
+
+    FIELDS = ("gpu_utilization", "memory_utilization", "memory_used_mb", "memory_total_mb",
+              "temperature_c", "power_draw_w")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.seq = 0  # samples appended so far
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values: Dict[int, np.ndarray] = {}  # gpu id -> (capacity, len(FIELDS)), NaN = no data
+        self._names: Dict[int, str] = {}
+        self._last_delta: Optional[str] = None
+        self._subscribers: set = set()
+
+    def observe(self, sample: Dict[str, Any], seconds: float):
+        """GpuSampler listener: append the sample and wake the subscribers"""
+        self.append(time.time(), sample["gpus"])
+
+    def append(self, timestamp: float, gpus: List[Dict[str, Any]]):
+        slot = self.seq % self.capacity
+        self._times[slot] = timestamp
+        for values in self._values.values():
+            values[slot] = np.nan
+        for gpu in gpus:
+            values = self._values.get(gpu["id"])
+            if values is None:
+                values = self._values[gpu["id"]] = np.full((self.capacity, len(self.FIELDS)), np.nan)
+            values[slot] = [np.nan if gpu[field] is None else gpu[field] for field in self.FIELDS]
+            self._names[gpu["id"]] = gpu["name"]
+        self.seq += 1
+        self._last_delta = None
+        for queue in self._subscribers:
+            if queue.empty():
+                queue.put_nowait(None)
+
+    def since(self, after_seq: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Samples numbered after after_seq (the whole window when None or when they have
+        been overwritten; reset is then true and the reader should replace its data)
+        """
+        oldest = max(0, self.seq - self.capacity)
+        # A sequence from before a restart (Last-Event-ID) is also a reset
+        reset = after_seq is None or not oldest <= after_seq <= self.seq
+        slots = np.arange(oldest if reset else after_seq, self.seq) % self.capacity
+        return {
+            "seq": self.seq,
+            "reset": reset,
+            "capacity": self.capacity,
+            "timestamps": np.round(self._times[slots], 3).tolist(),
+            "gpus": {
+                gpu_id: {
+                    "name": self._names[gpu_id],
+                    **{
+                        field: [None if math.isnan(v) else v for v in np.round(values[slots, i], 1).tolist()]
+                        for i, field in enumerate(self.FIELDS)
+                    },
+                }
+                for gpu_id, values in self._values.items()
+            },
+        }
+
+    def delta_json(self, after_seq: Optional[int]) -> str:
+        """since(after_seq) as JSON; the one-sample delta is encoded once per sample"""
+        if after_seq is not None and after_seq == self.seq - 1:
+            if self._last_delta is None:
+                self._last_delta = json.dumps(self.since(after_seq))
+            return self._last_delta
+        return json.dumps(self.since(after_seq))
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue that receives a wake-up after every sample (pair with unsubscribe)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": round(self.capacity * GPU_SAMPLE_INTERVAL),
+            "capacity": self.capacity,
+            "samples": min(self.seq, self.capacity),
+            "subscribers": len(self._subscribers),
+        }
+
+
+gpu_sampler = GpuSampler(GPU_SAMPLE_INTERVAL)
+gpu_usage_recorder = GpuUsageRecorder(GPU_USAGE_BATCH_SIZE, GPU_USAGE_FLUSH_INTERVAL)
+gpu_metric_rollup = GpuMetricRollup(GPU_USAGE_FLUSH_INTERVAL)
+gpu_live = GpuLiveBuffer(max(1, math.ceil(GPU_LIVE_WINDOW_MINUTES * 60 / GPU_SAMPLE_INTERVAL)))
+gpu_sampler.add_listener(gpu_usage_recorder.observe)
+gpu_sampler.add_listener(gpu_metric_rollup.observe)
+gpu_sampler.add_listener(gpu_live.observe)
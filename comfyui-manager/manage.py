@@ -0,0 +1,104 @@
+"""
+Management commands for ComfyUI Manager
+Maintenance tasks that run outside the web process
+
+Usage:
+    python manage.py check-balances
+    python manage.py rebuild-balances
+    python manage.py compact-checkpoints
+    python manage.py check-checkpoints
+    python manage.py rebuild-checkpoints
+"""
+
+import argparse
+import asyncio
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import db, init_db
+from wallet import LEDGER_CHECKPOINT_EVERY
+
+
+# ============================================
+# RCC Balance Projection
+# ============================================
+
+async def check_balances() -> int:
+    """Verify that user_balances matches the ledger. Exit code 1 on mismatch."""
+    mismatches = await db.check_user_balances()
+    if not mismatches:
+        print("✅ user_balances is consistent with rcc_ledger")
+        return 0
+
+    print(f"❌ {len(mismatches)} user(s) out of sync with rcc_ledger:")
+    for row in mismatches:
+        print(f"  user {row['user_id']}: ledger={row['ledger_balance']} projected={row['projected_balance']}")
+    print("Run `python manage.py rebuild-balances` to recompute the projection.")
+    return 1
+
+
+async def rebuild_balances() -> int:
+    """Recompute user_balances from rcc_ledger, then verify it."""
+    count = await db.rebuild_user_balances()
+    print(f"✅ Rebuilt balances for {count} user(s)")
+    return await check_balances()
+
+
+# ============================================
+# RCC Ledger Checkpoints
+# ============================================
+
+async def compact_checkpoints() -> int:
+    """Run one pass of the ledger checkpoint compactor."""
+    written = await db.compact_ledger_checkpoints(min_entries=LEDGER_CHECKPOINT_EVERY)
+    print(f"✅ Wrote {written} checkpoint(s)")
+    return 0
+
+
+async def check_checkpoints() -> int:
+    """Verify every checkpoint against the raw ledger. Exit code 1 on mismatch."""
+    mismatches = await db.verify_ledger_checkpoints()
+    if not mismatches:
+        print("✅ All ledger checkpoints match rcc_ledger")
+        return 0
+
+    print(f"❌ {len(mismatches)} checkpoint(s) do not match rcc_ledger:")
+    for row in mismatches:
+        print(
+            f"  checkpoint {row['id']} (user {row['user_id']}, ledger id {row['ledger_id']}): "
+            f"balance={row['balance']} ledger={row['ledger_balance']}"
+        )
+    print("Run `python manage.py rebuild-checkpoints` to recompute them.")
+    return 1
+
+
+async def rebuild_checkpoints() -> int:
+    """Recompute all checkpoints from rcc_ledger, then verify them."""
+    written = await db.rebuild_ledger_checkpoints(every=LEDGER_CHECKPOINT_EVERY)
+    print(f"✅ Rebuilt {written} checkpoint(s)")
+    return await check_checkpoints()
+
+
+COMMANDS = {
+    "check-balances": check_balances,
+    "rebuild-balances": rebuild_balances,
+    "compact-checkpoints": compact_checkpoints,
+    "check-checkpoints": check_checkpoints,
+    "rebuild-checkpoints": rebuild_checkpoints,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ComfyUI Manager maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS.keys()))
+    args = parser.parse_args()
+
+    init_db()
+    return asyncio.run(COMMANDS[args.command]())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Credit reconciler for ComfyUI Manager
+Enforces "no credits -> stop ComfyUI" in the background, off the request path
+"""
+
+import os
+import asyncio
+from datetime import datetime
+from typing import Optional, Set, Dict, Any
+
+from dotenv import load_dotenv
+
+from database import db
+from wallet import get_balances
+from docker_manager import docker_manager, ContainerStatus, OperationState
+
+load_dotenv()
+
+# Seconds between periodic checks of the session owner's balance
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "30"))
+
+# app_settings key holding the id of the user who last started ComfyUI
+OWNER_SETTING = "comfyui_owner_id"
+
+
+class CreditReconciler:
+    """
+    Stops the ComfyUI container when a non-admin user relevant to it has no credits.
+    Every RECONCILE_INTERVAL seconds it checks the user who last started the
+    container; check_user() queues an extra user (e.g. on login) and wakes the
+    loop immediately, so callers never wait on Docker.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.runs = 0
+        self.auto_stops = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._pending: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the reconcile loop on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def check_user(self, user_id: int):
+        """Queue a balance check for this user (returns immediately)"""
+        self._pending.add(user_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def set_owner(self, user_id: Optional[int]):
+        """Record who started the container (None once it is stopped)"""
+        await db.set_setting(OWNER_SETTING, str(user_id) if user_id is not None else "")
+
+    async def clear_owner_after(self, operation_id: str):
+        """Forget the owner once a queued stop has succeeded (a failed stop keeps it enforced)"""
+        try:
+            operation = await docker_manager.wait_for_operation(operation_id)
+            status = await docker_manager.get_status()
+            if (operation and operation["state"] == OperationState.SUCCEEDED
+                    and status.get("status") != ContainerStatus.RUNNING):
+                await self.set_owner(None)
+        except Exception as e:
+            print(f"[WARNING] Could not clear the ComfyUI owner after stop: {e}")
+
+    async def reconcile(self) -> int:
+        """Run one check. Returns the id of the user the container was stopped for, or 0."""
+        candidates, self._pending = self._pending, set()
+        owner = await db.get_setting(OWNER_SETTING)
+        if owner:
+            candidates.add(int(owner))
+        if not candidates:
+            return 0
+
+        balances = await get_balances(list(candidates))
+        for user_id in sorted(uid for uid in candidates if balances.get(uid, 0) <= 0):
+            # Admins bypass credit checks, as in /comfyui/start
+            user = await db.get_user_by_id(user_id)
+            if user is None or user.get("is_admin", False):
+                continue
+
+            status = await docker_manager.get_status()
+            if status.get("status") != ContainerStatus.RUNNING:
+                return 0
+
+            result = await docker_manager.stop()
+            if not result.get("success"):
+                raise RuntimeError(result.get("message"))
+            operation = await docker_manager.wait_for_operation(result["operation_id"])
+            if operation and operation["state"] == OperationState.FAILED:
+                raise RuntimeError(operation["error"])
+            await self.set_owner(None)
+            await db.add_log(
+                action="comfyui_auto_stop",
+                user_id=user_id,
+                details="ComfyUI stopped by reconciler - no credits available"
+            )
+            self.auto_stops += 1
+            return user_id
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "auto_stops": self.auto_stops,
+            "pending": len(self._pending),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_error": self.last_error,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.reconcile()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[WARNING] Credit reconciliation failed: {e}")
+                await db.add_log(
+                    action="comfyui_auto_stop_failed",
+                    details=f"Failed to auto-stop ComfyUI: {str(e)}",
+                    status="error"
+                )
+            self.runs += 1
+            self.last_run_at = datetime.utcnow()
+
+
+credit_reconciler = CreditReconciler(RECONCILE_INTERVAL)
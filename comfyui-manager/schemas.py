@@ -135,6 +135,7 @@ class RCCLedgerEntry(BaseModel):
     job_id: Optional[int] = None
     external_ref: Optional[str] = None
     created_at: datetime
+    balance_after: Optional[int] = None  # Running balance after this entry
     
     class Config:
         from_attributes = True
@@ -148,6 +149,8 @@ class RCCBalance(BaseModel):
 class RCCHistory(BaseModel):
     entries: List[RCCLedgerEntry]
     balance: int
+    next_cursor: Optional[str] = None  # older entries
+    prev_cursor: Optional[str] = None  # newer entries
 
 
 # ============================================
@@ -289,6 +292,26 @@ class TokenData(BaseModel):
     is_admin: bool = False
 
 
+class ApiKeyCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    scopes: List[str] = ["jobs:read", "jobs:write", "wallet:read"]
+    expires_in_days: Optional[int] = Field(None, ge=1, description="Omit for a key that does not expire")
+
+
+class ApiKeyInfo(BaseModel):
+    id: int
+    name: str
+    prefix: str
+    scopes: List[str]
+    created_at: datetime
+    expires_at: Optional[datetime] = None
+    revoked_at: Optional[datetime] = None
+
+
+class ApiKeyCreated(ApiKeyInfo):
+    key: str  # shown once, only the hash is stored
+
+
 # ============================================
 # Admin Dashboard Schemas
 # ============================================
@@ -0,0 +1,77 @@
+"""
+Shared scaffolding for the benchmark scripts
+
+Nearest-rank percentiles (the usage_stats helper the admin statistics use), a
+free local port, the "--seed" subprocess step and a portal served by uvicorn
+on a throwaway SQLite database. Scripts run from comfyui-manager/ and import
+this module as `from _bench_common import ...`.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+import httpx
+
+APP_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(APP_DIR))
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """usage_stats.percentile, imported on first use so that importing this module
+    does not configure the database before a script has set its environment"""
+    from usage_stats import percentile as nearest_rank
+    return nearest_rank(sorted_values, pct)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sqlite_env(tmp: Path, **overrides) -> Dict[str, str]:
+    """Environment for a portal on a fresh SQLite database in `tmp` (Supabase disabled)"""
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{Path(tmp) / 'bench.db'}",
+        "SUPABASE_URL": "",
+        "SUPABASE_KEY": "",
+        **{name: str(value) for name, value in overrides.items()},
+    }
+
+
+def run_seed(script: str, env: Dict[str, str], *args: str) -> str:
+    """Run `script --seed [args]` in a subprocess with `env` and return its stdout"""
+    return subprocess.run(
+        [sys.executable, script, "--seed", *args],
+        env=env, cwd=str(APP_DIR), capture_output=True, text=True, check=True
+    ).stdout
+
+
+@contextmanager
+def serve_portal(env: Dict[str, str]) -> Iterator[str]:
+    """Serve app:app with uvicorn under `env`; yields the base URL once /health answers"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning",
+         "--timeout-keep-alive", "120"],
+        env=env, cwd=str(APP_DIR), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/health", timeout=1)
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,121 @@
+"""
+Benchmark: login throughput and event-loop responsiveness during a login burst
+
+Starts the portal under uvicorn against a throwaway SQLite database and fires
+concurrent POST /auth/login requests while a probe polls GET /health. Each pass
+runs with a different PASSWORD_HASH_WORKERS; 0 runs bcrypt inline on the event
+loop (the legacy behaviour), so the first row is "before". Logins rejected with
+503 because the hashing queue was full are counted separately.
+
+Usage (from comfyui-manager/):
+    python scripts/bench_login.py
+    python scripts/bench_login.py --clients 50 --logins 4 --workers 0,2,4 --queue-limit 32
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from _bench_common import percentile, sqlite_env, run_seed, serve_portal
+
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+
+
+def seed():
+    """Create the benchmark user (environment already configured)"""
+    from database import db, init_db, close_db
+    from auth import get_password_hash
+
+    async def _seed():
+        await db.create_user(email=EMAIL, password_hash=get_password_hash(PASSWORD))
+        await close_db()
+
+    init_db()
+    asyncio.run(_seed())
+
+
+async def load(base_url: str, args) -> dict:
+    """Drive login clients plus a /health probe, return latency stats for both"""
+    logins, health = [], []
+    rejected = 0
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=args.clients + 1),
+                                 timeout=120) as client:
+        async def login_client():
+            nonlocal rejected
+            for _ in range(args.logins):
+                started = time.perf_counter()
+                response = await client.post("/auth/login", data={"username": EMAIL, "password": PASSWORD})
+                if response.status_code == 503:
+                    rejected += 1
+                    continue
+                response.raise_for_status()
+                logins.append((time.perf_counter() - started) * 1000)
+
+        async def health_probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                (await client.get("/health")).raise_for_status()
+                health.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(0.05)
+
+        probe = asyncio.create_task(health_probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_client() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe
+
+    logins.sort()
+    health.sort()
+    return {
+        "logins_per_s": round(len(logins) / elapsed, 1),
+        "login_p50_ms": round(percentile(logins, 50), 1),
+        "login_p99_ms": round(percentile(logins, 99), 1),
+        "rejected": rejected,
+        "health_p99_ms": round(percentile(health, 99), 1),
+        "health_max_ms": round(health[-1], 1) if health else 0.0,
+    }
+
+
+def run_pass(workers: int, args) -> dict:
+    """Seed a fresh database, serve it with uvicorn and run the load against it"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = sqlite_env(tmp, BCRYPT_ROUNDS=args.rounds, PASSWORD_HASH_WORKERS=workers,
+                         PASSWORD_HASH_QUEUE_LIMIT=args.queue_limit)
+        run_seed(__file__, env)
+        with serve_portal(env) as base_url:
+            return asyncio.run(load(base_url, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="concurrent login clients")
+    parser.add_argument("--logins", type=int, default=4, help="logins per client")
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS")
+    parser.add_argument("--queue-limit", type=int, default=32, help="PASSWORD_HASH_QUEUE_LIMIT")
+    parser.add_argument("--workers", default="0,2", help="comma-separated PASSWORD_HASH_WORKERS values (0 = inline)")
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed()
+        return
+
+    print(f"POST /auth/login - {args.clients} clients x {args.logins} logins, bcrypt cost {args.rounds}, "
+          f"queue limit {args.queue_limit}, GET /health probed every 50 ms\n")
+    print(f"{'mode':<14}{'logins/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'503s':>7}{'health p99':>12}{'health max':>12}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        result = run_pass(workers, args)
+        mode = "inline" if workers == 0 else f"{workers} workers"
+        print(f"{mode:<14}{result['logins_per_s']:>10}{result['login_p50_ms']:>10}{result['login_p99_ms']:>10}"
+              f"{result['rejected']:>7}{result['health_p99_ms']:>12}{result['health_max_ms']:>12}")
+
+
+if __name__ == "__main__":
+    main()
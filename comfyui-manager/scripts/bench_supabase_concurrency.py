@@ -0,0 +1,100 @@
+"""
+Benchmark: concurrent Supabase queries overlap their network I/O
+
+Starts a minimal PostgREST-compatible stand-in (every table read returns []
+and every RPC returns null after a fixed latency), points the Supabase
+backend at it through SUPABASE_REST_URL and fires concurrent Database calls.
+With a blocking client the calls run one after another; with the async
+client the elapsed time should be close to
+    latency * ceil(calls / min(SUPABASE_MAX_CONCURRENCY, SUPABASE_MAX_CONNECTIONS))
+(the stand-in is HTTP/1.1, so each in-flight request needs its own connection).
+
+Usage (from comfyui-manager/):
+    python scripts/bench_supabase_concurrency.py
+    python scripts/bench_supabase_concurrency.py --calls 200 --latency-ms 50 --max-concurrency 20
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import threading
+import time
+
+from _bench_common import free_port
+
+
+def start_stand_in(port: int, latency: float, stats: dict):
+    """Serve a PostgREST-shaped API on a background thread"""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def handle(request):
+        stats["in_flight"] += 1
+        stats["peak"] = max(stats["peak"], stats["in_flight"])
+        try:
+            await asyncio.sleep(latency)
+            if request.url.path.startswith("/rpc/"):
+                return JSONResponse(None)
+            return JSONResponse([])
+        finally:
+            stats["in_flight"] -= 1
+
+    app = Starlette(routes=[Route("/{path:path}", handle, methods=["GET", "POST", "PATCH", "DELETE"])])
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_calls(calls: int) -> float:
+    from database import db, close_db
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        db.get_user_by_email(f"user{i}@example.com") if i % 2 else db.get_user_rcc_balance(i)
+        for i in range(calls)
+    ))
+    elapsed = time.perf_counter() - started
+    await close_db()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="concurrent Database calls")
+    parser.add_argument("--latency-ms", type=int, default=50, help="stand-in latency per request")
+    parser.add_argument("--max-concurrency", type=int, default=50, help="SUPABASE_MAX_CONCURRENCY")
+    args = parser.parse_args()
+
+    port = free_port()
+    stats = {"in_flight": 0, "peak": 0}
+    server = start_stand_in(port, args.latency_ms / 1000, stats)
+
+    os.environ.update({
+        "SUPABASE_URL": f"http://127.0.0.1:{port}",
+        "SUPABASE_KEY": "stand-in",
+        "SUPABASE_REST_URL": f"http://127.0.0.1:{port}",
+        "SUPABASE_MAX_CONCURRENCY": str(args.max_concurrency),
+    })
+    elapsed = asyncio.run(run_calls(args.calls))
+    server.should_exit = True
+
+    serial = args.calls * args.latency_ms / 1000
+    # The stand-in speaks HTTP/1.1, so in-flight requests are also capped by the connection pool
+    from database import SUPABASE_MAX_CONNECTIONS
+    slots = min(args.max_concurrency, SUPABASE_MAX_CONNECTIONS)
+    ideal = math.ceil(args.calls / slots) * args.latency_ms / 1000
+    print(f"{args.calls} calls, {args.latency_ms} ms stand-in latency, max concurrency {args.max_concurrency}")
+    print(f"  {'elapsed:':<28}{elapsed:.2f}s")
+    print(f"  {'serial (blocking client):':<28}{serial:.2f}s")
+    print(f"  {'ideal (async client):':<28}{ideal:.2f}s")
+    print(f"  {'peak in-flight at stand-in:':<28}{stats['peak']}")
+
+
+if __name__ == "__main__":
+    main()
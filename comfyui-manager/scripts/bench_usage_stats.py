@@ -0,0 +1,97 @@
+"""
+Benchmark: vectorized usage statistics (usage_stats.compute_usage_stats)
+
+Generates synthetic job and gpu_usage columns (durations, utilisation, memory,
+job types, users) and times the NumPy statistics over them: percentiles,
+histograms and per job type / per user aggregates. A pure-Python pass with
+sorted() per group over the first --baseline-rows rows is timed as "before".
+
+Usage (from comfyui-manager/):
+    python scripts/bench_usage_stats.py
+    python scripts/bench_usage_stats.py --rows 5000000 --users 2000 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+APP_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(APP_DIR))
+
+from usage_stats import compute_usage_stats  # noqa: E402
+
+
+def make_columns(rows: int, users: int, seed: int = 1):
+    """Job and gpu_usage columns with one gpu_usage row per job"""
+    rng = np.random.default_rng(seed)
+    job_ids = np.arange(1, rows + 1)
+    types = np.where(rng.random(rows) < 0.8, "IMAGE_TASK", "VIDEO_TASK")
+    user_ids = rng.integers(1, users + 1, rows)
+    durations = np.where(types == "IMAGE_TASK", rng.lognormal(8.5, 0.6, rows), rng.lognormal(10.5, 0.8, rows))
+    jobs = {"id": job_ids, "type": types, "user_id": user_ids, "duration_ms": durations.round()}
+    gpu = {
+        "job_id": job_ids,
+        "user_id": user_ids,
+        "gpu_utilization": rng.integers(0, 101, rows).astype(np.float64),
+        "memory_used_mb": rng.normal(14000, 3000, rows).clip(500, 24000).round(),
+    }
+    return jobs, gpu
+
+
+def python_baseline(jobs, gpu) -> float:
+    """Per-group sorted() percentiles over Python lists (the list-comprehension approach)"""
+    started = time.perf_counter()
+    columns = {key: values.tolist() for key, values in jobs.items()}
+    gpu_columns = {key: values.tolist() for key, values in gpu.items()}
+    job_type = dict(zip(columns["id"], columns["type"]))
+    for values, types, users in (
+        (columns["duration_ms"], columns["type"], columns["user_id"]),
+        (gpu_columns["gpu_utilization"], [job_type.get(j, "unknown") for j in gpu_columns["job_id"]], gpu_columns["user_id"]),
+        (gpu_columns["memory_used_mb"], [job_type.get(j, "unknown") for j in gpu_columns["job_id"]], gpu_columns["user_id"]),
+    ):
+        for keys in ([0] * len(values), types, users):
+            groups = {}
+            for key, value in zip(keys, values):
+                groups.setdefault(key, []).append(value)
+            for group in groups.values():
+                group.sort()
+                n = len(group)
+                _ = [group[max(0, min(n - 1, round(p / 100 * n) - 1))] for p in (50, 95, 99)]
+                _ = sum(group) / n
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="jobs and gpu_usage rows each")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-rows", type=int, default=500_000,
+                        help="rows for the pure-Python pass (0 to skip)")
+    args = parser.parse_args()
+
+    jobs, gpu = make_columns(args.rows, args.users)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        stats = compute_usage_stats(jobs, gpu)
+        timings.append(time.perf_counter() - started)
+    samples = stats["jobs"] + stats["gpu_records"]
+    print(f"numpy   {args.rows:>10,} rows x 2 tables   best {min(timings) * 1000:8.1f} ms   "
+          f"worst {max(timings) * 1000:8.1f} ms   {samples / min(timings) / 1e6:6.1f} M values/s")
+    print(f"        duration_ms p50/p95/p99: {stats['duration_ms']['overall']['p50']:.0f} / "
+          f"{stats['duration_ms']['overall']['p95']:.0f} / {stats['duration_ms']['overall']['p99']:.0f}")
+
+    if args.baseline_rows:
+        rows = min(args.baseline_rows, args.rows)
+        subset = lambda columns: {key: values[:rows] for key, values in columns.items()}  # noqa: E731
+        elapsed = python_baseline(subset(jobs), subset(gpu))
+        print(f"python  {rows:>10,} rows x 2 tables   {elapsed * 1000:8.1f} ms   "
+              f"(~{elapsed * args.rows / rows * 1000:,.0f} ms extrapolated to {args.rows:,})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: /wallet/balance latency under concurrent clients (SQLite backend)
+
+Starts the portal under uvicorn against a throwaway SQLite database and fires
+concurrent authenticated GET /wallet/balance requests while a few clients
+page through a large /wallet/history (the "slow query" that used to stall the
+event loop). Each pass runs with a different SQLITE_POOL_SIZE; 0 is the
+legacy inline connection-per-query mode, so the first row is "before".
+
+Usage (from comfyui-manager/):
+    python scripts/bench_wallet_balance.py
+    python scripts/bench_wallet_balance.py --clients 200 --requests 20 --pool-sizes 0,4,8
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from _bench_common import percentile, sqlite_env, run_seed, serve_portal
+
+
+def seed(ledger_entries: int):
+    """Create the benchmark user and ledger (environment already configured), print a token"""
+    from database import db, init_db, close_db, RCCReason
+    from auth import get_password_hash, create_user_token
+
+    async def _seed():
+        user = await db.create_user(email="bench@example.com", password_hash=get_password_hash("benchmark"))
+        for _ in range(ledger_entries):
+            await db.add_rcc_entry(user["id"], 1, RCCReason.MANUAL_ADJUST)
+        token = create_user_token(user)
+        await close_db()
+        return token
+
+    init_db()
+    token = asyncio.run(_seed())
+    print(token)
+
+
+async def load(base_url: str, token: str, args) -> dict:
+    """Drive balance clients plus slow history readers, return balance latency stats"""
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=args.clients + args.slow_clients)
+    latencies = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def balance_client():
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = await client.get("/wallet/balance")
+                latencies.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+
+        async def history_client():
+            while not done.is_set():
+                response = await client.get("/wallet/history", params={"limit": 500})
+                response.raise_for_status()
+
+        slow = [asyncio.create_task(history_client()) for _ in range(args.slow_clients)]
+        started = time.perf_counter()
+        await asyncio.gather(*(balance_client() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*slow)
+
+    latencies.sort()
+    return {
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(latencies[-1], 1),
+    }
+
+
+def run_pass(pool_size: int, args) -> dict:
+    """Seed a fresh database, serve it with uvicorn and run the load against it"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = sqlite_env(tmp, SQLITE_POOL_SIZE=pool_size)
+        token = run_seed(__file__, env, "--ledger-entries", str(args.ledger_entries)).strip().splitlines()[-1]
+        with serve_portal(env) as base_url:
+            return asyncio.run(load(base_url, token, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent /wallet/balance clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests per balance client")
+    parser.add_argument("--slow-clients", type=int, default=4, help="concurrent /wallet/history readers")
+    parser.add_argument("--ledger-entries", type=int, default=5000, help="ledger rows seeded for the user")
+    parser.add_argument("--pool-sizes", default="0,4", help="comma-separated SQLITE_POOL_SIZE values (0 = legacy inline)")
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.ledger_entries)
+        return
+
+    print(f"GET /wallet/balance - {args.clients} clients x {args.requests} requests, "
+          f"{args.slow_clients} concurrent /wallet/history readers\n")
+    print(f"{'mode':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for pool_size in [int(p) for p in args.pool_sizes.split(",")]:
+        result = run_pass(pool_size, args)
+        mode = "inline (legacy)" if pool_size == 0 else f"pool size {pool_size}"
+        print(f"{mode:<18}{result['throughput_rps']:>10}{result['p50_ms']:>10}"
+              f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['max_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@ CREATE TABLE IF NOT EXISTS users (
 -- Index for email lookups
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_gitlab_id ON users(gitlab_id);
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id);
 
 -- =============================================
 -- Jobs Table
@@ -44,6 +45,10 @@ CREATE TABLE IF NOT EXISTS jobs (
 CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs(user_id);
 CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
 CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+-- Keyset pagination: lists are ordered by (created_at, id) within their filter
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at_id ON jobs(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_id_created_at_id ON jobs(user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at_id ON jobs(status, created_at, id);
 
 -- =============================================
 -- RCC Ledger Table (CRITICAL - Source of Truth)
@@ -69,6 +74,92 @@ CREATE TABLE IF NOT EXISTS rcc_ledger (
 CREATE INDEX IF NOT EXISTS idx_rcc_ledger_user_id ON rcc_ledger(user_id);
 CREATE INDEX IF NOT EXISTS idx_rcc_ledger_reason ON rcc_ledger(reason);
 CREATE INDEX IF NOT EXISTS idx_rcc_ledger_created_at ON rcc_ledger(created_at);
+CREATE INDEX IF NOT EXISTS idx_rcc_ledger_user_id_id ON rcc_ledger(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_rcc_ledger_reason_created_at ON rcc_ledger(reason, created_at);
+CREATE INDEX IF NOT EXISTS idx_rcc_ledger_user_id_created_at_id ON rcc_ledger(user_id, created_at, id);
+
+-- =============================================
+-- User Balances (projection of rcc_ledger)
+-- =============================================
+-- Earlier versions of this schema defined user_balances as a view
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_views WHERE schemaname = 'public' AND viewname = 'user_balances') THEN
+        DROP VIEW user_balances;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS user_balances (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id),
+    rcc_balance INTEGER NOT NULL DEFAULT 0,
+    last_ledger_id BIGINT,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Apply each ledger entry to the projection in the same transaction
+CREATE OR REPLACE FUNCTION apply_rcc_ledger_balance()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_balances (user_id, rcc_balance, last_ledger_id, updated_at)
+    VALUES (NEW.user_id, NEW.delta, NEW.id, NOW())
+    ON CONFLICT (user_id) DO UPDATE SET
+        rcc_balance = user_balances.rcc_balance + EXCLUDED.rcc_balance,
+        last_ledger_id = GREATEST(user_balances.last_ledger_id, EXCLUDED.last_ledger_id),
+        updated_at = EXCLUDED.updated_at;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS trg_rcc_ledger_apply_balance ON rcc_ledger;
+CREATE TRIGGER trg_rcc_ledger_apply_balance
+    AFTER INSERT ON rcc_ledger
+    FOR EACH ROW EXECUTE FUNCTION apply_rcc_ledger_balance();
+
+CREATE INDEX IF NOT EXISTS idx_user_balances_rcc_balance ON user_balances(rcc_balance, user_id);
+
+-- Every user has a projection row (balance 0 until a ledger entry), so balance
+-- sorts and filters read user_balances and its (rcc_balance, user_id) index
+CREATE OR REPLACE FUNCTION create_user_balance()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_balances (user_id, rcc_balance, updated_at)
+    VALUES (NEW.id, 0, NOW())
+    ON CONFLICT (user_id) DO NOTHING;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS trg_users_create_balance ON users;
+CREATE TRIGGER trg_users_create_balance
+    AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION create_user_balance();
+
+INSERT INTO user_balances (user_id, rcc_balance, updated_at)
+SELECT id, 0, NOW() FROM users
+ON CONFLICT (user_id) DO NOTHING;
+
+-- Users joined with their balance, for sorting/filtering the admin user list
+-- (security_invoker keeps the underlying tables' RLS in force; no password hashes)
+DROP VIEW IF EXISTS users_with_balances;
+CREATE VIEW users_with_balances WITH (security_invoker = true) AS
+SELECT b.user_id AS id, u.email, u.is_admin, u.gitlab_id, u.created_at, b.rcc_balance
+FROM user_balances b
+JOIN users u ON u.id = b.user_id;
+
+-- =============================================
+-- RCC Ledger Checkpoints (balance as of a ledger id)
+-- =============================================
+-- Written by the background compactor; always verifiable and rebuildable
+-- from rcc_ledger, which stays the source of truth.
+CREATE TABLE IF NOT EXISTS rcc_ledger_checkpoints (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id),
+    ledger_id BIGINT NOT NULL REFERENCES rcc_ledger(id),
+    balance INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE (user_id, ledger_id)
+);
 
 -- =============================================
 -- Payments Table (Audit)
@@ -108,6 +199,49 @@ CREATE TABLE IF NOT EXISTS logs (
 CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_logs_action ON logs(action);
 CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_logs_created_at_id ON logs(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_logs_action_created_at_id ON logs(action, created_at, id);
+
+-- =============================================
+-- API Keys (Automation Clients)
+-- =============================================
+-- The secret is never stored; key_hash is HMAC-SHA256 of the full key.
+-- Lookups go through the unique index on prefix.
+CREATE TABLE IF NOT EXISTS api_keys (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id),
+    name TEXT NOT NULL,
+    prefix TEXT UNIQUE NOT NULL,
+    key_hash TEXT NOT NULL,
+    scopes TEXT NOT NULL,  -- comma-separated, e.g. 'jobs:read,jobs:write'
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ,
+    revoked_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_api_keys_user_id ON api_keys(user_id);
+
+-- =============================================
+-- ComfyUI Startups Table (per-phase cold start timings, seconds)
+-- =============================================
+CREATE TABLE IF NOT EXISTS comfyui_startups (
+    id BIGSERIAL PRIMARY KEY,
+    started_at TIMESTAMPTZ NOT NULL,
+    outcome TEXT NOT NULL,  -- 'ready', 'timeout' or 'failed'
+    image_pulled BOOLEAN DEFAULT FALSE,
+    container_created BOOLEAN DEFAULT FALSE,
+    prepare_seconds REAL,
+    image_seconds REAL,
+    pull_bytes BIGINT,
+    create_seconds REAL,
+    start_seconds REAL,
+    first_log_seconds REAL,
+    ready_seconds REAL,
+    total_seconds REAL,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_comfyui_startups_started_at ON comfyui_startups(started_at);
 
 -- =============================================
 -- App Settings Table (Key-Value Store)
@@ -126,17 +260,6 @@ ON CONFLICT (key) DO NOTHING;
 -- Views for Common Queries
 -- =============================================
 
--- User balance view (calculated from ledger)
-CREATE OR REPLACE VIEW user_balances AS
-SELECT 
-    u.id as user_id,
-    u.email,
-    u.is_admin,
-    COALESCE(SUM(l.delta), 0) as rcc_balance
-FROM users u
-LEFT JOIN rcc_ledger l ON u.id = l.user_id
-GROUP BY u.id, u.email, u.is_admin;
-
 -- Daily stats view
 CREATE OR REPLACE VIEW daily_stats AS
 SELECT 
@@ -164,14 +287,124 @@ CREATE TABLE IF NOT EXISTS gpu_usage (
     memory_utilization INTEGER,  -- percentage 0-100
     temperature_c INTEGER,
     power_draw_w REAL,
-    duration_seconds REAL,
+    duration_seconds REAL,  -- GPU-seconds attributed to the job
+    energy_wh REAL,
+    sample_count INTEGER,  -- GPU samples summarised in this row
     recorded_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Added with per-job GPU attribution (existing databases)
+ALTER TABLE gpu_usage ADD COLUMN IF NOT EXISTS energy_wh REAL;
+ALTER TABLE gpu_usage ADD COLUMN IF NOT EXISTS sample_count INTEGER;
+
 -- Indexes for GPU usage
 CREATE INDEX IF NOT EXISTS idx_gpu_usage_user_id ON gpu_usage(user_id);
 CREATE INDEX IF NOT EXISTS idx_gpu_usage_recorded_at ON gpu_usage(recorded_at);
 CREATE INDEX IF NOT EXISTS idx_gpu_usage_job_id ON gpu_usage(job_id);
+CREATE INDEX IF NOT EXISTS idx_gpu_usage_user_id_recorded_at ON gpu_usage(user_id, recorded_at);
+
+-- gpu_usage rolled up per minute/hour/day and user (user_id 0 = not attributed),
+-- maintained by trg_gpu_usage_rollup; stats queries read these instead of gpu_usage
+CREATE TABLE IF NOT EXISTS gpu_usage_rollups (
+    resolution TEXT NOT NULL CHECK (resolution IN ('minute', 'hour', 'day')),
+    bucket TIMESTAMPTZ NOT NULL,
+    user_id BIGINT NOT NULL DEFAULT 0,
+    records BIGINT NOT NULL DEFAULT 0,
+    duration_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    energy_wh DOUBLE PRECISION NOT NULL DEFAULT 0,
+    gpu_utilization_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    gpu_utilization_count BIGINT NOT NULL DEFAULT 0,
+    memory_utilization_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    memory_utilization_count BIGINT NOT NULL DEFAULT 0,
+    power_draw_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    power_draw_count BIGINT NOT NULL DEFAULT 0,
+    peak_memory_mb INTEGER,
+    PRIMARY KEY (resolution, bucket, user_id)
+);
+
+-- GPU device metrics from the sampler per minute/hour/day (add_gpu_metric_minutes), for charts
+CREATE TABLE IF NOT EXISTS gpu_metric_rollups (
+    resolution TEXT NOT NULL CHECK (resolution IN ('minute', 'hour', 'day')),
+    bucket TIMESTAMPTZ NOT NULL,
+    gpu_id INTEGER NOT NULL,
+    samples BIGINT NOT NULL DEFAULT 0,
+    gpu_utilization_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    memory_used_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    memory_used_max INTEGER,
+    power_draw_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    power_draw_count BIGINT NOT NULL DEFAULT 0,
+    temperature_max INTEGER,
+    PRIMARY KEY (resolution, bucket, gpu_id)
+);
+
+-- Add a set of gpu_usage rows to the rollups (used by the trigger and the backfill)
+CREATE OR REPLACE FUNCTION add_gpu_usage_rollups(p_rows gpu_usage[])
+RETURNS VOID AS $$
+    INSERT INTO gpu_usage_rollups AS r
+        (resolution, bucket, user_id, records, duration_seconds, energy_wh,
+         gpu_utilization_sum, gpu_utilization_count, memory_utilization_sum, memory_utilization_count,
+         power_draw_sum, power_draw_count, peak_memory_mb)
+    SELECT res.resolution, date_trunc(res.resolution, g.recorded_at, 'UTC'), COALESCE(g.user_id, 0), COUNT(*),
+           COALESCE(SUM(g.duration_seconds), 0), COALESCE(SUM(g.energy_wh), 0),
+           COALESCE(SUM(g.gpu_utilization), 0), COUNT(g.gpu_utilization),
+           COALESCE(SUM(g.memory_utilization), 0), COUNT(g.memory_utilization),
+           COALESCE(SUM(g.power_draw_w), 0), COUNT(g.power_draw_w), MAX(g.memory_used_mb)
+    FROM unnest(p_rows) g
+    CROSS JOIN (VALUES ('minute'), ('hour'), ('day')) AS res(resolution)
+    GROUP BY 1, 2, 3
+    ON CONFLICT (resolution, bucket, user_id) DO UPDATE SET
+        records = r.records + EXCLUDED.records,
+        duration_seconds = r.duration_seconds + EXCLUDED.duration_seconds,
+        energy_wh = r.energy_wh + EXCLUDED.energy_wh,
+        gpu_utilization_sum = r.gpu_utilization_sum + EXCLUDED.gpu_utilization_sum,
+        gpu_utilization_count = r.gpu_utilization_count + EXCLUDED.gpu_utilization_count,
+        memory_utilization_sum = r.memory_utilization_sum + EXCLUDED.memory_utilization_sum,
+        memory_utilization_count = r.memory_utilization_count + EXCLUDED.memory_utilization_count,
+        power_draw_sum = r.power_draw_sum + EXCLUDED.power_draw_sum,
+        power_draw_count = r.power_draw_count + EXCLUDED.power_draw_count,
+        peak_memory_mb = GREATEST(r.peak_memory_mb, EXCLUDED.peak_memory_mb);
+$$ LANGUAGE sql;
+
+-- Keep the rollups current: one statement-level trigger per (bulk) insert
+CREATE OR REPLACE FUNCTION apply_gpu_usage_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM add_gpu_usage_rollups(ARRAY(SELECT n FROM new_rows n));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_gpu_usage_rollup ON gpu_usage;
+CREATE TRIGGER trg_gpu_usage_rollup
+    AFTER INSERT ON gpu_usage
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_gpu_usage_rollups();
+
+-- Merge per-minute sampler aggregates into the minute, hour and day metric rollups
+CREATE OR REPLACE FUNCTION add_gpu_metric_minutes(p_rows JSONB)
+RETURNS VOID AS $$
+    INSERT INTO gpu_metric_rollups AS r
+        (resolution, bucket, gpu_id, samples, gpu_utilization_sum, memory_used_sum, memory_used_max,
+         power_draw_sum, power_draw_count, temperature_max)
+    SELECT res.resolution, date_trunc(res.resolution, (m.bucket || 'Z')::TIMESTAMPTZ, 'UTC'), m.gpu_id,
+           SUM(m.samples), SUM(m.gpu_utilization_sum), SUM(m.memory_used_sum), MAX(m.memory_used_max),
+           SUM(m.power_draw_sum), SUM(m.power_draw_count), MAX(m.temperature_max)
+    FROM jsonb_to_recordset(p_rows) AS m(
+        bucket TEXT, gpu_id INTEGER, samples BIGINT, gpu_utilization_sum DOUBLE PRECISION,
+        memory_used_sum DOUBLE PRECISION, memory_used_max INTEGER, power_draw_sum DOUBLE PRECISION,
+        power_draw_count BIGINT, temperature_max INTEGER
+    )
+    CROSS JOIN (VALUES ('minute'), ('hour'), ('day')) AS res(resolution)
+    GROUP BY 1, 2, 3
+    ON CONFLICT (resolution, bucket, gpu_id) DO UPDATE SET
+        samples = r.samples + EXCLUDED.samples,
+        gpu_utilization_sum = r.gpu_utilization_sum + EXCLUDED.gpu_utilization_sum,
+        memory_used_sum = r.memory_used_sum + EXCLUDED.memory_used_sum,
+        memory_used_max = GREATEST(r.memory_used_max, EXCLUDED.memory_used_max),
+        power_draw_sum = r.power_draw_sum + EXCLUDED.power_draw_sum,
+        power_draw_count = r.power_draw_count + EXCLUDED.power_draw_count,
+        temperature_max = GREATEST(r.temperature_max, EXCLUDED.temperature_max);
+$$ LANGUAGE sql;
 
 -- =============================================
 -- Row Level Security (RLS) - Optional
@@ -181,8 +414,14 @@ CREATE INDEX IF NOT EXISTS idx_gpu_usage_job_id ON gpu_usage(job_id);
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE jobs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE rcc_ledger ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_balances ENABLE ROW LEVEL SECURITY;
+ALTER TABLE rcc_ledger_checkpoints ENABLE ROW LEVEL SECURITY;
 ALTER TABLE payments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE logs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE api_keys ENABLE ROW LEVEL SECURITY;
+ALTER TABLE comfyui_startups ENABLE ROW LEVEL SECURITY;
+ALTER TABLE gpu_usage_rollups ENABLE ROW LEVEL SECURITY;
+ALTER TABLE gpu_metric_rollups ENABLE ROW LEVEL SECURITY;
 
 -- Policies will depend on your authentication setup
 -- These are examples for reference:
@@ -199,12 +438,12 @@ ALTER TABLE logs ENABLE ROW LEVEL SECURITY;
 -- Functions
 -- =============================================
 
--- Function to calculate user balance
+-- Function to get user balance (from the user_balances projection)
 CREATE OR REPLACE FUNCTION get_user_balance(p_user_id BIGINT)
 RETURNS INTEGER AS $$
 BEGIN
     RETURN COALESCE(
-        (SELECT SUM(delta) FROM rcc_ledger WHERE user_id = p_user_id),
+        (SELECT rcc_balance FROM user_balances WHERE user_id = p_user_id),
         0
     );
 END;
@@ -218,6 +457,319 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Atomically debit RCC if the balance covers it (conditional JOB_RESERVE)
+-- Returns {"success": bool, "balance": int, "entry": ledger row | null}
+CREATE OR REPLACE FUNCTION debit_rcc_if_sufficient(
+    p_user_id BIGINT,
+    p_amount INTEGER,
+    p_reason TEXT DEFAULT 'JOB_RESERVE',
+    p_job_id BIGINT DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_balance INTEGER;
+    v_entry rcc_ledger;
+BEGIN
+    -- A negative amount would credit the user
+    IF p_amount IS NULL OR p_amount <= 0 THEN
+        RAISE EXCEPTION 'p_amount must be positive, got %', p_amount;
+    END IF;
+
+    -- Lock the user's balance row so concurrent debits serialize
+    INSERT INTO user_balances (user_id, rcc_balance) VALUES (p_user_id, 0)
+    ON CONFLICT (user_id) DO NOTHING;
+    SELECT rcc_balance INTO v_balance FROM user_balances WHERE user_id = p_user_id FOR UPDATE;
+
+    IF v_balance < p_amount THEN
+        RETURN jsonb_build_object('success', FALSE, 'balance', v_balance, 'entry', NULL);
+    END IF;
+
+    INSERT INTO rcc_ledger (user_id, delta, reason, job_id)
+    VALUES (p_user_id, -p_amount, p_reason, p_job_id)
+    RETURNING * INTO v_entry;
+
+    RETURN jsonb_build_object('success', TRUE, 'balance', v_balance - p_amount, 'entry', to_jsonb(v_entry));
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Create a job and reserve its cost in one transaction (nothing written if insufficient)
+-- Returns {"success": bool, "balance": int, "job": job row | null, "entry": ledger row | null}
+CREATE OR REPLACE FUNCTION create_job_with_reserve(
+    p_user_id BIGINT,
+    p_type TEXT,
+    p_cost INTEGER,
+    p_metadata TEXT DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_balance INTEGER;
+    v_job jobs;
+    v_entry rcc_ledger;
+BEGIN
+    IF p_cost IS NULL OR p_cost <= 0 THEN
+        RAISE EXCEPTION 'p_cost must be positive, got %', p_cost;
+    END IF;
+
+    INSERT INTO user_balances (user_id, rcc_balance) VALUES (p_user_id, 0)
+    ON CONFLICT (user_id) DO NOTHING;
+    SELECT rcc_balance INTO v_balance FROM user_balances WHERE user_id = p_user_id FOR UPDATE;
+
+    IF v_balance < p_cost THEN
+        RETURN jsonb_build_object('success', FALSE, 'balance', v_balance, 'job', NULL, 'entry', NULL);
+    END IF;
+
+    INSERT INTO jobs (user_id, type, cost_rcc, status, admin_bypass, metadata)
+    VALUES (p_user_id, p_type, p_cost, 'created', FALSE, to_jsonb(p_metadata))
+    RETURNING * INTO v_job;
+
+    INSERT INTO rcc_ledger (user_id, delta, reason, job_id)
+    VALUES (p_user_id, -p_cost, 'JOB_RESERVE', v_job.id)
+    RETURNING * INTO v_entry;
+
+    RETURN jsonb_build_object(
+        'success', TRUE,
+        'balance', v_balance - p_cost,
+        'job', to_jsonb(v_job),
+        'entry', to_jsonb(v_entry)
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Rebuild the user_balances projection from the ledger (returns users written)
+CREATE OR REPLACE FUNCTION rebuild_user_balances()
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- Block concurrent ledger writes while the projection is recomputed
+    LOCK TABLE rcc_ledger IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM user_balances;
+    INSERT INTO user_balances (user_id, rcc_balance, last_ledger_id, updated_at)
+    SELECT u.id, COALESCE(SUM(l.delta), 0), MAX(l.id), NOW()
+    FROM users u
+    LEFT JOIN rcc_ledger l ON l.user_id = u.id
+    GROUP BY u.id;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Consistency check: users whose projected balance differs from the ledger
+CREATE OR REPLACE FUNCTION check_user_balances()
+RETURNS TABLE (user_id BIGINT, ledger_balance BIGINT, projected_balance BIGINT) AS $$
+    SELECT
+        COALESCE(l.user_id, b.user_id),
+        COALESCE(l.ledger_balance, 0),
+        COALESCE(b.rcc_balance, 0)::BIGINT
+    FROM (SELECT r.user_id, SUM(r.delta) AS ledger_balance FROM rcc_ledger r GROUP BY r.user_id) l
+    FULL OUTER JOIN user_balances b ON b.user_id = l.user_id
+    WHERE COALESCE(l.ledger_balance, 0) <> COALESCE(b.rcc_balance, 0);
+$$ LANGUAGE sql STABLE;
+
+-- Balance as of a ledger entry: nearest checkpoint plus the deltas after it
+CREATE OR REPLACE FUNCTION get_rcc_balance_at(p_user_id BIGINT, p_ledger_id BIGINT)
+RETURNS INTEGER AS $$
+DECLARE
+    v_base_id BIGINT := 0;
+    v_base_balance INTEGER := 0;
+BEGIN
+    SELECT ledger_id, balance INTO v_base_id, v_base_balance
+    FROM rcc_ledger_checkpoints
+    WHERE user_id = p_user_id AND ledger_id <= p_ledger_id
+    ORDER BY ledger_id DESC
+    LIMIT 1;
+
+    RETURN COALESCE(v_base_balance, 0) + COALESCE(
+        (SELECT SUM(delta) FROM rcc_ledger
+         WHERE user_id = p_user_id AND id > COALESCE(v_base_id, 0) AND id <= p_ledger_id),
+        0
+    );
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Write a checkpoint for users with at least p_min_entries entries since their last one
+CREATE OR REPLACE FUNCTION compact_ledger_checkpoints(p_min_entries INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    INSERT INTO rcc_ledger_checkpoints (user_id, ledger_id, balance, entry_count)
+    SELECT b.user_id, MAX(l.id),
+           COALESCE(cp.balance, 0) + SUM(l.delta),
+           COALESCE(cp.entry_count, 0) + COUNT(l.id)
+    FROM user_balances b
+    LEFT JOIN LATERAL (
+        SELECT c.ledger_id, c.balance, c.entry_count
+        FROM rcc_ledger_checkpoints c
+        WHERE c.user_id = b.user_id
+        ORDER BY c.ledger_id DESC
+        LIMIT 1
+    ) cp ON TRUE
+    JOIN rcc_ledger l ON l.user_id = b.user_id AND l.id > COALESCE(cp.ledger_id, 0)
+    GROUP BY b.user_id, cp.balance, cp.entry_count
+    HAVING COUNT(l.id) >= p_min_entries
+    ON CONFLICT (user_id, ledger_id) DO NOTHING;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Checkpoints that do not match a recomputation from the raw ledger
+CREATE OR REPLACE FUNCTION verify_ledger_checkpoints()
+RETURNS TABLE (
+    id BIGINT, user_id BIGINT, ledger_id BIGINT, balance INTEGER, entry_count INTEGER,
+    ledger_balance BIGINT, ledger_entry_count BIGINT
+) AS $$
+    SELECT * FROM (
+        SELECT c.id, c.user_id, c.ledger_id, c.balance, c.entry_count,
+               (SELECT COALESCE(SUM(l.delta), 0) FROM rcc_ledger l
+                WHERE l.user_id = c.user_id AND l.id <= c.ledger_id),
+               (SELECT COUNT(*) FROM rcc_ledger l
+                WHERE l.user_id = c.user_id AND l.id <= c.ledger_id)
+        FROM rcc_ledger_checkpoints c
+    ) v (id, user_id, ledger_id, balance, entry_count, ledger_balance, ledger_entry_count)
+    WHERE v.balance <> v.ledger_balance OR v.entry_count <> v.ledger_entry_count;
+$$ LANGUAGE sql STABLE;
+
+-- Drop and recompute all checkpoints from the ledger (one every p_every entries per user)
+CREATE OR REPLACE FUNCTION rebuild_ledger_checkpoints(p_every INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    LOCK TABLE rcc_ledger IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM rcc_ledger_checkpoints;
+    INSERT INTO rcc_ledger_checkpoints (user_id, ledger_id, balance, entry_count)
+    SELECT user_id, id, running_balance, entry_count
+    FROM (
+        SELECT user_id, id,
+               SUM(delta) OVER (PARTITION BY user_id ORDER BY id) AS running_balance,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS entry_count
+        FROM rcc_ledger
+    ) r
+    WHERE entry_count % p_every = 0;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Total RCC consumed by job reservations, optionally since a timestamp
+CREATE OR REPLACE FUNCTION get_total_rcc_consumed(p_since TIMESTAMPTZ DEFAULT NULL)
+RETURNS BIGINT AS $$
+    SELECT COALESCE(SUM(ABS(delta)), 0)::BIGINT
+    FROM rcc_ledger
+    WHERE reason = 'JOB_RESERVE' AND (p_since IS NULL OR created_at >= p_since);
+$$ LANGUAGE sql STABLE;
+
+-- Admin dashboard tiles in one round trip
+CREATE OR REPLACE FUNCTION get_dashboard_kpis(p_since_24h TIMESTAMPTZ, p_since_7d TIMESTAMPTZ)
+RETURNS JSONB AS $$
+    WITH recent_jobs AS (
+        SELECT created_at, status FROM jobs WHERE created_at >= p_since_7d
+    ), recent_consumption AS (
+        SELECT created_at, ABS(delta) AS amount FROM rcc_ledger
+        WHERE reason = 'JOB_RESERVE' AND created_at >= p_since_7d
+    )
+    SELECT jsonb_build_object(
+        'total_users', (SELECT COUNT(*) FROM users),
+        'total_jobs_24h', (SELECT COUNT(*) FROM recent_jobs WHERE created_at >= p_since_24h),
+        'total_jobs_7d', (SELECT COUNT(*) FROM recent_jobs),
+        'failed_jobs_24h', (SELECT COUNT(*) FROM recent_jobs WHERE status = 'failed' AND created_at >= p_since_24h),
+        'rcc_consumed_24h', (SELECT COALESCE(SUM(amount), 0) FROM recent_consumption WHERE created_at >= p_since_24h),
+        'rcc_consumed_7d', (SELECT COALESCE(SUM(amount), 0) FROM recent_consumption)
+    );
+$$ LANGUAGE sql STABLE;
+
+-- GPU usage totals from the rollups of one resolution, optionally for one user (always one row)
+DROP FUNCTION IF EXISTS get_gpu_usage_summary(TIMESTAMPTZ, BIGINT);
+CREATE OR REPLACE FUNCTION get_gpu_usage_summary(p_resolution TEXT, p_since TIMESTAMPTZ, p_user_id BIGINT DEFAULT NULL)
+RETURNS TABLE (
+    total_records BIGINT, total_duration_seconds DOUBLE PRECISION,
+    avg_gpu_utilization DOUBLE PRECISION, avg_memory_utilization DOUBLE PRECISION,
+    peak_memory_mb INTEGER, avg_power_draw_w DOUBLE PRECISION, total_energy_wh DOUBLE PRECISION
+) AS $$
+    SELECT COALESCE(SUM(records), 0)::BIGINT,
+           COALESCE(SUM(duration_seconds), 0),
+           SUM(gpu_utilization_sum) / NULLIF(SUM(gpu_utilization_count), 0),
+           SUM(memory_utilization_sum) / NULLIF(SUM(memory_utilization_count), 0),
+           MAX(peak_memory_mb),
+           SUM(power_draw_sum) / NULLIF(SUM(power_draw_count), 0),
+           COALESCE(SUM(energy_wh), 0)
+    FROM gpu_usage_rollups
+    WHERE resolution = p_resolution AND bucket >= p_since
+      AND (p_user_id IS NULL OR user_id = p_user_id);
+$$ LANGUAGE sql STABLE;
+
+-- GPU usage per user from the rollups of one resolution, heaviest users first
+DROP FUNCTION IF EXISTS get_gpu_usage_by_user(TIMESTAMPTZ);
+CREATE OR REPLACE FUNCTION get_gpu_usage_by_user(p_resolution TEXT, p_since TIMESTAMPTZ)
+RETURNS TABLE (
+    user_id BIGINT, record_count BIGINT, total_duration DOUBLE PRECISION,
+    avg_gpu_util NUMERIC, avg_mem_util NUMERIC, peak_memory INTEGER, total_energy_wh DOUBLE PRECISION
+) AS $$
+    SELECT NULLIF(r.user_id, 0),
+           SUM(r.records)::BIGINT,
+           SUM(r.duration_seconds),
+           COALESCE(ROUND((SUM(r.gpu_utilization_sum) / NULLIF(SUM(r.gpu_utilization_count), 0))::NUMERIC, 1), 0),
+           COALESCE(ROUND((SUM(r.memory_utilization_sum) / NULLIF(SUM(r.memory_utilization_count), 0))::NUMERIC, 1), 0),
+           COALESCE(MAX(r.peak_memory_mb), 0),
+           SUM(r.energy_wh)
+    FROM gpu_usage_rollups r
+    WHERE r.resolution = p_resolution AND r.bucket >= p_since
+    GROUP BY r.user_id
+    ORDER BY 3 DESC;
+$$ LANGUAGE sql STABLE;
+
+-- Usage statistics input: the newest p_limit rows since p_since as one array per column,
+-- so the portal loads them in one call instead of 1000-row pages (NULL ids read as 0)
+CREATE OR REPLACE FUNCTION get_jobs_stat_columns(p_since TIMESTAMPTZ, p_limit INTEGER)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'id', COALESCE(jsonb_agg(id), '[]'),
+        'type', COALESCE(jsonb_agg(type), '[]'),
+        'user_id', COALESCE(jsonb_agg(COALESCE(user_id, 0)), '[]'),
+        'duration_ms', COALESCE(jsonb_agg(duration_ms), '[]')
+    )
+    FROM (
+        SELECT id, type, user_id, duration_ms FROM jobs
+        WHERE created_at >= p_since ORDER BY id DESC LIMIT p_limit
+    ) recent;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION get_gpu_usage_stat_columns(p_since TIMESTAMPTZ, p_limit INTEGER)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'job_id', COALESCE(jsonb_agg(COALESCE(job_id, 0)), '[]'),
+        'user_id', COALESCE(jsonb_agg(COALESCE(user_id, 0)), '[]'),
+        'gpu_utilization', COALESCE(jsonb_agg(gpu_utilization), '[]'),
+        'memory_used_mb', COALESCE(jsonb_agg(memory_used_mb), '[]')
+    )
+    FROM (
+        SELECT job_id, user_id, gpu_utilization, memory_used_mb FROM gpu_usage
+        WHERE recorded_at >= p_since ORDER BY id DESC LIMIT p_limit
+    ) recent;
+$$ LANGUAGE sql STABLE;
+
+-- SECURITY DEFINER RPCs bypass RLS and write credits: only the portal's service_role
+-- key may call them (functions are executable by PUBLIC, anon and authenticated by default)
+REVOKE EXECUTE ON FUNCTION debit_rcc_if_sufficient(BIGINT, INTEGER, TEXT, BIGINT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION create_job_with_reserve(BIGINT, TEXT, INTEGER, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION rebuild_user_balances() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION compact_ledger_checkpoints(INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION rebuild_ledger_checkpoints(INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION debit_rcc_if_sufficient(BIGINT, INTEGER, TEXT, BIGINT) TO service_role;
+GRANT EXECUTE ON FUNCTION create_job_with_reserve(BIGINT, TEXT, INTEGER, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION rebuild_user_balances() TO service_role;
+GRANT EXECUTE ON FUNCTION compact_ledger_checkpoints(INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION rebuild_ledger_checkpoints(INTEGER) TO service_role;
+
+-- Backfill the projection from the ledger (safe to re-run)
+SELECT rebuild_user_balances();
+
+-- Backfill GPU usage rollups once, for gpu_usage rows written before they existed
+SELECT add_gpu_usage_rollups(ARRAY(SELECT g FROM gpu_usage g))
+WHERE NOT EXISTS (SELECT 1 FROM gpu_usage_rollups);
+
 -- =============================================
 -- Sample Data (Optional - for testing)
 -- =============================================
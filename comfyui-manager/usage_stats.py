@@ -0,0 +1,222 @@
+"""
+Usage statistics for ComfyUI Manager
+Job and GPU usage columns are loaded into NumPy arrays; percentiles, histograms
+and per-group aggregates are computed in vectorized passes (one sort per metric,
+no per-row Python loop), so millions of rows take a fraction of a second.
+"""
+
+import os
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database import db
+
+load_dotenv()
+
+PERCENTILES = (50, 95, 99)
+HISTOGRAM_BINS = 20
+# Newest rows loaded per table for one statistics request (loading, not the NumPy pass,
+# dominates the request time)
+STATS_MAX_ROWS = int(os.getenv("STATS_MAX_ROWS", "100000"))
+# Users listed per metric (most rows first)
+STATS_TOP_USERS = 50
+# Group ids below this are encoded with a bincount table instead of a sort
+DENSE_KEY_LIMIT = 1 << 20
+# Strings are encoded label by label while there are at most this many distinct ones
+FEW_LABELS = 32
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0.0 when empty); for small lists"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _float_column(values) -> np.ndarray:
+    """float64 array; None becomes NaN"""
+    return np.asarray(values, dtype=np.float64)
+
+
+def _int_column(values, missing: int = 0) -> np.ndarray:
+    """int64 array; None becomes `missing`"""
+    return np.nan_to_num(_float_column(values), nan=missing).astype(np.int64)
+
+
+def encode(groups: np.ndarray) -> tuple:
+    """
+    (labels, codes): the distinct groups and each row's index into labels.
+    Non-negative ids below DENSE_KEY_LIMIT use a bincount table and strings are
+    matched one label at a time (job types are few); both avoid sorting the column.
+    """
+    if not len(groups):
+        return groups[:0], np.zeros(0, dtype=np.int64)
+    if groups.dtype.kind in "iu" and groups.min() >= 0 and groups.max() < DENSE_KEY_LIMIT:
+        present = np.bincount(groups) > 0
+        return np.flatnonzero(present), (np.cumsum(present) - 1)[groups]
+    if groups.dtype.kind == "U":
+        labels = []
+        codes = np.full(len(groups), -1, dtype=np.int64)
+        unassigned = np.arange(len(groups))
+        while len(unassigned) and len(labels) < FEW_LABELS:
+            codes[groups == groups[unassigned[0]]] = len(labels)
+            labels.append(groups[unassigned[0]])
+            unassigned = unassigned[codes[unassigned] < 0]
+        if not len(unassigned):
+            return np.array(labels), codes
+    return np.unique(groups, return_inverse=True)
+
+
+def lookup(keys: np.ndarray, values: np.ndarray, wanted: np.ndarray, default) -> np.ndarray:
+    """values[i] for the keys[i] equal to each wanted key (a vectorized join), else default"""
+    result = np.full(len(wanted), default, dtype=np.result_type(values, np.asarray(default)))
+    if not len(keys):
+        return result
+    if keys.min() >= 0 and keys.max() < max(DENSE_KEY_LIMIT, 4 * len(keys)):
+        # Ids (autoincrement) index a table directly: no sort, no search
+        table = np.full(int(keys.max()) + 1, -1, dtype=np.int64)
+        table[keys] = np.arange(len(keys))
+        known = (wanted >= 0) & (wanted < len(table))
+        positions = np.full(len(wanted), -1, dtype=np.int64)
+        positions[known] = table[wanted[known]]
+        found = positions >= 0
+        result[found] = values[positions[found]]
+        return result
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    positions = np.clip(np.searchsorted(sorted_keys, wanted), 0, len(sorted_keys) - 1)
+    found = sorted_keys[positions] == wanted
+    result[found] = values[order][positions[found]]
+    return result
+
+
+def group_stats(labels: np.ndarray, codes: np.ndarray, values: np.ndarray,
+                limit: Optional[int] = None) -> Dict[Any, Dict[str, float]]:
+    """
+    count, mean, min, max and nearest-rank PERCENTILES of integer values per group.
+    Each row packs into one int64 key (group code, value), so a single np.sort orders
+    rows by group and by value at once; every group is then a contiguous sorted slice.
+    With `limit`, only the groups with the most values.
+    """
+    if not len(values):
+        return {}
+    low = values.min()
+    width = int(values.max() - low) + 1
+    if len(labels) == 1:
+        grouped = np.sort(values)
+        value_at = grouped.__getitem__
+    elif len(labels) * width < 1 << 62:
+        grouped = codes * width
+        grouped += values
+        grouped.sort()
+        # Only the few selected keys are unpacked back into values
+        value_at = lambda index: (grouped[index] - low) % width + low  # noqa: E731
+    else:
+        grouped = values[np.lexsort((values, codes))]
+        value_at = grouped.__getitem__
+    if len(labels) == 1:
+        counts, sums = np.array([len(values)]), np.array([values.sum()], dtype=np.float64)
+    else:
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = np.bincount(codes, weights=values, minlength=len(labels))
+    starts = np.cumsum(counts) - counts
+    present = np.flatnonzero(counts)
+    counts, sums, starts = counts[present], sums[present], starts[present]
+    columns = {
+        "count": counts,
+        "mean": sums / counts,
+        "min": value_at(starts),
+        "max": value_at(starts + counts - 1),
+    }
+    for pct in PERCENTILES:
+        ranks = np.clip(np.round(pct / 100 * counts).astype(np.int64) - 1, 0, counts - 1)
+        columns[f"p{pct}"] = value_at(starts + ranks)
+
+    selected = np.argsort(-counts, kind="stable")[:limit] if limit else range(len(present))
+    return {
+        labels[present[i]].item(): {
+            name: int(column[i]) if name == "count" else round(float(column[i]), 2)
+            for name, column in columns.items()
+        }
+        for i in selected
+    }
+
+
+def histogram(values: np.ndarray, value_range: tuple, bins: int = HISTOGRAM_BINS) -> Dict[str, List]:
+    """Bin edges and counts over value_range; values outside it are counted in the first/last bin"""
+    if not len(values):
+        return {"edges": [], "counts": []}
+    low, high = value_range
+    high = high if high > low else low + 1
+    indices = ((values - low) * (bins / (high - low))).astype(np.int64)
+    counts = np.bincount(np.clip(indices, 0, bins - 1), minlength=bins)
+    return {"edges": np.round(np.linspace(low, high, bins + 1), 2).tolist(), "counts": counts.tolist()}
+
+
+def metric_stats(values: np.ndarray, groupings: Dict[str, tuple],
+                 value_range: Optional[tuple] = None) -> Dict[str, Any]:
+    """
+    Overall summary, histogram and group_stats for each grouping ((labels, codes) by name)
+    of an integer metric; NaN (NULL) values are skipped. Without a value_range the
+    histogram spans min..p99, so one outlier does not flatten it.
+    """
+    valid = ~np.isnan(values)
+    if valid.all():
+        valid = slice(None)
+    values = np.rint(values[valid]).astype(np.int64)
+    overall = group_stats(np.zeros(1, dtype=np.int64), np.zeros(len(values), dtype=np.int64), values).get(0)
+    if overall is None:
+        return {"overall": {"count": 0}, "histogram": histogram(values, (0, 0)), **{name: {} for name in groupings}}
+    stats = {
+        "overall": overall,
+        "histogram": histogram(values, value_range or (overall["min"], overall["p99"])),
+    }
+    for name, (labels, codes) in groupings.items():
+        limit = STATS_TOP_USERS if name == "by_user" else None
+        stats[name] = group_stats(labels, codes[valid], values, limit=limit)
+    return stats
+
+
+def compute_usage_stats(jobs: Dict[str, Any], gpu: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Percentiles, histograms and per job type / per user aggregates of job duration_ms
+    and of gpu_usage utilisation and memory. Inputs are columns (arrays, or lists) as
+    returned by db.get_job_stat_columns / db.get_gpu_usage_stat_columns.
+    """
+    started = time.perf_counter()
+    job_ids = _int_column(jobs["id"])
+    type_labels, job_types = encode(np.asarray(jobs["type"], dtype=str))
+    job_users = encode(_int_column(jobs["user_id"]))
+
+    # gpu_usage rows take the type of their job (manual entries and older jobs are "unknown")
+    type_labels = np.append(type_labels, "unknown")
+    gpu_types = lookup(job_ids, job_types, _int_column(gpu["job_id"]), len(type_labels) - 1)
+    gpu_groupings = {"by_type": (type_labels, gpu_types), "by_user": encode(_int_column(gpu["user_id"]))}
+    return {
+        "jobs": len(job_ids),
+        "gpu_records": len(gpu_types),
+        "duration_ms": metric_stats(_float_column(jobs["duration_ms"]),
+                                    {"by_type": (type_labels, job_types), "by_user": job_users}),
+        "gpu_utilization": metric_stats(_float_column(gpu["gpu_utilization"]), gpu_groupings, (0, 100)),
+        "memory_used_mb": metric_stats(_float_column(gpu["memory_used_mb"]), gpu_groupings),
+        "compute_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+async def get_usage_stats(days: float = 7) -> Dict[str, Any]:
+    """Load the window's columns and compute their statistics off the event loop"""
+    since = datetime.utcnow() - timedelta(days=days)
+    jobs, gpu = await asyncio.gather(
+        db.get_job_stat_columns(since, STATS_MAX_ROWS),
+        db.get_gpu_usage_stat_columns(since, STATS_MAX_ROWS)
+    )
+    stats = await asyncio.to_thread(compute_usage_stats, jobs, gpu)
+    stats["days"] = days
+    stats["truncated"] = max(stats["jobs"], stats["gpu_records"]) >= STATS_MAX_ROWS
+    return stats
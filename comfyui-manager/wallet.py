@@ -10,13 +10,14 @@ Handles all Ranch Cloud Credits operations including:
 
 import os
 import json
-from typing import Optional, Dict, Any
+import asyncio
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 from fastapi import HTTPException, status
 from dotenv import load_dotenv
 
-from database import db, RCCReason, JobType
+from database import db, page_cursors, RCCReason, JobType
 
 load_dotenv()
 
@@ -164,14 +165,22 @@ def should_charge_on_completion() -> bool:
 async def get_balance(user_id: int) -> int:
     """
     Get the current RCC balance for a user.
-    Calculated as the sum of all ledger entries (source of truth).
+    Read from the user_balances projection, which is kept in sync
+    with the ledger (source of truth) on every ledger insert.
     """
     return await db.get_user_rcc_balance(user_id)
 
 
+async def get_balances(user_ids: List[int]) -> Dict[int, int]:
+    """Get RCC balances for many users with a single query (user_id -> balance)"""
+    return await db.get_balances(user_ids)
+
+
 async def check_sufficient_balance(user_id: int, required: int) -> bool:
     """
     Check if user has sufficient RCC balance for an operation.
+    Informational only - use reserve_rcc / charge_on_completion to debit,
+    since they check and debit atomically.
     """
     balance = await get_balance(user_id)
     return balance >= required
@@ -185,7 +194,7 @@ async def reserve_rcc(user_id: int, job_id: int, job_type: JobType, is_admin: bo
     - Non-admin: creates ledger entry with JOB_RESERVE (negative delta)
     - Admin: creates ledger entry with ADMIN_BYPASS (delta=0)
     
-    Returns the ledger entry.
+    Returns the ledger entry (None for a free job type).
     Raises HTTPException if insufficient balance (non-admin only).
     """
     cost = get_job_cost(job_type)
@@ -200,23 +209,54 @@ async def reserve_rcc(user_id: int, job_id: int, job_type: JobType, is_admin: bo
         )
         return entry
     
-    # Check balance for non-admin
-    balance = await get_balance(user_id)
-    if balance < cost:
+    if cost == 0:
+        # Free job type (base_cost 0): nothing to reserve
+        return None
+    
+    # Check balance and debit RCC (negative delta) in one atomic operation
+    result = await db.debit_rcc_if_sufficient(
+        user_id=user_id,
+        amount=cost,
+        reason=RCCReason.JOB_RESERVE,
+        job_id=job_id
+    )
+    if not result["success"]:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Insufficient RCC balance. Required: {cost}, Available: {balance}"
+            detail=f"Insufficient RCC balance. Required: {cost}, Available: {result['balance']}"
         )
     
-    # Debit RCC (negative delta)
-    entry = await db.add_rcc_entry(
+    return result["entry"]
+
+
+async def create_reserved_job(user_id: int, job_type: JobType, metadata: Optional[str] = None) -> dict:
+    """
+    Create a job and reserve its RCC cost in a single database transaction.
+    
+    Used for non-admin jobs when charge_mode is "on_creation": the job row
+    and the JOB_RESERVE ledger entry are written together, or not at all.
+    
+    Returns the created job.
+    Raises HTTPException if insufficient balance.
+    """
+    cost = get_job_cost(job_type)
+    if cost == 0:
+        # Free job type (base_cost 0): nothing to reserve
+        return await db.create_job(user_id=user_id, job_type=job_type, cost_rcc=0, metadata=metadata)
+    
+    result = await db.create_job_with_reserve(
         user_id=user_id,
-        delta=-cost,
-        reason=RCCReason.JOB_RESERVE,
-        job_id=job_id
+        job_type=job_type,
+        cost_rcc=cost,
+        metadata=metadata
     )
+    if not result["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient RCC balance. Required: {cost}, Available: {result['balance']}"
+        )
     
-    return entry
+    return result["job"]
 
 
 async def release_rcc(user_id: int, job_id: int, cost: int) -> dict:
@@ -273,24 +313,23 @@ async def charge_on_completion(user_id: int, job_id: int, job_type: JobType, is_
         return entry
     
     cost = get_job_cost(job_type)
+    if cost == 0:
+        return None
     
-    # Check balance
-    balance = await get_balance(user_id)
-    if balance < cost:
-        raise HTTPException(
-            status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Insufficient RCC balance for task completion. Required: {cost}, Available: {balance}"
-        )
-    
-    # Debit RCC for completed task
-    entry = await db.add_rcc_entry(
+    # Check balance and debit RCC for completed task in one atomic operation
+    result = await db.debit_rcc_if_sufficient(
         user_id=user_id,
-        delta=-cost,
+        amount=cost,
         reason=RCCReason.JOB_RESERVE,  # Using same reason for now, could add JOB_COMPLETE
         job_id=job_id
     )
+    if not result["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient RCC balance for task completion. Required: {cost}, Available: {result['balance']}"
+        )
     
-    return entry
+    return result["entry"]
 
 
 async def process_task_completion(
@@ -410,28 +449,63 @@ async def manual_adjust_rcc(user_id: int, delta: int, admin_user_id: int, reason
     await db.add_log(
         action="rcc_manual_adjust",
         user_id=admin_user_id,
-        details=f"Adjusted user {user_id} RCC by {delta}. Reason: {reason or 'not specified'}"
+        details=f"Adjusted user {user_id} RCC by {delta}. Reason: {reason or 'not specified'}",
+        sync=True
     )
     
     return entry
 
 
-async def get_rcc_history(user_id: int, limit: int = 50, offset: int = 0) -> dict:
+async def get_rcc_history(user_id: int, limit: int = 50, offset: int = 0,
+                          cursor: Optional[str] = None) -> dict:
     """
     Get RCC transaction history for a user.
     
     Returns:
-        dict with entries list and current balance
+        dict with entries list, current balance and next/prev page cursors
+    
+    Raises:
+        HTTPException 400 if the cursor is malformed
     """
-    entries = await db.get_user_rcc_history(user_id, limit=limit, offset=offset)
+    try:
+        entries = await db.get_user_rcc_history(user_id, limit=limit, offset=offset, cursor=cursor)
+        cursors = page_cursors(entries, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     balance = await get_balance(user_id)
     
     return {
         "entries": entries,
-        "balance": balance
+        "balance": balance,
+        **cursors
     }
 
 
+# ============================================
+# Ledger Checkpoint Compactor
+# ============================================
+# Periodically writes per-user checkpoints (balance as of ledger id N) so
+# history queries only sum the deltas since the nearest checkpoint.
+
+LEDGER_CHECKPOINT_EVERY = int(os.getenv("LEDGER_CHECKPOINT_EVERY", "1000"))  # entries per checkpoint
+LEDGER_COMPACT_INTERVAL = int(os.getenv("LEDGER_COMPACT_INTERVAL", "300"))  # seconds between runs
+
+
+async def run_ledger_compactor():
+    """
+    Background task: checkpoint every user with LEDGER_CHECKPOINT_EVERY
+    or more ledger entries since their last checkpoint.
+    """
+    while True:
+        try:
+            written = await db.compact_ledger_checkpoints(min_entries=LEDGER_CHECKPOINT_EVERY)
+            if written:
+                print(f"[INFO] Ledger compactor wrote {written} checkpoint(s)")
+        except Exception as e:
+            print(f"[WARNING] Ledger compaction failed: {e}")
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+
+
 # ============================================
 # Top-up Pack Definitions
 # ============================================